@@ -0,0 +1,1435 @@
+#!/usr/bin/env python3
+#
+# faux-gnome-screensaver-bench.py
+# This file is part of faux-gnome-screensaver
+#
+# Copyright (C) 2012-2013 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/faux-gnome-screensaver
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Runs faux-gnome-screensaver against private session and system buses,
+# fake gnome-session / logind / ConsoleKit services and the stand-in
+# executables in stubs/, and prints the results as JSON.
+
+from gi.repository import GLib, Gio
+import collections
+import importlib.util
+import json
+import optparse
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STUBS_DIR = os.path.join(BENCH_DIR, 'stubs')
+DAEMON = os.path.join(os.path.dirname(BENCH_DIR), 'faux-gnome-screensaver.py')
+COMMAND = os.path.join(os.path.dirname(BENCH_DIR), 'faux-gnome-screensaver-command.py')
+# where the real xscreensaver and Xvfb are found
+HOST_PATH = os.environ.get('PATH', os.defpath)
+
+RESULTS_VERSION = 1
+
+# XScreenSaverManager.COMMAND_TIMEOUT, after which a stuck command is killed
+COMMAND_TIMEOUT = 5 # in seconds
+
+GS_SERVICE = 'org.gnome.ScreenSaver'
+GS_PATH = '/org/gnome/ScreenSaver'
+GS_INTERFACE = 'org.gnome.ScreenSaver'
+FGS_INTERFACE = 'com.github.jefferyto.FauxGnomeScreensaver'
+
+DBUS_SERVICE = 'org.freedesktop.DBus'
+DBUS_PATH = '/org/freedesktop/DBus'
+DBUS_INTERFACE = 'org.freedesktop.DBus'
+DBUS_INTERFACE_PROPERTIES = 'org.freedesktop.DBus.Properties'
+
+# no service directories, so nothing from the host can be activated
+BUS_CONFIG = '''<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+	<type>%(type)s</type>
+	<listen>unix:path=%(path)s</listen>
+	<auth>EXTERNAL</auth>
+	<policy context="default">
+		<allow send_destination="*" eavesdrop="true"/>
+		<allow eavesdrop="true"/>
+		<allow own="*"/>
+	</policy>
+</busconfig>
+'''
+
+# just the keys that GSettingsManager looks at
+SCHEMAS = '''<schemalist>
+	<schema id="org.gnome.desktop.screensaver" path="/org/gnome/desktop/screensaver/">
+		<key name="idle-activation-enabled" type="b"><default>true</default></key>
+	</schema>
+	<schema id="org.gnome.desktop.session" path="/org/gnome/desktop/session/">
+		<key name="idle-delay" type="u"><default>300</default></key>
+	</schema>
+	<schema id="org.gnome.settings-daemon.plugins.power" path="/org/gnome/settings-daemon/plugins/power/">
+		<key name="sleep-display-ac" type="i"><default>600</default></key>
+		<key name="sleep-display-battery" type="i"><default>600</default></key>
+	</schema>
+</schemalist>
+'''
+
+XSCREENSAVER_OPTIONS = 'timeout:\t0:10:00\nlock:\t\tFalse\n'
+
+GSM_XML = '''
+<node>
+	<interface name="org.gnome.SessionManager">
+		<method name="IsInhibited">
+			<arg name="flags" type="u" direction="in"/>
+			<arg name="is_inhibited" type="b" direction="out"/>
+		</method>
+		<method name="GetInhibitors">
+			<arg name="inhibitors" type="ao" direction="out"/>
+		</method>
+		<signal name="InhibitorAdded">
+			<arg name="id" type="o"/>
+		</signal>
+		<signal name="InhibitorRemoved">
+			<arg name="id" type="o"/>
+		</signal>
+	</interface>
+</node>
+'''
+
+GSM_INHIBITOR_XML = '''
+<node>
+	<interface name="org.gnome.SessionManager.Inhibitor">
+		<method name="GetFlags">
+			<arg name="flags" type="u" direction="out"/>
+		</method>
+	</interface>
+</node>
+'''
+
+LOGIND_XML = '''
+<node>
+	<interface name="org.freedesktop.login1.Manager">
+		<method name="GetSession">
+			<arg name="session_id" type="s" direction="in"/>
+			<arg name="session" type="o" direction="out"/>
+		</method>
+		<method name="GetSessionByPID">
+			<arg name="pid" type="u" direction="in"/>
+			<arg name="session" type="o" direction="out"/>
+		</method>
+		<method name="Inhibit">
+			<arg name="what" type="s" direction="in"/>
+			<arg name="who" type="s" direction="in"/>
+			<arg name="why" type="s" direction="in"/>
+			<arg name="mode" type="s" direction="in"/>
+			<arg name="pipe_fd" type="h" direction="out"/>
+		</method>
+		<signal name="PrepareForSleep">
+			<arg name="start" type="b"/>
+		</signal>
+	</interface>
+</node>
+'''
+
+LOGIND_SESSION_XML = '''
+<node>
+	<interface name="org.freedesktop.login1.Session">
+		<signal name="Lock"/>
+		<signal name="Unlock"/>
+	</interface>
+	<interface name="org.freedesktop.DBus.Properties">
+		<method name="Get">
+			<arg name="interface_name" type="s" direction="in"/>
+			<arg name="property_name" type="s" direction="in"/>
+			<arg name="value" type="v" direction="out"/>
+		</method>
+		<signal name="PropertiesChanged">
+			<arg name="interface_name" type="s"/>
+			<arg name="changed_properties" type="a{sv}"/>
+			<arg name="invalidated_properties" type="as"/>
+		</signal>
+	</interface>
+</node>
+'''
+
+CK_XML = '''
+<node>
+	<interface name="org.freedesktop.ConsoleKit.Manager">
+		<method name="GetCurrentSession">
+			<arg name="ssid" type="o" direction="out"/>
+		</method>
+	</interface>
+</node>
+'''
+
+CK_SESSION_XML = '''
+<node>
+	<interface name="org.freedesktop.ConsoleKit.Session">
+		<signal name="Lock"/>
+		<signal name="Unlock"/>
+		<signal name="ActiveChanged">
+			<arg name="is_active" type="b"/>
+		</signal>
+	</interface>
+</node>
+'''
+
+
+class BenchError(Exception):
+	pass
+
+
+def wait_until(predicate, timeout, interval=1):
+	# run the main loop until predicate() is true, checking at least every
+	# interval milliseconds
+	context = GLib.MainContext.default()
+	tick_id = GLib.timeout_add(interval, lambda: True)
+	deadline = time.monotonic() + timeout
+	try:
+		while not predicate():
+			if time.monotonic() > deadline:
+				raise BenchError("Timed out after %d seconds" % timeout)
+			context.iteration(True)
+	finally:
+		GLib.source_remove(tick_id)
+
+
+def stats(values):
+	# in milliseconds
+	if not values:
+		return {'n': 0}
+	values = sorted(v * 1000 for v in values)
+	n = len(values)
+
+	def percentile(p):
+		return values[min(n - 1, int(round(p / 100.0 * (n - 1))))]
+
+	return {
+		'n': n,
+		'min': values[0],
+		'median': percentile(50),
+		'p90': percentile(90),
+		'p99': percentile(99),
+		'max': values[-1],
+		'mean': sum(values) / n
+	}
+
+
+def process_usage(pid):
+	# resident memory in kB and CPU time in seconds
+	with open('/proc/%d/status' % pid) as f:
+		rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+	with open('/proc/%d/stat' % pid) as f:
+		# the command name may contain spaces
+		fields = f.read().rsplit(')', 1)[1].split()
+	cpu = (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+	return rss, cpu
+
+
+class Bus(object):
+	def __init__(self, bus_type, work_dir):
+		self.path = os.path.join(work_dir, bus_type + '_bus')
+		config_path = os.path.join(work_dir, bus_type + '_bus.conf')
+		with open(config_path, 'w') as f:
+			f.write(BUS_CONFIG % {'type': bus_type, 'path': self.path})
+
+		self._process = subprocess.Popen(['dbus-daemon', '--config-file=' + config_path, '--nofork', '--print-address'], stdout=subprocess.PIPE)
+		self.address = self._process.stdout.readline().decode().strip()
+		if not self.address:
+			raise BenchError("Cannot start %s bus" % bus_type)
+		self.connection = self.connect()
+
+	def connect(self):
+		flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+		return Gio.DBusConnection.new_for_address_sync(self.address, flags, None, None)
+
+	def own_name(self, name):
+		# DBUS_NAME_FLAG_DO_NOT_QUEUE
+		self.connection.call_sync(DBUS_SERVICE, DBUS_PATH, DBUS_INTERFACE, 'RequestName', GLib.Variant('(su)', (name, 4)), None, Gio.DBusCallFlags.NONE, -1, None)
+
+	def has_owner(self, name):
+		return self.connection.call_sync(DBUS_SERVICE, DBUS_PATH, DBUS_INTERFACE, 'NameHasOwner', GLib.Variant('(s)', (name,)), None, Gio.DBusCallFlags.NONE, -1, None).unpack()[0]
+
+	def close(self):
+		self.connection.close_sync(None)
+		self._process.terminate()
+		self._process.wait()
+
+
+class FakeObject(object):
+	# a D-Bus object whose methods are answered by python callables, which
+	# return a GLib.Variant, None, or a (GLib.Variant, Gio.UnixFDList) pair
+	def __init__(self, connection, path, xml, methods=None):
+		self.path = path
+		self.calls = collections.Counter()
+		self._connection = connection
+		self._methods = methods or {}
+		node_info = Gio.DBusNodeInfo.new_for_xml(xml)
+		self._registration_ids = [connection.register_object_with_closures(path, i, self._method_call, None, None) for i in node_info.interfaces]
+
+	def _method_call(self, connection, sender, path, interface_name, method_name, parameters, invocation):
+		self.calls[method_name] += 1
+		handler = self._methods.get(method_name)
+		if handler is None:
+			invocation.return_dbus_error('org.freedesktop.DBus.Error.UnknownMethod', "No such method %s" % method_name)
+			return
+		result = handler(*parameters.unpack())
+		if isinstance(result, tuple):
+			invocation.return_value_with_unix_fd_list(*result)
+		else:
+			invocation.return_value(result)
+
+	def emit(self, interface_name, signal_name, parameters=None):
+		self._connection.emit_signal(None, self.path, interface_name, signal_name, parameters)
+
+	def close(self):
+		for registration_id in self._registration_ids:
+			self._connection.unregister_object(registration_id)
+		self._registration_ids = []
+
+
+class FakeGnomeSession(object):
+	SERVICE = 'org.gnome.SessionManager'
+	PATH = '/org/gnome/SessionManager'
+	INTERFACE = 'org.gnome.SessionManager'
+
+	def __init__(self, bus):
+		self._bus = bus
+		self._inhibitors = collections.OrderedDict()
+		self._next_id = 1
+		self.manager = FakeObject(bus.connection, self.PATH, GSM_XML, {
+			'IsInhibited': lambda flags: GLib.Variant('(b)', (any(f & flags for f in self._inhibitors.values()),)),
+			'GetInhibitors': lambda: GLib.Variant('(ao)', (list(self._inhibitors),))
+		})
+		self._objects = {}
+		bus.own_name(self.SERVICE)
+
+	def add_inhibitor(self, flags, path=None, emit=True):
+		if path is None:
+			path = '%s/Inhibitor%d' % (self.PATH, self._next_id)
+			self._next_id += 1
+		self._inhibitors[path] = flags
+		self._objects[path] = FakeObject(self._bus.connection, path, GSM_INHIBITOR_XML, {
+			'GetFlags': lambda: GLib.Variant('(u)', (flags,))
+		})
+		if emit:
+			self.manager.emit(self.INTERFACE, 'InhibitorAdded', GLib.Variant('(o)', (path,)))
+		return path
+
+	def remove_inhibitor(self, path):
+		del self._inhibitors[path]
+		self._objects.pop(path).close()
+		self.manager.emit(self.INTERFACE, 'InhibitorRemoved', GLib.Variant('(o)', (path,)))
+
+
+class FakeLogind(object):
+	SERVICE = 'org.freedesktop.login1'
+	PATH = '/org/freedesktop/login1'
+	INTERFACE = 'org.freedesktop.login1.Manager'
+	SESSION_PATH = '/org/freedesktop/login1/session/_1'
+	SESSION_INTERFACE = 'org.freedesktop.login1.Session'
+
+	def __init__(self, bus):
+		self._bus = bus
+		self.active = True
+		# read ends of the inhibitor pipes, and when each was closed
+		self.inhibitors = {}
+		self.released = []
+		# sessions other than the default one, by id, and the session each
+		# daemon pid is in
+		self.sessions = {}
+		self.pids = {}
+		self.manager = FakeObject(bus.connection, self.PATH, LOGIND_XML, {
+			'GetSession': lambda session_id: GLib.Variant('(o)', (self.sessions[session_id].path,)),
+			'GetSessionByPID': lambda pid: GLib.Variant('(o)', (self.pids.get(pid, self.SESSION_PATH),)),
+			'Inhibit': self._inhibit
+		})
+		self.session = FakeObject(bus.connection, self.SESSION_PATH, LOGIND_SESSION_XML, {
+			'Get': self._get
+		})
+		bus.own_name(self.SERVICE)
+
+	def add_session(self, session_id):
+		path = '%s/session/%s' % (self.PATH, session_id)
+		self.sessions[session_id] = FakeObject(self._bus.connection, path, LOGIND_SESSION_XML, {
+			'Get': self._get
+		})
+		return path
+
+	def remove_session(self, session_id):
+		self.sessions.pop(session_id).close()
+
+	def _get(self, interface_name, property_name):
+		return GLib.Variant('(v)', (GLib.Variant('b', self.active),))
+
+	def _inhibit(self, what, who, why, mode):
+		# like logind, notice the inhibitor being released by the other end
+		# of the pipe being closed
+		read_fd, write_fd = os.pipe()
+		fd_list = Gio.UnixFDList.new()
+		index = fd_list.append(write_fd)
+		os.close(write_fd)
+		self.inhibitors[read_fd] = (what, who, why, mode)
+		GLib.io_add_watch(read_fd, GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._inhibitor_released)
+		return GLib.Variant('(h)', (index,)), fd_list
+
+	def _inhibitor_released(self, fd, condition):
+		self.released.append(time.monotonic())
+		del self.inhibitors[fd]
+		os.close(fd)
+		return False
+
+	def _session(self, session_id):
+		return self.sessions[session_id] if session_id is not None else self.session
+
+	def lock(self, session_id=None):
+		self._session(session_id).emit(self.SESSION_INTERFACE, 'Lock')
+
+	def unlock(self, session_id=None):
+		self._session(session_id).emit(self.SESSION_INTERFACE, 'Unlock')
+
+	def set_active(self, active, session_id=None):
+		self.active = active
+		self._session(session_id).emit(DBUS_INTERFACE_PROPERTIES, 'PropertiesChanged', GLib.Variant('(sa{sv}as)', (self.SESSION_INTERFACE, {'Active': GLib.Variant('b', active)}, [])))
+
+	def prepare_for_sleep(self, start):
+		self.manager.emit(self.INTERFACE, 'PrepareForSleep', GLib.Variant('(b)', (start,)))
+
+
+class FakeConsoleKit(object):
+	SERVICE = 'org.freedesktop.ConsoleKit'
+	MANAGER_PATH = '/org/freedesktop/ConsoleKit/Manager'
+	SESSION_PATH = '/org/freedesktop/ConsoleKit/Session1'
+	SESSION_INTERFACE = 'org.freedesktop.ConsoleKit.Session'
+
+	def __init__(self, bus):
+		self.manager = FakeObject(bus.connection, self.MANAGER_PATH, CK_XML, {
+			'GetCurrentSession': lambda: GLib.Variant('(o)', (self.SESSION_PATH,))
+		})
+		self.session = FakeObject(bus.connection, self.SESSION_PATH, CK_SESSION_XML)
+		bus.own_name(self.SERVICE)
+
+	def lock(self):
+		self.session.emit(self.SESSION_INTERFACE, 'Lock')
+
+
+class BenchEnvironment(object):
+	def __init__(self, options):
+		self._options = options
+		self.debug = options.debug
+		self._daemon = None
+		self._daemon_log = None
+		self.state = {}
+		self.active_changes = 0
+		self.work_dir = tempfile.mkdtemp(prefix='fgs-bench-')
+
+		for d in ['home', 'runtime', 'schemas', 'watchers']:
+			os.mkdir(os.path.join(self.work_dir, d), 0o700)
+		with open(os.path.join(self.work_dir, 'home', '.xscreensaver'), 'w') as f:
+			f.write(XSCREENSAVER_OPTIONS)
+		schemas_dir = os.path.join(self.work_dir, 'schemas')
+		with open(os.path.join(schemas_dir, 'fgs-bench.gschema.xml'), 'w') as f:
+			f.write(SCHEMAS)
+		subprocess.check_call(['glib-compile-schemas', schemas_dir])
+
+		self.session_bus = Bus('session', self.work_dir)
+		self.system_bus = Bus('system', self.work_dir)
+		self.gnome_session = FakeGnomeSession(self.session_bus)
+		self.logind = FakeLogind(self.system_bus)
+		self.console_kit = FakeConsoleKit(self.system_bus)
+
+		self._subscription_ids = [
+			self.session_bus.connection.signal_subscribe(GS_SERVICE, DBUS_INTERFACE_PROPERTIES, 'PropertiesChanged', GS_PATH, FGS_INTERFACE, Gio.DBusSignalFlags.NONE, self._properties_changed),
+			self.session_bus.connection.signal_subscribe(GS_SERVICE, GS_INTERFACE, 'ActiveChanged', GS_PATH, None, Gio.DBusSignalFlags.NONE, self._active_changed)
+		]
+
+		self.env = dict(os.environ)
+		self.env.pop('DISPLAY', None)
+		self.env.update({
+			'PATH': STUBS_DIR + os.pathsep + os.environ.get('PATH', ''),
+			'HOME': os.path.join(self.work_dir, 'home'),
+			'XDG_RUNTIME_DIR': os.path.join(self.work_dir, 'runtime'),
+			'DBUS_SESSION_BUS_ADDRESS': self.session_bus.address,
+			'DBUS_SYSTEM_BUS_ADDRESS': self.system_bus.address,
+			'GSETTINGS_BACKEND': 'memory',
+			'GSETTINGS_SCHEMA_DIR': schemas_dir,
+			'FGS_BENCH_DIR': self.work_dir
+		})
+
+	def _properties_changed(self, connection, sender, path, interface, signal, parameters, *user_data):
+		interface_name, changed, invalidated = parameters.unpack()
+		self.state.update(changed)
+
+	def _active_changed(self, connection, sender, path, interface, signal, parameters, *user_data):
+		self.active_changes += 1
+
+	def close(self):
+		self.stop_daemon()
+		for subscription_id in self._subscription_ids:
+			self.session_bus.connection.signal_unsubscribe(subscription_id)
+		self.session_bus.close()
+		self.system_bus.close()
+		if self._options.keep:
+			sys.stderr.write("Keeping %s\n" % self.work_dir)
+		else:
+			shutil.rmtree(self.work_dir, ignore_errors=True)
+
+	def start_daemon(self, args=(), env=None):
+		for name in ['state', 'xscreensaver.pid']:
+			try:
+				os.remove(os.path.join(self.work_dir, name))
+			except OSError:
+				pass
+		self.state = {}
+		self._daemon_log = open(os.path.join(self.work_dir, 'daemon.log'), 'a')
+		argv = [sys.executable, DAEMON] + (['--debug'] if self._options.debug else []) + list(args)
+		self._daemon = subprocess.Popen(argv, env=env or self.env, stdout=self._daemon_log, stderr=subprocess.STDOUT)
+
+	@property
+	def daemon_pid(self):
+		return self._daemon.pid if self._daemon is not None else None
+
+	def stop_daemon(self):
+		if self._daemon is None:
+			return
+		self._daemon.terminate()
+		try:
+			self._daemon.wait(5)
+		except subprocess.TimeoutExpired:
+			self._daemon.kill()
+			self._daemon.wait()
+		self._daemon = None
+		self._daemon_log.close()
+		self._daemon_log = None
+		wait_until(lambda: not self.session_bus.has_owner(GS_SERVICE), 5)
+
+	def watchers(self):
+		watchers_dir = os.path.join(self.work_dir, 'watchers')
+		return [os.path.join(watchers_dir, name) for name in os.listdir(watchers_dir)]
+
+	def xscreensaver_pid(self):
+		try:
+			with open(os.path.join(self.work_dir, 'xscreensaver.pid')) as f:
+				return int(f.read())
+		except (IOError, ValueError):
+			return None
+
+	def xscreensaver_state(self):
+		# may be caught half written
+		try:
+			with open(os.path.join(self.work_dir, 'state')) as f:
+				return f.read().split()[0]
+		except (IOError, IndexError):
+			return None
+
+	def wait_ready(self, timeout=10):
+		# the watcher is started once xscreensaver is ready
+		wait_until(lambda: self.watchers(), timeout)
+		self.state.update(self.call_sync('GetState', FGS_INTERFACE)[0])
+
+	def unlock(self):
+		if self.state.get('Locked'):
+			self.command('deactivate')
+			wait_until(lambda: not self.state.get('Locked'), 10)
+
+	def command(self, cmd):
+		subprocess.check_call([os.path.join(STUBS_DIR, 'xscreensaver-command'), '-' + cmd], env=self.env)
+
+	def call(self, method_name, interface_name=GS_INTERFACE, connection=None, callback=None):
+		connection = connection or self.session_bus.connection
+		connection.call(GS_SERVICE, GS_PATH, interface_name, method_name, None, None, Gio.DBusCallFlags.NONE, -1, None,
+			lambda source, result, *user_data: callback(source.call_finish(result)) if callback else source.call_finish(result))
+
+	def call_sync(self, method_name, interface_name=GS_INTERFACE):
+		return self.session_bus.connection.call_sync(GS_SERVICE, GS_PATH, interface_name, method_name, None, None, Gio.DBusCallFlags.NONE, -1, None).unpack()
+
+
+FleetDisplay = collections.namedtuple('FleetDisplay', ['display', 'dir', 'bus', 'session_id', 'session_path'])
+
+
+class DisplayFleet(object):
+	# many displays, each with its own session bus, logind session and
+	# stand-in xscreensaver, run by one supervising daemon or one daemon
+	# per display
+
+	FIRST_DISPLAY = 100
+
+	def __init__(self, env, count):
+		self._env = env
+		self._processes = []
+		self._log = None
+		self._subscriptions = []
+		self.locked = {}
+		self.displays = []
+		for i in range(count):
+			number = self.FIRST_DISPLAY + i
+			display_dir = os.path.join(env.work_dir, 'displays', str(number))
+			os.makedirs(os.path.join(display_dir, 'watchers'))
+			session_id = 'bench%d' % number
+			display = FleetDisplay(':%d' % number, display_dir, Bus('session', display_dir), session_id, env.logind.add_session(session_id))
+			self._subscriptions.append((display.bus, display.bus.connection.signal_subscribe(GS_SERVICE, DBUS_INTERFACE_PROPERTIES, 'PropertiesChanged', GS_PATH, FGS_INTERFACE, Gio.DBusSignalFlags.NONE, self._properties_changed, display.display)))
+			self.displays.append(display)
+
+	def _properties_changed(self, connection, sender, path, interface, signal, parameters, display):
+		interface_name, changed, invalidated = parameters.unpack()
+		if 'Locked' in changed:
+			self.locked[display] = changed['Locked']
+
+	def _start(self, args, env):
+		if self._log is None:
+			self._log = open(os.path.join(self._env.work_dir, 'daemon.log'), 'a')
+		argv = [sys.executable, DAEMON] + (['--debug'] if self._env.debug else []) + list(args)
+		process = subprocess.Popen(argv, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+		self._processes.append(process)
+		return process
+
+	def start_supervisor(self):
+		config_path = os.path.join(self._env.work_dir, 'displays.conf')
+		with open(config_path, 'w') as f:
+			for d in self.displays:
+				f.write('%s %s %s\n' % (d.display, d.bus.address, d.session_id))
+		self._start(['--supervise', config_path], self._env.env)
+
+	def start_separate(self):
+		for d in self.displays:
+			process = self._start([], dict(self._env.env, DISPLAY=d.display, DBUS_SESSION_BUS_ADDRESS=d.bus.address))
+			# before the daemon gets as far as asking
+			self._env.logind.pids[process.pid] = d.session_path
+
+	def wait_ready(self):
+		# every display has its bus name and a watcher
+		pending = list(self.displays)
+
+		def ready():
+			while pending and pending[0].bus.has_owner(GS_SERVICE) and os.listdir(os.path.join(pending[0].dir, 'watchers')):
+				pending.pop(0)
+			return not pending
+
+		wait_until(ready, 10 + len(self.displays) * 0.2, 100)
+
+	def usage(self):
+		rss = 0
+		cpu = 0
+		for process in self._processes:
+			process_rss, process_cpu = process_usage(process.pid)
+			rss += process_rss
+			cpu += process_cpu
+		return rss, cpu
+
+	def lock_all(self):
+		for d in self.displays:
+			self._env.logind.lock(d.session_id)
+		wait_until(lambda: all(self.locked.get(d.display) for d in self.displays), 10 + len(self.displays) * 0.1, 10)
+
+	def unlock_all(self):
+		for d in self.displays:
+			subprocess.check_call([os.path.join(STUBS_DIR, 'xscreensaver-command'), '-deactivate'], env=dict(self._env.env, DISPLAY=d.display))
+		wait_until(lambda: not any(self.locked.get(d.display) for d in self.displays), 10 + len(self.displays) * 0.1, 10)
+
+	def close(self):
+		for process in self._processes:
+			process.terminate()
+		for process in self._processes:
+			try:
+				process.wait(10 + len(self.displays) * 0.1)
+			except subprocess.TimeoutExpired:
+				process.kill()
+				process.wait()
+			self._env.logind.pids.pop(process.pid, None)
+		self._processes = []
+		if self._log is not None:
+			self._log.close()
+			self._log = None
+
+		for bus, subscription_id in self._subscriptions:
+			bus.connection.signal_unsubscribe(subscription_id)
+		self._subscriptions = []
+		for d in self.displays:
+			d.bus.close()
+			self._env.logind.remove_session(d.session_id)
+		shutil.rmtree(os.path.join(self._env.work_dir, 'displays'), ignore_errors=True)
+		self.displays = []
+
+
+def bench_startup(env, options):
+	bus_name_times = []
+	ready_times = []
+	rss = [] # in kB
+	for i in range(options.startup_runs):
+		started = time.monotonic()
+		env.start_daemon()
+		wait_until(lambda: env.session_bus.has_owner(GS_SERVICE), 10)
+		bus_name_times.append(time.monotonic() - started)
+		env.wait_ready()
+		ready_times.append(time.monotonic() - started)
+		rss.append(process_usage(env.daemon_pid)[0])
+		env.stop_daemon()
+
+	# --help exits once the daemon's modules are imported
+	import_times = collections.defaultdict(list)
+	totals = []
+	for i in range(options.startup_runs):
+		process = subprocess.run([sys.executable, '-X', 'importtime', DAEMON, '--help'], env=env.env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+		modules = parse_importtime(process.stderr)
+		for name, seconds in modules.items():
+			import_times[name].append(seconds)
+		totals.append(sum(modules.values()))
+	medians = dict((name, stats(times)['median']) for name, times in import_times.items())
+	slowest = sorted(medians, key=medians.get, reverse=True)[:5]
+
+	return collections.OrderedDict([
+		('bus_name_ms', stats(bus_name_times)),
+		('ready_ms', stats(ready_times)),
+		('rss_kb', {'median': sorted(rss)[len(rss) // 2], 'max': max(rss)}),
+		('import_ms', stats(totals)),
+		('slowest_imports_ms', collections.OrderedDict((name, medians[name]) for name in slowest))
+	])
+
+
+def bench_recovery(env, options):
+	# each run gets a new daemon, so that every kill is a first crash rather
+	# than one further along the restart backoff
+	results = collections.OrderedDict()
+
+	restart_times = []
+	relocked_times = []
+	for i in range(options.recovery_runs):
+		env.start_daemon()
+		env.wait_ready()
+		env.call_sync('Lock')
+		wait_until(lambda: env.state.get('Locked'), 10)
+
+		# a new xscreensaver starts out unlocked, the daemon should lock it
+		# again
+		old_pid = env.xscreensaver_pid()
+		started = time.monotonic()
+		os.kill(old_pid, signal.SIGKILL)
+		wait_until(lambda: env.xscreensaver_pid() not in (None, old_pid), 10)
+		restart_times.append(time.monotonic() - started)
+		wait_until(lambda: env.xscreensaver_state() == 'LOCK' and env.state.get('Locked'), 20)
+		relocked_times.append(time.monotonic() - started)
+		env.stop_daemon()
+	results['xscreensaver'] = {'restart_ms': stats(restart_times), 'relocked_ms': stats(relocked_times)}
+
+	restart_times = []
+	resynced_times = []
+	for i in range(options.recovery_runs):
+		env.start_daemon()
+		env.wait_ready()
+
+		# the lock happens while there is no watcher to see it, so it has to
+		# be picked up by the status query after the restart
+		old_watchers = env.watchers()
+		started = time.monotonic()
+		for path in old_watchers:
+			os.kill(int(os.path.basename(path).split('.')[0]), signal.SIGKILL)
+			# SIGKILL leaves no chance to clean up
+			os.remove(path)
+		env.command('lock')
+		wait_until(lambda: env.watchers(), 10)
+		restart_times.append(time.monotonic() - started)
+		wait_until(lambda: env.state.get('Locked'), 10)
+		resynced_times.append(time.monotonic() - started)
+		env.stop_daemon()
+	results['watcher'] = {'restart_ms': stats(restart_times), 'resynced_ms': stats(resynced_times)}
+
+	return results
+
+
+def measure_fleet(env, options, count, separate):
+	fleet = DisplayFleet(env, count)
+	try:
+		started = time.monotonic()
+		if separate:
+			fleet.start_separate()
+		else:
+			fleet.start_supervisor()
+		fleet.wait_ready()
+		startup_time = time.monotonic() - started
+		rss, startup_cpu = fleet.usage()
+
+		fleet.lock_all()
+		fleet.unlock_all()
+		lock_cpu = fleet.usage()[1] - startup_cpu
+
+		idle_started = fleet.usage()[1]
+		deadline = time.monotonic() + options.duration
+		wait_until(lambda: time.monotonic() >= deadline, options.duration + 10, 100)
+		idle_cpu = fleet.usage()[1] - idle_started
+	finally:
+		fleet.close()
+
+	return collections.OrderedDict([
+		('daemons', count if separate else 1),
+		('startup_ms', startup_time * 1000),
+		('rss_kb', rss),
+		('rss_kb_per_display', rss / float(count)),
+		('startup_cpu_ms_per_display', startup_cpu * 1000 / count),
+		('lock_cpu_ms_per_display', lock_cpu * 1000 / count),
+		('idle_cpu_ms_per_display', idle_cpu * 1000 / count),
+		('idle_seconds', options.duration)
+	])
+
+
+def bench_supervisor(env, options):
+	# memory and CPU of the daemon(s) only, xscreensaver and the watchers
+	# are the same either way
+	results = collections.OrderedDict()
+	for count in options.displays:
+		result = collections.OrderedDict([('supervisor', measure_fleet(env, options, count, False))])
+		if count <= options.baseline_displays:
+			result['separate'] = measure_fleet(env, options, count, True)
+		results[str(count)] = result
+	return results
+
+
+def bench_lock_latency(env, options):
+	results = {}
+
+	reply_times = []
+	locked_times = []
+	for i in range(options.lock_runs):
+		env.unlock()
+		started = time.monotonic()
+		env.call('Lock', callback=lambda reply: reply_times.append(time.monotonic() - started))
+		wait_until(lambda: env.state.get('Locked') and len(reply_times) > i, 10)
+		locked_times.append(time.monotonic() - started)
+	results['dbus'] = {'reply_ms': stats(reply_times), 'locked_ms': stats(locked_times)}
+
+	locked_times = []
+	for i in range(options.lock_runs):
+		env.unlock()
+		started = time.monotonic()
+		env.logind.lock()
+		wait_until(lambda: env.state.get('Locked'), 10)
+		locked_times.append(time.monotonic() - started)
+	results['logind'] = {'locked_ms': stats(locked_times)}
+
+	env.unlock()
+	return results
+
+
+def bench_sleep_lock(env, options):
+	# how long suspend is held off by the daemon's delay inhibitor
+	held_times = []
+	for i in range(options.sleep_runs):
+		env.unlock()
+		wait_until(lambda: env.logind.inhibitors, 10)
+		released = len(env.logind.released)
+		started = time.monotonic()
+		env.logind.prepare_for_sleep(True)
+		wait_until(lambda: len(env.logind.released) > released, 10)
+		held_times.append(env.logind.released[-1] - started)
+		env.logind.prepare_for_sleep(False)
+
+	env.unlock()
+	return {'held_ms': stats(held_times)}
+
+
+def measure_get_active(env, clients, duration):
+	latencies = []
+	outstanding = [0]
+	deadline = time.monotonic() + duration
+
+	def call(connection):
+		started = time.monotonic()
+		outstanding[0] += 1
+		env.call('GetActive', connection=connection, callback=lambda reply: finished(connection, started))
+
+	def finished(connection, started):
+		outstanding[0] -= 1
+		latencies.append(time.monotonic() - started)
+		if time.monotonic() < deadline:
+			call(connection)
+
+	connections = [env.session_bus.connect() for i in range(clients)]
+	started = time.monotonic()
+	for connection in connections:
+		call(connection)
+	wait_until(lambda: outstanding[0] == 0, duration + 10)
+	elapsed = time.monotonic() - started
+
+	for connection in connections:
+		connection.close_sync(None)
+
+	return {
+		'clients': clients,
+		'calls': len(latencies),
+		'calls_per_second': len(latencies) / elapsed,
+		'latency_ms': stats(latencies)
+	}
+
+
+def bench_get_active(env, options):
+	return measure_get_active(env, options.clients, options.duration)
+
+
+def bench_get_active_stuck(env, options):
+	# GetActive while xscreensaver-command and xset hang, until the daemon
+	# gives up on them after COMMAND_TIMEOUT
+	results = collections.OrderedDict()
+	results['baseline'] = measure_get_active(env, options.clients, options.duration)
+
+	hung_dir = os.path.join(env.work_dir, 'hung')
+	hang_path = os.path.join(env.work_dir, 'hang')
+	with open(hang_path, 'w') as f:
+		f.write('xscreensaver-command\nxset\n')
+	try:
+		# inhibiting runs xscreensaver-command -deactivate and xset -dpms
+		started = time.monotonic()
+		path = env.gnome_session.add_inhibitor(8)
+		wait_until(lambda: os.path.isdir(hung_dir) and os.listdir(hung_dir), 10)
+		results['stuck'] = measure_get_active(env, options.clients, options.stuck_duration)
+
+		def all_killed():
+			for name in os.listdir(hung_dir):
+				try:
+					os.kill(int(name), 0)
+				except ProcessLookupError:
+					continue
+				return False
+			return True
+
+		wait_until(all_killed, COMMAND_TIMEOUT + 10, 10)
+		results['hung_commands'] = len(os.listdir(hung_dir))
+		results['killed_after_ms'] = (time.monotonic() - started) * 1000
+	finally:
+		os.remove(hang_path)
+
+	env.gnome_session.remove_inhibitor(path)
+	wait_until(lambda: not env.state.get('Inhibited'), 10)
+	shutil.rmtree(hung_dir, ignore_errors=True)
+	return results
+
+
+def parse_importtime(output):
+	# python -X importtime, top level imports only; nested ones are part of
+	# their importer's cumulative time
+	modules = {}
+	for line in output.splitlines():
+		if not line.startswith('import time:'):
+			continue
+		parts = line[len('import time:'):].split('|')
+		if len(parts) != 3 or not parts[1].strip().isdigit():
+			continue
+		name = parts[2].rstrip()
+		if len(name) - len(name.lstrip()) == 1:
+			modules[name.strip()] = int(parts[1]) / 1e6
+	return modules
+
+
+def bench_command_startup(env, options):
+	# cold start cost of one gnome-screensaver-command query, against the
+	# interpreter starting and doing nothing
+	def run(args):
+		started = time.monotonic()
+		process = subprocess.run([sys.executable] + args, env=env.env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+		return time.monotonic() - started, process
+
+	baseline_times = []
+	query_times = []
+	for i in range(options.command_runs):
+		baseline_times.append(run(['-c', 'pass'])[0])
+		elapsed, process = run([COMMAND, '-q'])
+		if process.returncode != 0:
+			raise BenchError("%s -q failed: %s" % (COMMAND, process.stderr.strip()))
+		query_times.append(elapsed)
+
+	# importtime slows imports down, so it gets runs of its own
+	import_times = collections.defaultdict(list)
+	totals = []
+	for i in range(options.command_runs):
+		modules = parse_importtime(run(['-X', 'importtime', COMMAND, '-q'])[1].stderr)
+		for name, seconds in modules.items():
+			import_times[name].append(seconds)
+		totals.append(sum(modules.values()))
+	medians = dict((name, stats(times)['median']) for name, times in import_times.items())
+	slowest = sorted(medians, key=medians.get, reverse=True)[:5]
+
+	baseline = stats(baseline_times)
+	query = stats(query_times)
+	imports = stats(totals)
+	overhead_ms = query['median'] - baseline['median']
+	return collections.OrderedDict([
+		('interpreter_ms', baseline),
+		('query_ms', query),
+		('overhead_ms', overhead_ms),
+		('import_ms', imports),
+		('slowest_imports_ms', collections.OrderedDict((name, medians[name]) for name in slowest)),
+		('budget_ms', {'overhead': options.command_budget, 'import': options.import_budget}),
+		('within_budget', overhead_ms <= options.command_budget and imports['median'] <= options.import_budget)
+	])
+
+
+def bench_watcher(env, options):
+	# alternate so that every event changes the active state, and end
+	# where we started
+	count = options.events - options.events % 2
+	states = ['BLANK', 'UNBLANK'] if not env.state.get('Active') else ['UNBLANK', 'BLANK']
+	now = time.ctime()
+	data = ''.join('%s %s\n' % (states[i % 2], now) for i in range(count)).encode()
+	wakeups_key = 'faux_gnome_screensaver_wakeups_total{source="watcher"}'
+
+	def wakeups():
+		return env.call_sync('GetMetrics', FGS_INTERFACE)[0].get(wakeups_key, 0)
+
+	before = wakeups()
+	target = env.active_changes + count
+	started = time.monotonic()
+	for path in env.watchers():
+		fd = os.open(path, os.O_WRONLY)
+		try:
+			os.write(fd, data)
+		finally:
+			os.close(fd)
+	wait_until(lambda: env.active_changes >= target, 60)
+	elapsed = time.monotonic() - started
+	# lines that arrive together are read in one wakeup
+	woken = wakeups() - before
+
+	return {
+		'events': count,
+		'elapsed_ms': elapsed * 1000,
+		'events_per_second': count / elapsed,
+		'wakeups': woken,
+		'wakeups_per_event': woken / count if count else 0
+	}
+
+
+def bench_inhibit(env, options):
+	inhibited_times = []
+	uninhibited_times = []
+	for i in range(options.inhibit_runs):
+		started = time.monotonic()
+		path = env.gnome_session.add_inhibitor(8)
+		wait_until(lambda: env.state.get('Inhibited'), 10)
+		inhibited_times.append(time.monotonic() - started)
+
+		started = time.monotonic()
+		env.gnome_session.remove_inhibitor(path)
+		wait_until(lambda: not env.state.get('Inhibited'), 10)
+		uninhibited_times.append(time.monotonic() - started)
+
+	return {
+		'inhibited_ms': stats(inhibited_times),
+		'uninhibited_ms': stats(uninhibited_times)
+	}
+
+
+def bench_other_sessions(env, options):
+	# signals for other sessions on the host should be dropped by the bus,
+	# rather than woken up for and ignored
+	connection = env.system_bus.connection
+	received_key = 'faux_gnome_screensaver_wakeups_total{source="dbus-signal"}'
+
+	def received():
+		return env.call_sync('GetMetrics', FGS_INTERFACE)[0].get(received_key, 0)
+
+	before = received()
+	sent = 0
+	started = time.monotonic()
+	for i in range(options.sessions):
+		path = '%s/session/other%d' % (FakeLogind.PATH, i)
+		connection.emit_signal(None, path, FakeLogind.SESSION_INTERFACE, 'Lock', None)
+		connection.emit_signal(None, path, FakeLogind.SESSION_INTERFACE, 'Unlock', None)
+		connection.emit_signal(None, path, DBUS_INTERFACE_PROPERTIES, 'PropertiesChanged', GLib.Variant('(sa{sv}as)', (FakeLogind.SESSION_INTERFACE, {'Active': GLib.Variant('b', False)}, [])))
+
+		path = '/org/freedesktop/ConsoleKit/OtherSession%d' % i
+		connection.emit_signal(None, path, FakeConsoleKit.SESSION_INTERFACE, 'Lock', None)
+		connection.emit_signal(None, path, FakeConsoleKit.SESSION_INTERFACE, 'Unlock', None)
+		connection.emit_signal(None, path, FakeConsoleKit.SESSION_INTERFACE, 'ActiveChanged', GLib.Variant('(b)', (False,)))
+		sent += 6
+
+	# signals from one sender arrive in order, so once the daemon has seen
+	# this one it has seen (or been spared) all of the others
+	env.logind.set_active(True)
+	wait_until(lambda: received() > before, 10, 10)
+	elapsed = time.monotonic() - started
+
+	return {
+		'sessions': options.sessions,
+		'signals_sent': sent,
+		'signals_received': received() - before - 1,
+		'elapsed_ms': elapsed * 1000
+	}
+
+
+def x_missing(names):
+	missing = [name for name in names if not shutil.which(name, path=HOST_PATH)]
+	if missing:
+		return {'skipped': "%s not found" % ', '.join(missing)}
+	return None
+
+
+_daemon_module = None
+
+
+def load_daemon():
+	# to time parts of the daemon (the X client, the timestamp parser) on
+	# their own, without the rest of the daemon
+	global _daemon_module
+	if _daemon_module is None:
+		spec = importlib.util.spec_from_file_location('fgs_daemon', DAEMON)
+		_daemon_module = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(_daemon_module)
+	return _daemon_module
+
+
+def bench_parse_datetime(env, options):
+	# XScreenSaverManager.parse_datetime against the strptime call it
+	# replaced, on the ctime() strings xscreensaver prints
+	parse_datetime = load_daemon().XScreenSaverManager.parse_datetime
+	now = int(time.time())
+	# both single and double digit days
+	samples = [time.ctime(now - day * 86400) for day in range(31)]
+
+	for text in samples:
+		expected = time.mktime(time.strptime(text, '%a %b %d %H:%M:%S %Y'))
+		if parse_datetime(text) != expected:
+			raise BenchError("parse_datetime(%r) returned %r, expected %r" % (text, parse_datetime(text), expected))
+
+	def run(parse):
+		started = time.perf_counter()
+		for i in range(options.parse_runs):
+			parse(samples[i % len(samples)])
+		return (time.perf_counter() - started) / options.parse_runs * 1000000
+
+	parse_datetime_us = run(parse_datetime)
+	strptime_us = run(lambda text: time.mktime(time.strptime(text, '%a %b %d %H:%M:%S %Y')))
+	return collections.OrderedDict([
+		('parse_datetime_us', parse_datetime_us),
+		('strptime_us', strptime_us),
+		('speedup', strptime_us / parse_datetime_us)
+	])
+
+
+class XServer(object):
+	# Xvfb, and the real xscreensaver and xset to go with it rather than the
+	# stubs
+	def __init__(self, env, args=()):
+		read_fd, write_fd = os.pipe()
+		try:
+			self._process = subprocess.Popen(['Xvfb', '-displayfd', str(write_fd), '-nolisten', 'tcp', '-screen', '0', '640x480x24'] + list(args),
+				pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		finally:
+			os.close(write_fd)
+		with os.fdopen(read_fd) as f:
+			number = f.readline().strip()
+		if not number:
+			self._process.kill()
+			self._process.wait()
+			raise BenchError("Cannot start Xvfb")
+		self.display = ':' + number
+		self.env = dict(env.env, DISPLAY=self.display, PATH=HOST_PATH)
+		self._xscreensaver = None
+
+	def run(self, argv):
+		return subprocess.call(argv, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+	def command(self, cmd):
+		return self.run(['xscreensaver-command', '-' + cmd])
+
+	def start_xscreensaver(self):
+		self._xscreensaver = subprocess.Popen(['xscreensaver', '-nosplash'], env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		self.wait_xscreensaver(True)
+
+	def wait_xscreensaver(self, running):
+		wait_until(lambda: (self.command('time') == 0) == running, 30, 100)
+
+	def close(self):
+		if self._xscreensaver is not None:
+			self._xscreensaver.terminate()
+			self._xscreensaver.wait()
+		self._process.terminate()
+		self._process.wait()
+
+
+def measure_x_latency(env, options, x_server):
+	wait_until(lambda: env.session_bus.has_owner(GS_SERVICE), 10)
+	x_server.wait_xscreensaver(True)
+	env.state.update(env.call_sync('GetState', FGS_INTERFACE)[0])
+
+	# the first change can come before the daemon is listening for it
+	for attempt in range(5):
+		x_server.command('activate')
+		try:
+			wait_until(lambda: env.state.get('Active'), 2)
+			break
+		except BenchError:
+			x_server.command('deactivate')
+	else:
+		raise BenchError("Daemon did not notice xscreensaver blanking")
+	x_server.command('deactivate')
+	wait_until(lambda: not env.state.get('Active'), 10)
+
+	blank_times = []
+	unblank_times = []
+	for i in range(options.x_runs):
+		started = time.monotonic()
+		x_server.command('activate')
+		wait_until(lambda: env.state.get('Active'), 10)
+		blank_times.append(time.monotonic() - started)
+
+		started = time.monotonic()
+		x_server.command('deactivate')
+		wait_until(lambda: not env.state.get('Active'), 10)
+		unblank_times.append(time.monotonic() - started)
+
+	return {
+		'blank_ms': stats(blank_times),
+		'unblank_ms': stats(unblank_times),
+		'forks': env.call_sync('GetMetrics', FGS_INTERFACE)[0].get('faux_gnome_screensaver_forks_total{command="xscreensaver-command -watch"}', 0)
+	}
+
+
+def bench_x_events(env, options):
+	# how quickly xscreensaver blanking and unblanking reaches ActiveChanged
+	# through _SCREENSAVER_STATUS and through xscreensaver-command -watch
+	skipped = x_missing(['Xvfb', 'xscreensaver', 'xscreensaver-command'])
+	if skipped:
+		return skipped
+
+	x_server = XServer(env)
+	results = collections.OrderedDict()
+	try:
+		for name, args in [('x_events', []), ('watcher', ['--use-watcher'])]:
+			env.start_daemon(args, x_server.env)
+			try:
+				results[name] = measure_x_latency(env, options, x_server)
+			finally:
+				env.stop_daemon()
+			# xscreensaver is asked to exit, make sure it has before the next run
+			x_server.wait_xscreensaver(False)
+	finally:
+		x_server.close()
+
+	return results
+
+
+def bench_x_commands(env, options):
+	# per command latency of the daemon's ClientMessage client against
+	# running xscreensaver-command; note that xscreensaver-command also waits
+	# for xscreensaver to answer, which the daemon does not need to
+	skipped = x_missing(['Xvfb', 'xscreensaver', 'xscreensaver-command'])
+	if skipped:
+		return skipped
+
+	x_server = XServer(env)
+	try:
+		x_server.start_xscreensaver()
+		client = load_daemon().XScreenSaverClient(x_server.display)
+		if not client.open():
+			return {'skipped': "Cannot open %s (libX11 older than 1.7?)" % x_server.display}
+		try:
+			results = collections.OrderedDict()
+			for name, in_process, argv in [
+				('deactivate', lambda: client.send_command('deactivate'), ['xscreensaver-command', '-deactivate']),
+				('time', lambda: client.get_status() is not None, ['xscreensaver-command', '-time'])
+			]:
+				client_times = []
+				fork_times = []
+				for i in range(options.x_runs):
+					started = time.monotonic()
+					if not in_process():
+						raise BenchError("X client failed to %s" % name)
+					client_times.append(time.monotonic() - started)
+
+					started = time.monotonic()
+					if x_server.run(argv) != 0:
+						raise BenchError("%s failed" % ' '.join(argv))
+					fork_times.append(time.monotonic() - started)
+				results[name] = {'client_message_ms': stats(client_times), 'fork_ms': stats(fork_times)}
+		finally:
+			client.close()
+	finally:
+		x_server.close()
+
+	return results
+
+
+def bench_x_dpms(env, options):
+	# XScreenSaverManager's DPMS handling against the DPMS extension: no
+	# request for a state it is already in, changes made with xset are
+	# noticed and undone, --no-dpms leaves DPMS alone
+	skipped = x_missing(['Xvfb', 'xset'])
+	if skipped:
+		return skipped
+
+	daemon = load_daemon()
+	x_server = XServer(env, ['+extension', 'DPMS'])
+	try:
+		client = daemon.XScreenSaverClient(x_server.display)
+		if not client.open():
+			return {'skipped': "Cannot open %s (libX11 older than 1.7?)" % x_server.display}
+		try:
+			if client.get_dpms() is None:
+				return {'skipped': "Xvfb has no DPMS extension"}
+
+			requests = []
+			set_dpms = client.set_dpms
+			client.set_dpms = lambda enable: requests.append(enable) or set_dpms(enable)
+
+			manager = daemon.XScreenSaverManager(daemon.ScreensaverState(), display=x_server.display)
+			manager._client = client
+			checks = collections.OrderedDict()
+
+			manager._set_dpms(False)
+			checks['disabled'] = requests == [False] and client.get_dpms() is False
+			manager._set_dpms(False)
+			checks['redundant_change_skipped'] = requests == [False]
+
+			x_server.run(['xset', '+dpms'])
+			checks['outside_change_seen'] = client.get_dpms() is True
+			manager._set_dpms(False)
+			checks['outside_change_undone'] = requests == [False, False] and client.get_dpms() is False
+			checks['no_forks'] = manager._forks == 0
+
+			no_dpms = daemon.XScreenSaverManager(daemon.ScreensaverState(), no_dpms=True, display=x_server.display)
+			no_dpms._client = client
+			no_dpms._set_dpms(True)
+			checks['no_dpms_left_alone'] = requests == [False, False] and client.get_dpms() is False
+
+			failed = [name for name, ok in checks.items() if not ok]
+			if failed:
+				raise BenchError("DPMS checks failed: %s" % ', '.join(failed))
+
+			client_times = []
+			fork_times = []
+			for i in range(options.x_runs):
+				for enable in [True, False]:
+					started = time.monotonic()
+					set_dpms(enable)
+					client_times.append(time.monotonic() - started)
+
+					started = time.monotonic()
+					x_server.run(['xset', '+dpms' if enable else '-dpms'])
+					fork_times.append(time.monotonic() - started)
+		finally:
+			client.close()
+	finally:
+		x_server.close()
+
+	return collections.OrderedDict([
+		('checks', checks),
+		('dpms_extension_ms', stats(client_times)),
+		('xset_ms', stats(fork_times))
+	])
+
+
+# these need Xvfb and the real xscreensaver or xset
+X_BENCHMARKS = collections.OrderedDict([
+	('x_events', bench_x_events),
+	('x_commands', bench_x_commands),
+	('x_dpms', bench_x_dpms)
+])
+
+# these run against a daemon that is already running and ready
+BENCHMARKS = collections.OrderedDict([
+	('lock_latency', bench_lock_latency),
+	('sleep_lock', bench_sleep_lock),
+	('get_active', bench_get_active),
+	('get_active_stuck', bench_get_active_stuck),
+	('watcher', bench_watcher),
+	('inhibit', bench_inhibit),
+	('other_sessions', bench_other_sessions),
+	('command_startup', bench_command_startup)
+])
+
+
+def main(argv):
+	parser = optparse.OptionParser(description="faux-gnome-screensaver-bench - hermetic benchmarks for faux-gnome-screensaver")
+	parser.add_option('-o', '--output', dest='output', help="Write results to FILE instead of standard output", metavar='FILE')
+	parser.add_option('-b', '--benchmark', action='append', dest='benchmarks', choices=['startup', 'recovery', 'supervisor', 'parse_datetime'] + list(X_BENCHMARKS) + list(BENCHMARKS), help="Only run this benchmark (may be repeated); supervisor and the x_ benchmarks only run when asked for", metavar='NAME')
+	parser.add_option('--startup-runs', type='int', dest='startup_runs', default=5, help="Number of daemon starts to time [default: %default]")
+	parser.add_option('--lock-runs', type='int', dest='lock_runs', default=20, help="Number of locks to time per source [default: %default]")
+	parser.add_option('--recovery-runs', type='int', dest='recovery_runs', default=5, help="Number of times to kill xscreensaver and the watcher [default: %default]")
+	parser.add_option('--sleep-runs', type='int', dest='sleep_runs', default=10, help="Number of PrepareForSleep cycles to time [default: %default]")
+	parser.add_option('--inhibit-runs', type='int', dest='inhibit_runs', default=5, help="Number of inhibit / uninhibit cycles to time [default: %default]")
+	parser.add_option('--x-runs', type='int', dest='x_runs', default=10, help="Number of blank / unblank cycles, or of each command, to time on Xvfb [default: %default]")
+	parser.add_option('--parse-runs', type='int', dest='parse_runs', default=100000, help="Number of timestamps to parse each way [default: %default]")
+	parser.add_option('--clients', type='int', dest='clients', default=8, help="Number of concurrent GetActive clients [default: %default]")
+	parser.add_option('--duration', type='float', dest='duration', default=5, help="Seconds to run GetActive calls for [default: %default]")
+	parser.add_option('--stuck-duration', type='float', dest='stuck_duration', default=COMMAND_TIMEOUT + 3, help="Seconds to run GetActive calls for while commands are stuck [default: %default]")
+	parser.add_option('--command-runs', type='int', dest='command_runs', default=20, help="Number of gnome-screensaver-command queries to time [default: %default]")
+	parser.add_option('--command-budget', type='float', dest='command_budget', default=40, help="Milliseconds a query may take beyond starting the interpreter [default: %default]", metavar='MS')
+	parser.add_option('--import-budget', type='float', dest='import_budget', default=25, help="Milliseconds a query may spend importing modules [default: %default]", metavar='MS')
+	parser.add_option('--events', type='int', dest='events', default=1000, help="Number of watcher events to send [default: %default]")
+	parser.add_option('--sessions', type='int', dest='sessions', default=500, help="Number of other sessions to send logind and ConsoleKit signals for [default: %default]")
+	parser.add_option('--displays', dest='displays', default='10,100,500', help="Comma separated numbers of displays for the supervisor benchmark [default: %default]", metavar='COUNTS')
+	parser.add_option('--baseline-displays', type='int', dest='baseline_displays', default=10, help="Also run one daemon per display, for up to this many displays [default: %default]", metavar='N')
+	parser.add_option('--debug', action='store_true', dest='debug', default=False, help="Run the daemon with --debug")
+	parser.add_option('--keep', action='store_true', dest='keep', default=False, help="Keep the working directory (and daemon log)")
+
+	options, args = parser.parse_args(argv[1:])
+	try:
+		options.displays = [int(count) for count in options.displays.split(',')]
+	except ValueError:
+		parser.error("--displays should be a comma separated list of numbers")
+	selected = options.benchmarks or ['startup', 'recovery', 'parse_datetime'] + list(BENCHMARKS)
+
+	results = collections.OrderedDict([
+		('version', RESULTS_VERSION),
+		('timestamp', int(time.time())),
+		('python', platform.python_version()),
+		('host', platform.node())
+	])
+
+	env = BenchEnvironment(options)
+	try:
+		if 'startup' in selected:
+			results['startup'] = bench_startup(env, options)
+		if 'recovery' in selected:
+			results['recovery'] = bench_recovery(env, options)
+		if 'supervisor' in selected:
+			results['supervisor'] = bench_supervisor(env, options)
+		if 'parse_datetime' in selected:
+			results['parse_datetime'] = bench_parse_datetime(env, options)
+		for name in X_BENCHMARKS:
+			if name in selected:
+				results[name] = X_BENCHMARKS[name](env, options)
+
+		names = [name for name in BENCHMARKS if name in selected]
+		if names:
+			env.start_daemon()
+			env.wait_ready()
+			for name in names:
+				results[name] = BENCHMARKS[name](env, options)
+			results['metrics'] = env.call_sync('GetMetrics', FGS_INTERFACE)[0]
+	except BenchError as err:
+		sys.stderr.write("%s (daemon log in %s)\n" % (err, os.path.join(env.work_dir, 'daemon.log')))
+		options.keep = True
+		return 1
+	finally:
+		env.close()
+
+	output = json.dumps(results, indent=2) + '\n'
+	if options.output:
+		with open(options.output, 'w') as f:
+			f.write(output)
+	else:
+		sys.stdout.write(output)
+
+	over = [name for name, result in results.items() if isinstance(result, dict) and result.get('within_budget') is False]
+	if over:
+		sys.stderr.write("Over budget: %s\n" % ', '.join(over))
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
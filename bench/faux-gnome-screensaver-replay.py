@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+#
+# faux-gnome-screensaver-replay.py
+# This file is part of faux-gnome-screensaver
+#
+# Copyright (C) 2012-2013 Jeffery To <jeffery.to@gmail.com>
+# https://github.com/jefferyto/faux-gnome-screensaver
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Replays a file written by faux-gnome-screensaver --record against the
+# benchmarks' private buses, fake services and stand-in executables:
+# watcher lines and _SCREENSAVER_STATUS changes are written to the watcher
+# fifos, D-Bus calls are made again, signals are sent from the fake
+# services, and settings and ~/.xscreensaver changes are written where the
+# daemon will notice them.
+# Replies to the daemon's own calls set up the fake services instead.
+#
+# Inputs that the daemon caused itself, e.g. the watcher line for a lock
+# that it asked for, are replayed as well, so the daemon may see them twice.
+
+from gi.repository import GLib, Gio
+import collections
+import importlib.util
+import json
+import optparse
+import os
+import platform
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the fake services and environment are shared with the benchmarks
+_spec = importlib.util.spec_from_file_location('fgs_bench', os.path.join(BENCH_DIR, 'faux-gnome-screensaver-bench.py'))
+bench = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench)
+
+RECORDING_VERSION = 1
+
+LOGIND_PREFIX = 'org.freedesktop.login1'
+
+
+def read_recording(path):
+	events = []
+	with open(path) as f:
+		lines = f.readlines()
+	for i, line in enumerate(lines):
+		try:
+			events.append(json.loads(line))
+		except ValueError:
+			# the daemon may have died halfway through the last line
+			if i == len(lines) - 1:
+				break
+			raise bench.BenchError("%s:%d is not valid JSON" % (path, i + 1))
+
+	if not events or events[0].get('k') != 'start':
+		raise bench.BenchError("%s is not a recording" % path)
+	if events[0].get('version') != RECORDING_VERSION:
+		raise bench.BenchError("%s is a version %s recording, expected %d" % (path, events[0].get('version'), RECORDING_VERSION))
+	return events[1:]
+
+
+def parse_variant(text):
+	return GLib.Variant.parse(None, text, None, None)
+
+
+def format_options(values):
+	lines = []
+	for key, value in sorted(values.items()):
+		if isinstance(value, bool):
+			text = 'True' if value else 'False'
+		else:
+			text = '%d:%02d:%02d' % (value // 3600, value // 60 % 60, value % 60)
+		lines.append('%s:\t%s\n' % (key, text))
+	return ''.join(lines)
+
+
+class Replayer(object):
+	def __init__(self, env, events):
+		self._env = env
+		self._events = events
+		# one connection per recorded sender, so that calls from different
+		# clients can still overlap
+		self._connections = {}
+		self._schemas = Gio.SettingsSchemaSource.new_from_directory(os.path.join(env.work_dir, 'schemas'), None, False)
+		self._settings_path = os.path.join(env.work_dir, 'config', 'glib-2.0', 'settings', 'keyfile')
+		self._options_path = os.path.join(env.env['HOME'], '.xscreensaver')
+		# flags of each inhibitor, from the daemon's GetFlags calls
+		self._flags = {}
+		self._inhibitors = set()
+		self._handlers = {
+			'watcher': self._watcher,
+			'x-status': self._x_status,
+			'call': self._call,
+			'signal': self._signal,
+			'gsettings': self._gsettings,
+			'options': self._options
+		}
+		self.pending = 0
+		self.errors = 0
+		self.replayed = collections.Counter()
+		self.skipped = collections.Counter()
+		self.lag = []
+
+		os.makedirs(os.path.dirname(self._settings_path))
+		env.env.update({
+			'GSETTINGS_BACKEND': 'keyfile',
+			'XDG_CONFIG_HOME': os.path.join(env.work_dir, 'config')
+		})
+
+	def prepare(self):
+		# put things the way they were when the daemon started
+		inhibitors = None
+		active = None
+		for event in self._events:
+			kind = event['k']
+			if kind == 'options' and event['init']:
+				self._options(event)
+			elif kind == 'gsettings' and event['init']:
+				self._gsettings(event)
+			elif kind == 'reply' and 'args' in event:
+				method = event['method']
+				if method == 'GetFlags':
+					self._flags[event['path']] = parse_variant(event['args']).unpack()[0]
+				elif method == 'GetInhibitors' and inhibitors is None:
+					inhibitors = parse_variant(event['args']).unpack()[0]
+				elif method == 'Get' and event['path'].startswith(bench.FakeLogind.PATH) and active is None:
+					active = parse_variant(event['args']).unpack()[0]
+
+		for path in inhibitors or []:
+			self._env.gnome_session.add_inhibitor(self._flags.get(path, 0), path, emit=False)
+			self._inhibitors.add(path)
+		if active is not None:
+			self._env.logind.active = active
+
+	def run(self, speed):
+		started = time.monotonic()
+		for event in self._events:
+			kind = event['k']
+			handler = self._handlers.get(kind)
+			if handler is None or event.get('init'):
+				continue
+
+			if speed > 0:
+				due = started + event['t'] / speed
+				if time.monotonic() < due:
+					bench.wait_until(lambda: time.monotonic() >= due, due - time.monotonic() + 10)
+				self.lag.append(time.monotonic() - due)
+
+			if handler(event) is False:
+				self.skipped[kind] += 1
+			else:
+				self.replayed[kind] += 1
+
+		bench.wait_until(lambda: self.pending == 0, 60)
+		return time.monotonic() - started
+
+	def close(self):
+		for connection in self._connections.values():
+			connection.close_sync(None)
+		self._connections = {}
+
+	def _watcher(self, event):
+		paths = self._env.watchers()
+		if not paths:
+			return False
+		data = (event['line'] + '\n').encode()
+		for path in paths:
+			fd = os.open(path, os.O_WRONLY)
+			try:
+				os.write(fd, data)
+			finally:
+				os.close(fd)
+
+	def _x_status(self, event):
+		# there is no X display here, so the daemon has a watcher instead
+		return self._watcher({'line': '%s %s' % (event['state'], time.ctime(event['since']))})
+
+	def _call(self, event):
+		# the replay decides when the daemon stops
+		if event['name'] == 'Quit':
+			return False
+
+		connection = self._connections.get(event['sender'])
+		if connection is None:
+			connection = self._connections[event['sender']] = self._env.session_bus.connect()
+		self.pending += 1
+		connection.call(bench.GS_SERVICE, bench.GS_PATH, event['iface'], event['name'], parse_variant(event['args']), None, Gio.DBusCallFlags.NONE, -1, None, self._call_finished)
+
+	def _call_finished(self, source, result, *user_data):
+		self.pending -= 1
+		try:
+			source.call_finish(result)
+		except GLib.Error:
+			self.errors += 1
+
+	def _signal(self, event):
+		interface, name, path = event['iface'], event['name'], event['path']
+		parameters = parse_variant(event['args'])
+
+		if interface == bench.FakeGnomeSession.INTERFACE:
+			inhibitor = parameters.unpack()[0]
+			if name == 'InhibitorAdded' and inhibitor not in self._inhibitors:
+				self._env.gnome_session.add_inhibitor(self._flags.get(inhibitor, 0), inhibitor)
+				self._inhibitors.add(inhibitor)
+			elif name == 'InhibitorRemoved' and inhibitor in self._inhibitors:
+				self._env.gnome_session.remove_inhibitor(inhibitor)
+				self._inhibitors.discard(inhibitor)
+			else:
+				return False
+
+		elif interface == bench.FakeLogind.INTERFACE:
+			self._env.logind.manager.emit(interface, name, parameters)
+
+		# whichever session it was recorded for, it was the daemon's own
+		elif interface.startswith(LOGIND_PREFIX) or (interface == bench.DBUS_INTERFACE_PROPERTIES and path.startswith(bench.FakeLogind.PATH)):
+			if name == 'PropertiesChanged':
+				changed = parameters.unpack()[1]
+				if 'Active' in changed:
+					self._env.logind.active = changed['Active']
+			self._env.logind.session.emit(interface, name, parameters)
+
+		elif interface == bench.FakeConsoleKit.SESSION_INTERFACE:
+			self._env.console_kit.session.emit(interface, name, parameters)
+
+		else:
+			return False
+
+	def _gsettings(self, event):
+		schema = self._schemas.lookup(event['schema'], False)
+		if schema is None or not schema.has_key(event['key']):
+			return False
+
+		# the daemon writes to the same file, keep what it wrote
+		keyfile = GLib.KeyFile()
+		if os.path.exists(self._settings_path):
+			keyfile.load_from_file(self._settings_path, GLib.KeyFileFlags.NONE)
+		value = event['value']
+		if isinstance(value, bool):
+			value = 'true' if value else 'false'
+		keyfile.set_value(schema.get_path().strip('/'), event['key'], str(value))
+		keyfile.save_to_file(self._settings_path)
+
+	def _options(self, event):
+		# replaced rather than rewritten, like most editors do
+		tmp_path = self._options_path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			f.write(format_options(event['values']))
+		os.replace(tmp_path, self._options_path)
+
+
+def main(argv):
+	parser = optparse.OptionParser(usage="%prog [options] RECORDING", description="faux-gnome-screensaver-replay - replay a faux-gnome-screensaver --record file")
+	parser.add_option('-o', '--output', dest='output', help="Write results to FILE instead of standard output", metavar='FILE')
+	parser.add_option('--speed', type='float', dest='speed', default=1, help="Replay at this multiple of the recorded speed, 0 for as fast as possible [default: %default]")
+	parser.add_option('--trace', dest='trace', help="Write the daemon's trace (Chrome trace event format) to FILE", metavar='FILE')
+	parser.add_option('--record', dest='record', help="Have the daemon record the replay to FILE", metavar='FILE')
+	parser.add_option('--debug', action='store_true', dest='debug', default=False, help="Run the daemon with --debug")
+	parser.add_option('--keep', action='store_true', dest='keep', default=False, help="Keep the working directory (and daemon log)")
+
+	options, args = parser.parse_args(argv[1:])
+	if len(args) != 1:
+		parser.error("expected one recording")
+	if options.speed < 0:
+		parser.error("--speed cannot be negative")
+
+	try:
+		events = read_recording(args[0])
+	except (IOError, bench.BenchError) as err:
+		sys.stderr.write("%s\n" % err)
+		return 1
+
+	results = collections.OrderedDict([
+		('version', bench.RESULTS_VERSION),
+		('timestamp', int(time.time())),
+		('python', platform.python_version()),
+		('host', platform.node()),
+		('recording', os.path.basename(args[0])),
+		('speed', options.speed)
+	])
+
+	env = bench.BenchEnvironment(options)
+	replayer = Replayer(env, events)
+	try:
+		replayer.prepare()
+		env.start_daemon(['--record', os.path.abspath(options.record)] if options.record else [])
+		env.wait_ready()
+
+		elapsed = replayer.run(options.speed)
+		results['recorded_ms'] = events[-1]['t'] * 1000 if events else 0
+		results['elapsed_ms'] = elapsed * 1000
+		results['replayed'] = dict(replayer.replayed)
+		results['skipped'] = dict(replayer.skipped)
+		results['call_errors'] = replayer.errors
+		if options.speed > 0:
+			results['lag_ms'] = bench.stats(replayer.lag)
+		results['metrics'] = env.call_sync('GetMetrics', bench.FGS_INTERFACE)[0]
+
+		if options.trace:
+			with open(options.trace, 'w') as f:
+				f.write(env.call_sync('GetTrace', bench.FGS_INTERFACE)[0])
+	except bench.BenchError as err:
+		sys.stderr.write("%s (daemon log in %s)\n" % (err, os.path.join(env.work_dir, 'daemon.log')))
+		options.keep = True
+		return 1
+	finally:
+		replayer.close()
+		env.close()
+
+	output = json.dumps(results, indent=2) + '\n'
+	if options.output:
+		with open(options.output, 'w') as f:
+			f.write(output)
+	else:
+		sys.stdout.write(output)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
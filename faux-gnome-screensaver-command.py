@@ -19,10 +19,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import dbus
-import logging
 import optparse
 import os
+import socket
+import struct
 import sys
 
 VERSION = '0.3.0'
@@ -30,11 +30,239 @@ VERSION = '0.3.0'
 GS_SERVICE = 'org.gnome.ScreenSaver'
 GS_PATH = '/org/gnome/ScreenSaver'
 GS_INTERFACE = 'org.gnome.ScreenSaver'
+FGS_INTERFACE = 'com.github.jefferyto.FauxGnomeScreensaver'
 
-LOG = logging.getLogger(__name__)
+LOG_NAME = __name__
 LOG_FORMAT = '%(name)s %(levelname)s: %(message)s'
 
 
+def log_info(msg, *args):
+	# logging takes longer to import than the rest of a query, so only
+	# import it when there is something to log
+	import logging
+	logging.basicConfig(format=LOG_FORMAT, level=logging.INFO)
+	logging.getLogger(LOG_NAME).info(msg, *args)
+
+
+class BusError(Exception):
+	pass
+
+
+class RawBusClient(object):
+	# just enough of the D-Bus wire protocol to authenticate, say Hello and
+	# make a batch of method calls, all sent together and answered in a
+	# single round trip
+
+	BUS_SERVICE = 'org.freedesktop.DBus'
+	BUS_PATH = '/org/freedesktop/DBus'
+	BUS_INTERFACE = 'org.freedesktop.DBus'
+
+	METHOD_CALL = 1
+	METHOD_RETURN = 2
+	ERROR = 3
+
+	FIELD_PATH = 1
+	FIELD_INTERFACE = 2
+	FIELD_MEMBER = 3
+	FIELD_ERROR_NAME = 4
+	FIELD_REPLY_SERIAL = 5
+	FIELD_DESTINATION = 6
+	FIELD_SIGNATURE = 8
+
+	def __init__(self, path):
+		self._path = path
+		self._serial = 0
+		self._calls = []
+
+	@classmethod
+	def from_environment(cls):
+		address = os.environ.get('DBUS_SESSION_BUS_ADDRESS')
+		if not address:
+			runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+			return cls(os.path.join(runtime_dir, 'bus')) if runtime_dir else None
+
+		for entry in address.split(';'):
+			transport, sep, params = entry.partition(':')
+			if transport != 'unix':
+				continue
+			for param in params.split(','):
+				key, sep, value = param.partition('=')
+				if key == 'path':
+					return cls(cls._unescape(value))
+				if key == 'abstract':
+					return cls('\0' + cls._unescape(value))
+
+		return None
+
+	@staticmethod
+	def _unescape(value):
+		parts = value.split('%')
+		return parts[0] + ''.join(chr(int(part[:2], 16)) + part[2:] for part in parts[1:])
+
+	def add_call(self, destination, path, interface, member, signature='', args=()):
+		self._calls.append((destination, path, interface, member, signature, args))
+
+	def send(self):
+		data = bytearray(b'\0AUTH EXTERNAL ')
+		data.extend(str(os.getuid()).encode('ascii').hex().encode('ascii'))
+		data.extend(b'\r\nBEGIN\r\n')
+
+		serials = []
+		for call in [(self.BUS_SERVICE, self.BUS_PATH, self.BUS_INTERFACE, 'Hello', '', ())] + self._calls:
+			self._serial += 1
+			serials.append(self._serial)
+			data.extend(self._method_call(self._serial, *call))
+		self._calls = []
+
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			sock.connect(self._path)
+			sock.sendall(data)
+			return self._read_replies(sock, serials)[1:]
+		finally:
+			sock.close()
+
+	def _method_call(self, serial, destination, path, interface, member, signature, args):
+		body = bytearray()
+		for sig, value in zip(signature, args):
+			self._marshal(body, sig, value)
+
+		fields = bytearray()
+		for code, sig, value in [
+					(self.FIELD_PATH, 'o', path),
+					(self.FIELD_INTERFACE, 's', interface),
+					(self.FIELD_MEMBER, 's', member),
+					(self.FIELD_DESTINATION, 's', destination),
+					(self.FIELD_SIGNATURE, 'g', signature)
+				]:
+			if value:
+				self._pad(fields, 8)
+				fields.append(code)
+				self._marshal(fields, 'g', sig)
+				self._marshal(fields, sig, value)
+
+		message = bytearray(struct.pack('<cBBBIII', b'l', self.METHOD_CALL, 0, 1, len(body), serial, len(fields)))
+		message.extend(fields)
+		self._pad(message, 8)
+		message.extend(body)
+		return message
+
+	@staticmethod
+	def _pad(buf, align):
+		buf.extend(b'\0' * (-len(buf) % align))
+
+	def _marshal(self, buf, sig, value):
+		if sig == 'b' or sig == 'u':
+			self._pad(buf, 4)
+			buf.extend(struct.pack('<I', int(value)))
+		elif sig == 's' or sig == 'o':
+			data = value.encode('utf-8')
+			self._pad(buf, 4)
+			buf.extend(struct.pack('<I', len(data)))
+			buf.extend(data)
+			buf.append(0)
+		elif sig == 'g':
+			data = value.encode('ascii')
+			buf.append(len(data))
+			buf.extend(data)
+			buf.append(0)
+		else:
+			raise BusError("Cannot marshal type %s" % sig)
+
+	def _unmarshal(self, buf, offset, sig, endian):
+		if sig == 'b' or sig == 'u':
+			offset += -offset % 4
+			value = struct.unpack_from(endian + 'I', buf, offset)[0]
+			return (bool(value) if sig == 'b' else value), offset + 4
+		if sig == 's' or sig == 'o':
+			offset += -offset % 4
+			length = struct.unpack_from(endian + 'I', buf, offset)[0]
+			offset += 4
+			return bytes(buf[offset:offset + length]).decode('utf-8', 'replace'), offset + length + 1
+		if sig == 'g':
+			length = buf[offset]
+			return bytes(buf[offset + 1:offset + 1 + length]).decode('ascii'), offset + length + 2
+		raise BusError("Cannot unmarshal type %s" % sig)
+
+	def _read_replies(self, sock, serials):
+		buf = bytearray()
+
+		while b'\r\n' not in buf:
+			self._recv(sock, buf)
+		line, sep, rest = bytes(buf).partition(b'\r\n')
+		if not line.startswith(b'OK'):
+			raise BusError("Authentication failed: %s" % line.decode('ascii', 'replace'))
+		buf = bytearray(rest)
+
+		replies = {}
+		while len(replies) < len(serials):
+			while len(buf) < 16:
+				self._recv(sock, buf)
+			endian = '<' if buf[0:1] == b'l' else '>'
+			msg_type = buf[1]
+			body_length, serial, fields_length = struct.unpack_from(endian + 'III', buf, 4)
+			header_length = 16 + fields_length + (-fields_length % 8)
+			while len(buf) < header_length + body_length:
+				self._recv(sock, buf)
+
+			fields = {}
+			offset = 16
+			while offset < 16 + fields_length:
+				offset += -offset % 8
+				code = buf[offset]
+				sig, offset = self._unmarshal(buf, offset + 1, 'g', endian)
+				fields[code], offset = self._unmarshal(buf, offset, sig, endian)
+
+			# body alignment is relative to the start of the body
+			body = buf[header_length:header_length + body_length]
+			values = []
+			offset = 0
+			for sig in fields.get(self.FIELD_SIGNATURE, ''):
+				value, offset = self._unmarshal(body, offset, sig, endian)
+				values.append(value)
+
+			reply_serial = fields.get(self.FIELD_REPLY_SERIAL)
+			if msg_type == self.METHOD_RETURN and reply_serial in serials:
+				replies[reply_serial] = values[0] if values else None
+			elif msg_type == self.ERROR and reply_serial in serials:
+				message = values[0] if values else ''
+				raise BusError("%s: %s" % (fields.get(self.FIELD_ERROR_NAME), message))
+
+			del buf[:header_length + body_length]
+
+		return [replies[serial] for serial in serials]
+
+	def _recv(self, sock, buf):
+		data = sock.recv(4096)
+		if not data:
+			raise BusError("Connection closed by the bus")
+		buf.extend(data)
+
+
+class DBusPythonClient(object):
+	# fallback for bus addresses that RawBusClient does not understand
+
+	def __init__(self):
+		self._calls = []
+
+	def add_call(self, destination, path, interface, member, signature='', args=()):
+		self._calls.append((destination, path, interface, member, args))
+
+	def send(self):
+		import dbus
+
+		bus = dbus.SessionBus()
+		results = []
+		try:
+			for destination, path, interface, member, args in self._calls:
+				proxy = bus.get_object(destination, path, introspect=False)
+				results.append(proxy.get_dbus_method(member, interface)(*args))
+		except dbus.exceptions.DBusException as err:
+			raise BusError(str(err))
+		self._calls = []
+		return results
+
+
 def main(argv):
 	parser = optparse.OptionParser(description="faux-gnome-screensaver-command - controls faux-gnome-screensaver")
 	parser.add_option('--exit', action='store_true', dest='exit', default=False, help="Causes the screensaver to exit gracefully")
@@ -43,38 +271,64 @@ def main(argv):
 	parser.add_option('-l', '--lock', action='store_true', dest='lock', default=False, help="Tells the running screensaver process to lock the screen immediately")
 	parser.add_option('-a', '--activate', action='store_true', dest='activate', default=False, help="Turn the screensaver on (blank the screen)")
 	parser.add_option('-d', '--deactivate', action='store_true', dest='deactivate', default=False, help="If the screensaver is active then deactivate it (un-blank the screen)")
+	parser.add_option('--dump-trace', dest='dump_trace', help="Write recent activity of the screensaver to FILE, in Chrome trace format", metavar='FILE')
+	parser.add_option('--log-level', dest='log_level', help="Change how much the screensaver logs, one of DEBUG, INFO, WARNING, ERROR or CRITICAL", metavar='LEVEL')
 	parser.add_option('-V', '--version', action='store_true', dest='version', default=False, help="Version of this application")
 
 	options, args = parser.parse_args()
 
-	logging.basicConfig(format=LOG_FORMAT, level=logging.INFO)
-
 	if options.version:
 		print("%s %s" % (argv[0], VERSION))
 		return
 
-	bus = dbus.SessionBus()
+	# every call is sent in one batch, so the answers for -q and -t are
+	# read from the same replies
+	calls = []
+	if options.dump_trace:
+		# before anything else, so that the trace does not include this run
+		calls.append((FGS_INTERFACE, 'GetTrace', '', ()))
+	if options.log_level:
+		calls.append((FGS_INTERFACE, 'SetLogLevel', 's', (options.log_level,)))
+	if options.exit:
+		calls.append((GS_INTERFACE, 'Quit', '', ()))
+	else:
+		if options.query or options.time:
+			calls.append((GS_INTERFACE, 'GetActive', '', ()))
+		if options.time:
+			calls.append((GS_INTERFACE, 'GetActiveTime', '', ()))
+		if options.lock:
+			calls.append((GS_INTERFACE, 'Lock', '', ()))
+		if options.activate:
+			calls.append((GS_INTERFACE, 'SetActive', 'b', (True,)))
+		if options.deactivate:
+			calls.append((GS_INTERFACE, 'SetActive', 'b', (False,)))
+
+	if not calls:
+		return
+
+	client = RawBusClient.from_environment() or DBusPythonClient()
+	for interface, member, signature, args in calls:
+		client.add_call(GS_SERVICE, GS_PATH, interface, member, signature, args)
 	try:
-		proxy = bus.get_object(GS_SERVICE, GS_PATH)
-	except dbus.exceptions.DBusException as err:
-		LOG.info("Could not get dbus object: %s", err)
+		results = dict(zip([call[1] for call in calls], client.send()))
+	except (BusError, socket.error) as err:
+		log_info("Could not call %s: %s", GS_SERVICE, err)
 		return 1
-	iface = dbus.Interface(proxy, dbus_interface=GS_INTERFACE)
 
-	if options.exit:
-		iface.Quit()
-		return
+	if options.dump_trace:
+		with open(options.dump_trace, 'w') as f:
+			f.write(results['GetTrace'])
 
 	if options.query:
-		if iface.GetActive():
+		if results['GetActive']:
 			print("The screensaver is active")
 		else:
 			print("The screensaver is inactive")
 
 	if options.time:
-		if iface.GetActive():
+		if results['GetActive']:
 			# TODO use ngettext
-			seconds = iface.GetActiveTime()
+			seconds = results['GetActiveTime']
 			if seconds == 1:
 				print("The screensaver is has been active for 1 second.")
 			else:
@@ -82,21 +336,12 @@ def main(argv):
 		else:
 			print("The screensaver is not currently active.")
 
-	if options.lock:
-		iface.Lock()
-
-	if options.activate:
-		iface.SetActive(True)
-
-	if options.deactivate:
-		iface.SetActive(False)
-
 	
 if __name__ == '__main__':
 	argv = sys.argv
 	basename = os.path.basename(argv[0])
 
-	LOG = logging.getLogger(basename)
+	LOG_NAME = basename
 
 	sys.exit(main(argv))
 
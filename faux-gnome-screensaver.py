@@ -20,28 +20,1170 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from gi.repository import GLib, GObject, Gio
+import collections
+import contextlib
 import ctypes
-import datetime
-import dbus
-import dbus.service
-from dbus.mainloop.glib import DBusGMainLoop
+import ctypes.util
+import errno
+import fcntl
+import json
 import logging
 import optparse
 import os
 import re
 import signal
-import subprocess
+import socket
+import struct
 import sys
 import time
 
 LOG = logging.getLogger(__name__)
 LOG_FORMAT = '%(asctime)s %(name)s %(levelname)s: %(message)s'
 
+STARTUP_TIME = time.monotonic()
+
+
+def startup_ms():
+	return (time.monotonic() - STARTUP_TIME) * 1000
+
+
+def dbus_call(connection, bus_name, object_path, interface_name, method_name, parameters, reply_handler, error_handler):
+	trace_id = TRACER.current
+	started = time.monotonic()
+
+	def finish(source, result, *user_data):
+		TRACER.add('dbus-call:' + method_name, started, time.monotonic(), trace_id)
+		with TRACER.resume(trace_id):
+			try:
+				reply = source.call_finish(result)
+			except GLib.Error as err:
+				RECORDER.record('reply', method=method_name, path=object_path, error=err.message)
+				error_handler(err.message)
+				return
+			if RECORDER.active:
+				RECORDER.record('reply', method=method_name, path=object_path, args=reply.print_(True))
+			reply_handler(*reply.unpack())
+
+	connection.call(bus_name, object_path, interface_name, method_name, parameters, None, Gio.DBusCallFlags.NONE, -1, None, finish)
+
+
+# handler is called with the sender path followed by the signal arguments
+# object_path and arg0 narrow the match rule, so that the bus does not send
+# us signals only to have them ignored
+# display labels the metrics and traces of a supervised display's signals
+def dbus_subscribe(connection, bus_name, interface_name, signal_name, object_path, handler, arg0=None, display=None):
+	def received(connection, sender, path, interface, signal, parameters, *user_data):
+		METRICS.count('wakeups_total', source='dbus-signal', display=display)
+		if RECORDER.active:
+			RECORDER.record('signal', sender=sender, path=path, iface=interface, name=signal, args=parameters.print_(True))
+		with TRACER.trigger('signal:' + signal, sender=sender, path=path, display=display):
+			handler(path, *parameters.unpack())
+
+	return connection.signal_subscribe(bus_name, interface_name, signal_name, object_path, arg0, Gio.DBusSignalFlags.NONE, received)
+
+
+class Metrics(object):
+	PREFIX = 'faux_gnome_screensaver_'
+
+	WRITE_INTERVAL = 15 # in seconds
+
+	# upper bounds in seconds
+	BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5]
+
+	def __init__(self):
+		# keyed by (name, labels), labels being a sorted tuple of pairs
+		self._counters = collections.defaultdict(int)
+		self._histograms = {}
+		self.version = 0
+
+	# labels that are None are left out, e.g. display outside --supervise
+	@staticmethod
+	def _labels(labels):
+		return tuple(sorted((k, v) for k, v in labels.items() if v is not None))
+
+	def count(self, name, value=1, **labels):
+		self._counters[(name, self._labels(labels))] += value
+		self.version += 1
+
+	def observe(self, name, seconds, **labels):
+		key = (name, self._labels(labels))
+		histogram = self._histograms.get(key)
+		if histogram is None:
+			histogram = self._histograms[key] = {'buckets': [0] * len(self.BUCKETS), 'count': 0, 'sum': 0.0}
+		for i, bound in enumerate(self.BUCKETS):
+			if seconds <= bound:
+				histogram['buckets'][i] += 1
+				break
+		histogram['count'] += 1
+		histogram['sum'] += seconds
+		self.version += 1
+
+	@staticmethod
+	def _series(name, labels):
+		if not labels:
+			return name
+		return '%s{%s}' % (name, ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels))
+
+	# displays, if given, picks the series of those displays, '' being
+	# the ones that belong to the whole process (logind, GSettings)
+	@staticmethod
+	def _selected(labels, displays):
+		return displays is None or dict(labels).get('display', '') in displays
+
+	def samples(self, extra_labels=(), displays=None):
+		extra_labels = tuple(extra_labels)
+		for (name, labels), value in sorted(self._counters.items()):
+			if self._selected(labels, displays):
+				yield self.PREFIX + name, 'counter', self._series(self.PREFIX + name, extra_labels + labels), value
+
+		for (name, labels), histogram in sorted(self._histograms.items()):
+			if not self._selected(labels, displays):
+				continue
+			name = self.PREFIX + name
+			labels = extra_labels + labels
+			cumulative = 0
+			for bound, count in zip(self.BUCKETS, histogram['buckets']):
+				cumulative += count
+				yield name, 'histogram', self._series(name + '_bucket', labels + (('le', repr(bound)),)), cumulative
+			yield name, 'histogram', self._series(name + '_bucket', labels + (('le', '+Inf'),)), histogram['count']
+			yield name, 'histogram', self._series(name + '_sum', labels), histogram['sum']
+			yield name, 'histogram', self._series(name + '_count', labels), histogram['count']
+
+	def as_dict(self, displays=None):
+		return dict((series, float(value)) for name, kind, series, value in self.samples(displays=displays))
+
+	# Prometheus text exposition format
+	def as_text(self, extra_labels=(), displays=None):
+		lines = []
+		typed = set()
+		for name, kind, series, value in self.samples(extra_labels, displays):
+			if name not in typed:
+				typed.add(name)
+				lines.append('# TYPE %s %s' % (name, kind))
+			lines.append('%s %s' % (series, value))
+		return '\n'.join(lines) + '\n'
+
+	def write_file(self, path, extra_labels=(), displays=None):
+		# write then rename so that readers never see a partial file
+		tmp_path = path + '.tmp'
+		try:
+			with open(tmp_path, 'w') as f:
+				f.write(self.as_text(extra_labels, displays))
+			os.replace(tmp_path, path)
+		except OSError as err:
+			LOG.error("Cannot write metrics to %s: %s", path, err)
+			return False
+		return True
+
+
+METRICS = Metrics()
+
+
+class Tracer(object):
+	RING_SIZE = 4096 # spans
+
+	def __init__(self):
+		# (name, started, ended, trace id, asynchronous, args)
+		self._spans = collections.deque(maxlen=self.RING_SIZE)
+		self._next_id = 1
+		# the trigger whose work is being done, if any
+		self.current = None
+
+	@contextlib.contextmanager
+	def trigger(self, name, **args):
+		# starts a new trace, for something that happened outside the daemon
+		trace_id = self._next_id
+		self._next_id += 1
+		with self.resume(trace_id):
+			with self.span(name, **args):
+				yield
+
+	@contextlib.contextmanager
+	def resume(self, trace_id):
+		# continues a trace in a later callback
+		previous = self.current
+		self.current = trace_id
+		try:
+			yield
+		finally:
+			self.current = previous
+
+	@contextlib.contextmanager
+	def span(self, name, **args):
+		started = time.monotonic()
+		try:
+			yield
+		finally:
+			self.add(name, started, time.monotonic(), self.current, False, **args)
+
+	# asynchronous spans can overlap other work, e.g. a child process
+	def add(self, name, started, ended, trace_id, asynchronous=True, **args):
+		args = dict((k, v) for k, v in args.items() if v is not None)
+		self._spans.append((name, started, ended, trace_id, asynchronous, args))
+
+	# Chrome / Perfetto trace event format; display, if given, leaves out
+	# the traces started by other supervised displays
+	def as_json(self, display=None):
+		displays = {}
+		for name, started, ended, trace_id, asynchronous, args in self._spans:
+			if 'display' in args:
+				displays[trace_id] = args['display']
+
+		pid = os.getpid()
+		events = []
+		for name, started, ended, trace_id, asynchronous, args in self._spans:
+			if display is not None and displays.get(trace_id, display) != display:
+				continue
+			args = dict(args, trace_id=trace_id)
+			event = {'name': name, 'cat': name.split(':', 1)[0], 'pid': pid, 'tid': pid, 'args': args}
+			if asynchronous:
+				events.append(dict(event, ph='b', id=trace_id or 0, ts=started * 1e6))
+				events.append(dict(event, ph='e', id=trace_id or 0, ts=ended * 1e6))
+			else:
+				events.append(dict(event, ph='X', ts=started * 1e6, dur=(ended - started) * 1e6))
+		return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+
+
+TRACER = Tracer()
+
+
+# writes every input the daemon receives, one JSON object per line, so
+# that a session can be replayed later (see bench/)
+class Recorder(object):
+	VERSION = 1
+
+	def __init__(self):
+		self._file = None
+		self._started = None
+
+	@property
+	def active(self):
+		return self._file is not None
+
+	def open(self, path):
+		# line buffered, so that a crash loses at most the current line
+		self._file = open(path, 'w', buffering=1)
+		self._started = time.monotonic()
+		self.record('start', version=self.VERSION, pid=os.getpid(), display=os.environ.get('DISPLAY', ''))
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+		self._file = None
+		self._started = None
+
+	# t is in seconds since the recording started, k is the kind of input
+	def record(self, kind, **fields):
+		if self._file is None:
+			return
+		fields['t'] = round(time.monotonic() - self._started, 6)
+		fields['k'] = kind
+		try:
+			self._file.write(json.dumps(fields, separators=(',', ':'), sort_keys=True) + '\n')
+		except (IOError, OSError) as err:
+			LOG.error("Cannot record, stopping: %s", err)
+			self.close()
+
+
+RECORDER = Recorder()
+
+
+# writes to journald's native protocol, so that structured fields survive
+class JournalHandler(logging.Handler):
+	SOCKET_PATH = '/run/systemd/journal/socket'
+
+	def __init__(self, identifier):
+		logging.Handler.__init__(self)
+		self._identifier = identifier
+		self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+	@classmethod
+	def available(cls):
+		return os.path.exists(cls.SOCKET_PATH)
+
+	# systemd sets JOURNAL_STREAM when stderr is connected to the journal
+	@staticmethod
+	def stderr_is_journal():
+		stream = os.environ.get('JOURNAL_STREAM')
+		if not stream:
+			return False
+		try:
+			st = os.fstat(sys.stderr.fileno())
+		except (OSError, ValueError):
+			return False
+		return stream == '%d:%d' % (st.st_dev, st.st_ino)
+
+	@staticmethod
+	def priority(levelno):
+		if levelno >= logging.CRITICAL:
+			return 2
+		if levelno >= logging.ERROR:
+			return 3
+		if levelno >= logging.WARNING:
+			return 4
+		if levelno >= logging.INFO:
+			return 6
+		return 7
+
+	@staticmethod
+	def _field(name, value):
+		name = name.encode('ascii')
+		value = str(value).encode('utf-8', 'replace')
+		if b'\n' in value:
+			return name + b'\n' + struct.pack('<Q', len(value)) + value + b'\n'
+		return name + b'=' + value + b'\n'
+
+	# only called for records that pass the level checks, so nothing is
+	# formatted for messages that are dropped
+	def emit(self, record):
+		try:
+			fields = [
+				('MESSAGE', self.format(record)),
+				('PRIORITY', self.priority(record.levelno)),
+				('SYSLOG_IDENTIFIER', self._identifier),
+				('LOGGER', record.name),
+				('CODE_FILE', record.pathname),
+				('CODE_LINE', record.lineno),
+				('CODE_FUNC', record.funcName)
+			]
+			if TRACER.current is not None:
+				fields.append(('TRACE_ID', TRACER.current))
+			for name, value in getattr(record, 'journal_fields', {}).items():
+				if value is not None:
+					fields.append((name.upper(), value))
+			data = b''.join(self._field(n, v) for n, v in fields)
+			try:
+				self._socket.sendto(data, self.SOCKET_PATH)
+			except OSError as err:
+				if err.errno not in (errno.EMSGSIZE, errno.ENOBUFS) or not hasattr(os, 'memfd_create'):
+					raise
+				self._send_memfd(data)
+		except Exception:
+			self.handleError(record)
+
+	# too big for one datagram (e.g. a long traceback), so pass journald a
+	# sealed memfd instead, as sd_journal_send() does
+	def _send_memfd(self, data):
+		fd = os.memfd_create('journal-message', os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+		try:
+			with os.fdopen(os.dup(fd), 'wb') as f:
+				f.write(data)
+			fcntl.fcntl(fd, fcntl.F_ADD_SEALS, fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_GROW | fcntl.F_SEAL_WRITE | fcntl.F_SEAL_SEAL)
+			self._socket.sendmsg([], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, struct.pack('i', fd))], 0, self.SOCKET_PATH)
+		finally:
+			os.close(fd)
+
+	def close(self):
+		self._socket.close()
+		logging.Handler.close(self)
+
+
+def journal_fields(**fields):
+	return {'journal_fields': fields}
+
+
+class XClientMessageData(ctypes.Union):
+	_fields_ = [
+		('b', ctypes.c_char * 20),
+		('s', ctypes.c_short * 10),
+		('l', ctypes.c_long * 5)
+	]
+
+
+class XClientMessageEvent(ctypes.Structure):
+	_fields_ = [
+		('type', ctypes.c_int),
+		('serial', ctypes.c_ulong),
+		('send_event', ctypes.c_int),
+		('display', ctypes.c_void_p),
+		('window', ctypes.c_ulong),
+		('message_type', ctypes.c_ulong),
+		('format', ctypes.c_int),
+		('data', XClientMessageData)
+	]
+
+
+class XPropertyEvent(ctypes.Structure):
+	_fields_ = [
+		('type', ctypes.c_int),
+		('serial', ctypes.c_ulong),
+		('send_event', ctypes.c_int),
+		('display', ctypes.c_void_p),
+		('window', ctypes.c_ulong),
+		('atom', ctypes.c_ulong),
+		('time', ctypes.c_ulong),
+		('state', ctypes.c_int)
+	]
+
+
+class XEvent(ctypes.Union):
+	_fields_ = [
+		('type', ctypes.c_int),
+		('xclient', XClientMessageEvent),
+		('xproperty', XPropertyEvent),
+		('pad', ctypes.c_long * 24)
+	]
+
+
+class XErrorEvent(ctypes.Structure):
+	_fields_ = [
+		('type', ctypes.c_int),
+		('display', ctypes.c_void_p),
+		('resourceid', ctypes.c_ulong),
+		('serial', ctypes.c_ulong),
+		('error_code', ctypes.c_ubyte),
+		('request_code', ctypes.c_ubyte),
+		('minor_code', ctypes.c_ubyte)
+	]
+
+
+class XScreenSaverInfo(ctypes.Structure):
+	_fields_ = [
+		('window', ctypes.c_ulong),
+		('state', ctypes.c_int),
+		('kind', ctypes.c_int),
+		('til_or_since', ctypes.c_ulong),
+		('idle', ctypes.c_ulong),
+		('eventMask', ctypes.c_ulong)
+	]
+
+
+X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(XErrorEvent))
+X_IO_ERROR_EXIT_HANDLER = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p)
+
+
+class XScreenSaverClient(object):
+	# speaks the same ClientMessage protocol as xscreensaver-command, over a
+	# single persistent display connection
+
+	XA_STRING = 31
+	XA_INTEGER = 19
+	CLIENT_MESSAGE = 33
+	PROPERTY_NOTIFY = 28
+	PROPERTY_CHANGE_MASK = 1 << 22
+
+	COMMANDS = {
+		'activate': 'ACTIVATE',
+		'deactivate': 'DEACTIVATE',
+		'lock': 'LOCK',
+		'exit': 'EXIT'
+	}
+
+	# Xlib has one error handler per process, shared by every open client
+	_clients = {}
+	_error_handler = None
+	_old_error_handler = None
+	_io_error_exit_handler = None
+
+	def __init__(self, display_name=None):
+		self._display_name = display_name
+		self._xlib = None
+		self._xss = None
+		self._xss_info = None
+		self._xext = None
+		self._display = None
+		self._root = None
+		self._atoms = None
+		self._window = None
+		self._error_code = None
+		self._status_callback = None
+		self._event = None
+		self._event_id = None
+		self._check_id = None
+		self._socket = None
+		self._lost = False
+		self._lost_callback = None
+		self._lost_id = None
+		self._survives_io_errors = False
+
+	def open(self):
+		path = ctypes.util.find_library('X11') or 'libX11.so.6'
+		try:
+			xlib = ctypes.cdll.LoadLibrary(path)
+		except OSError as err:
+			LOG.debug("Cannot load Xlib: %s", err)
+			return False
+
+		xlib.XOpenDisplay.restype = ctypes.c_void_p
+		xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+		xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+		xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+		xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+		xlib.XInternAtom.restype = ctypes.c_ulong
+		xlib.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+		xlib.XQueryTree.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.POINTER(ctypes.c_ulong)), ctypes.POINTER(ctypes.c_uint)]
+		xlib.XGetWindowProperty.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_long, ctypes.c_long, ctypes.c_int, ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_void_p)]
+		xlib.XSendEvent.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_long, ctypes.POINTER(XEvent)]
+		xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+		xlib.XFree.argtypes = [ctypes.c_void_p]
+		xlib.XSetErrorHandler.restype = ctypes.c_void_p
+		xlib.XSetErrorHandler.argtypes = [ctypes.c_void_p]
+		xlib.XSelectInput.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_long]
+		xlib.XFlush.argtypes = [ctypes.c_void_p]
+		xlib.XConnectionNumber.argtypes = [ctypes.c_void_p]
+		xlib.XPending.argtypes = [ctypes.c_void_p]
+		xlib.XEventsQueued.argtypes = [ctypes.c_void_p, ctypes.c_int]
+		xlib.XNextEvent.argtypes = [ctypes.c_void_p, ctypes.POINTER(XEvent)]
+
+		# by default Xlib exits the process when the connection to the X
+		# server is lost, which would take every other display with it;
+		# libX11 1.7 and later can call us instead
+		survives_io_errors = hasattr(xlib, 'XSetIOErrorExitHandler')
+		if not survives_io_errors and self._display_name is not None:
+			LOG.debug("libX11 is older than 1.7, not keeping a connection to display %s", self._display_name)
+			return False
+
+		name = self._display_name.encode('utf-8') if self._display_name else None
+		display = xlib.XOpenDisplay(name)
+		if not display:
+			LOG.debug("Cannot open display %s", self._display_name or os.environ.get('DISPLAY'))
+			return False
+
+		self._xlib = xlib
+		self._display = display
+		self._root = xlib.XDefaultRootWindow(display)
+
+		# the default Xlib error handler exits the process
+		cls = XScreenSaverClient
+		if not cls._clients:
+			cls._error_handler = X_ERROR_HANDLER(cls._handle_error)
+			cls._old_error_handler = xlib.XSetErrorHandler(ctypes.cast(cls._error_handler, ctypes.c_void_p))
+		cls._clients[display] = self
+
+		if survives_io_errors:
+			xlib.XSetIOErrorExitHandler.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+			if cls._io_error_exit_handler is None:
+				cls._io_error_exit_handler = X_IO_ERROR_EXIT_HANDLER(cls._handle_io_error)
+			xlib.XSetIOErrorExitHandler(display, ctypes.cast(cls._io_error_exit_handler, ctypes.c_void_p), None)
+		self._survives_io_errors = survives_io_errors
+
+		self._atoms = {}
+		for name in ['XSCREENSAVER', '_SCREENSAVER_VERSION', '_SCREENSAVER_STATUS', 'BLANK', 'LOCK'] + list(self.COMMANDS.values()):
+			self._atoms[name] = xlib.XInternAtom(display, name.encode('ascii'), False)
+
+		self._open_xss()
+		self._open_dpms()
+
+		LOG.debug("Opened X display connection for xscreensaver commands")
+		return True
+
+	def _open_xss(self):
+		path = ctypes.util.find_library('Xss') or 'libXss.so.1'
+		try:
+			xss = ctypes.cdll.LoadLibrary(path)
+		except OSError as err:
+			LOG.debug("Cannot load libXss, idle time is not available: %s", err)
+			return
+
+		xss.XScreenSaverQueryExtension.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+		xss.XScreenSaverQueryInfo.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XScreenSaverInfo)]
+
+		event_base = ctypes.c_int()
+		error_base = ctypes.c_int()
+		if not xss.XScreenSaverQueryExtension(self._display, ctypes.byref(event_base), ctypes.byref(error_base)):
+			LOG.debug("MIT-SCREEN-SAVER extension is not available, idle time is not available")
+			return
+
+		self._xss = xss
+		self._xss_info = XScreenSaverInfo()
+
+	def _open_dpms(self):
+		path = ctypes.util.find_library('Xext') or 'libXext.so.6'
+		try:
+			xext = ctypes.cdll.LoadLibrary(path)
+		except OSError as err:
+			LOG.debug("Cannot load libXext, DPMS is not available: %s", err)
+			return
+
+		xext.DPMSQueryExtension.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+		xext.DPMSCapable.argtypes = [ctypes.c_void_p]
+		xext.DPMSInfo.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_ushort), ctypes.POINTER(ctypes.c_ubyte)]
+		xext.DPMSEnable.argtypes = [ctypes.c_void_p]
+		xext.DPMSDisable.argtypes = [ctypes.c_void_p]
+
+		event_base = ctypes.c_int()
+		error_base = ctypes.c_int()
+		if not xext.DPMSQueryExtension(self._display, ctypes.byref(event_base), ctypes.byref(error_base)) or not xext.DPMSCapable(self._display):
+			LOG.debug("DPMS extension is not available")
+			return
+
+		self._xext = xext
+
+	def close(self):
+		if self._event_id is not None:
+			GLib.source_remove(self._event_id)
+
+		if self._check_id is not None:
+			GLib.source_remove(self._check_id)
+
+		if self._lost_id is not None:
+			GLib.source_remove(self._lost_id)
+
+		if self._socket is not None:
+			self._socket.close()
+
+		if self._display:
+			cls = XScreenSaverClient
+			del cls._clients[self._display]
+			if not cls._clients:
+				self._xlib.XSetErrorHandler(cls._old_error_handler)
+				cls._error_handler = None
+				cls._old_error_handler = None
+			if self._lost and not self._survives_io_errors:
+				# closing would find the connection gone and exit
+				LOG.debug("Leaving lost X display connection open")
+			else:
+				self._xlib.XCloseDisplay(self._display)
+				LOG.debug("Closed X display connection for xscreensaver commands")
+
+		self._xlib = None
+		self._xss = None
+		self._xss_info = None
+		self._xext = None
+		self._display = None
+		self._root = None
+		self._atoms = None
+		self._window = None
+		self._error_code = None
+		self._status_callback = None
+		self._event = None
+		self._event_id = None
+		self._check_id = None
+		self._socket = None
+		self._lost = False
+		self._lost_callback = None
+		self._lost_id = None
+		self._survives_io_errors = False
+
+	def watch_status(self, callback, lost_callback):
+		# xscreensaver updates _SCREENSAVER_STATUS on the root window when it
+		# starts and whenever its state changes
+		self._status_callback = callback
+		self._lost_callback = lost_callback
+		self._event = XEvent()
+		self._xlib.XSelectInput(self._display, self._root, self.PROPERTY_CHANGE_MASK)
+		self._xlib.XFlush(self._display)
+		fd = self._xlib.XConnectionNumber(self._display)
+		# to see the server hang up before Xlib does
+		self._socket = socket.socket(fileno=os.dup(fd))
+		self._event_id = GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._read_events)
+
+	def _server_gone(self, condition):
+		if condition & (GLib.IO_HUP | GLib.IO_ERR):
+			return True
+		try:
+			return not self._socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+		except BlockingIOError:
+			return False
+		except OSError:
+			return True
+
+	def _connection_lost(self):
+		if self._lost:
+			return
+		self._lost = True
+		LOG.warning("Lost connection to X display %s", self._display_name or os.environ.get('DISPLAY'))
+		if self._event_id is not None:
+			GLib.source_remove(self._event_id)
+			self._event_id = None
+		if self._lost_callback and self._lost_id is None:
+			# not from inside Xlib
+			self._lost_id = GLib.idle_add(self._report_lost)
+
+	def _report_lost(self):
+		self._lost_id = None
+		self._lost_callback()
+		return False
+
+	def _read_events(self, fd=None, condition=None):
+		received = time.monotonic()
+		if fd is None:
+			self._check_id = None
+		METRICS.count('wakeups_total', source='x-events', display=self._display_name)
+
+		if self._lost:
+			return False
+		if fd is not None and self._server_gone(condition):
+			# Xlib must not be the one to find out
+			self._event_id = None
+			self._connection_lost()
+			return False
+
+		changed = False
+		event = self._event
+		status_atom = self._atoms['_SCREENSAVER_STATUS']
+		while self._xlib.XPending(self._display):
+			self._xlib.XNextEvent(self._display, ctypes.byref(event))
+			if event.type == self.PROPERTY_NOTIFY and event.xproperty.atom == status_atom:
+				changed = True
+
+		if changed:
+			with TRACER.trigger('x:status', display=self._display_name):
+				self._status_callback(received)
+
+		return fd is not None
+
+	def _check_events(self):
+		# round trips can move events into Xlib's queue without the
+		# connection becoming readable again
+		if self._status_callback and not self._lost and self._check_id is None and self._xlib.XEventsQueued(self._display, 0):
+			self._check_id = GLib.idle_add(self._read_events)
+
+	@classmethod
+	def _handle_error(cls, display, event):
+		# passed on to the client for the display the error came from
+		client = cls._clients.get(display)
+		if client is not None:
+			client._error_code = event.contents.error_code
+		return 0
+
+	@classmethod
+	def _handle_io_error(cls, display, user_data):
+		# Xlib treats the connection as dead from here on
+		client = cls._clients.get(display)
+		if client is not None:
+			client._connection_lost()
+
+	def _sync(self):
+		self._error_code = None
+		self._xlib.XSync(self._display, False)
+		self._check_events()
+		return self._error_code is None
+
+	def _get_property(self, window, atom, prop_type, length):
+		actual_type = ctypes.c_ulong()
+		actual_format = ctypes.c_int()
+		nitems = ctypes.c_ulong()
+		bytes_after = ctypes.c_ulong()
+		data = ctypes.c_void_p()
+
+		self._error_code = None
+		status = self._xlib.XGetWindowProperty(self._display, window, atom, 0, length, False, prop_type,
+			ctypes.byref(actual_type), ctypes.byref(actual_format), ctypes.byref(nitems), ctypes.byref(bytes_after), ctypes.byref(data))
+		self._check_events()
+		if status != 0 or self._error_code is not None or not actual_type.value:
+			if data.value:
+				self._xlib.XFree(data)
+			return None
+
+		if actual_format.value == 32:
+			# format 32 properties are returned as an array of longs
+			values = list(ctypes.cast(data, ctypes.POINTER(ctypes.c_long))[:nitems.value])
+		else:
+			values = ctypes.string_at(data, nitems.value)
+		self._xlib.XFree(data)
+		return values
+
+	def find_window(self):
+		if self._lost:
+			return None
+
+		root_return = ctypes.c_ulong()
+		parent_return = ctypes.c_ulong()
+		children = ctypes.POINTER(ctypes.c_ulong)()
+		nchildren = ctypes.c_uint()
+
+		window = None
+		if self._xlib.XQueryTree(self._display, self._root, ctypes.byref(root_return), ctypes.byref(parent_return), ctypes.byref(children), ctypes.byref(nchildren)):
+			for i in range(nchildren.value):
+				if self._get_property(children[i], self._atoms['_SCREENSAVER_VERSION'], self.XA_STRING, 200) is not None:
+					window = children[i]
+					break
+			if children:
+				self._xlib.XFree(children)
+
+		return window
+
+	def send_command(self, cmd):
+		if not self._display or self._lost or cmd not in self.COMMANDS:
+			return False
+
+		# the xscreensaver window changes if xscreensaver is restarted, so
+		# look for it again once before giving up
+		for attempt in range(2):
+			if self._window is None:
+				self._window = self.find_window()
+				if self._window is None:
+					LOG.debug("Cannot find xscreensaver window")
+					return False
+
+			event = XEvent()
+			event.xclient.type = self.CLIENT_MESSAGE
+			event.xclient.display = self._display
+			event.xclient.window = self._window
+			event.xclient.message_type = self._atoms['XSCREENSAVER']
+			event.xclient.format = 32
+			event.xclient.data.l[0] = self._atoms[self.COMMANDS[cmd]]
+
+			LOG.debug("Sending %s to xscreensaver window 0x%x", self.COMMANDS[cmd], self._window)
+			self._xlib.XSendEvent(self._display, self._window, False, 0, ctypes.byref(event))
+			if self._sync():
+				return True
+
+			LOG.debug("  failed with X error %d", self._error_code)
+			self._window = None
+
+		return False
+
+	def get_idle_time(self):
+		# time since the last user input, in seconds
+		if not self._xss or self._lost:
+			return None
+
+		if not self._xss.XScreenSaverQueryInfo(self._display, self._root, ctypes.byref(self._xss_info)):
+			return None
+		self._check_events()
+		return self._xss_info.idle / 1000.0
+
+	def get_dpms(self):
+		if not self._xext or self._lost:
+			return None
+
+		power_level = ctypes.c_ushort()
+		state = ctypes.c_ubyte()
+		if not self._xext.DPMSInfo(self._display, ctypes.byref(power_level), ctypes.byref(state)):
+			return None
+		self._check_events()
+		return bool(state.value)
+
+	def set_dpms(self, enable):
+		if not self._xext or self._lost:
+			return False
+
+		if enable:
+			self._xext.DPMSEnable(self._display)
+		else:
+			self._xext.DPMSDisable(self._display)
+		return self._sync()
+
+	def get_status(self):
+		if not self._display or self._lost:
+			return None
+
+		values = self._get_property(self._root, self._atoms['_SCREENSAVER_STATUS'], self.XA_INTEGER, 999)
+		if not values or len(values) < 2:
+			return None
+
+		blank_atom = values[0] & 0xffffffff
+		if blank_atom == self._atoms['LOCK']:
+			state = 'LOCK'
+		elif blank_atom == self._atoms['BLANK']:
+			state = 'BLANK'
+		else:
+			state = 'UNBLANK'
+		return state, values[1] & 0xffffffff
+
+
+class XScreenSaverOptions(GObject.GObject):
+	__gsignals__ = {
+		'changed': (GObject.SignalFlags.RUN_LAST | GObject.SignalFlags.DETAILED, None, (str,))
+	}
+
+	RELOAD_DELAY = 250 # in milliseconds
+
+	# option name: (type, default value), using xscreensaver's own defaults
+	OPTIONS = {
+		'timeout': ('duration', 600),
+		'cycle': ('duration', 600),
+		'lock': ('boolean', False),
+		'lockTimeout': ('duration', 0),
+		'dpmsEnabled': ('boolean', False),
+		'dpmsStandby': ('duration', 7200),
+		'dpmsSuspend': ('duration', 7200),
+		'dpmsOff': ('duration', 14400)
+	}
+
+	def __init__(self, path, display=None):
+		self._path = path
+		# only labels metrics and traces
+		self._display = display
+		self._values = None
+		self._stat = None
+		self._monitor = None
+		self._monitor_id = None
+		self._reload_id = None
+
+		super(XScreenSaverOptions, self).__init__()
+
+	def activate(self):
+		self._values = dict((key, info[1]) for key, info in self.OPTIONS.items())
+		self._reload(init=True)
+
+		# editors that save by renaming a new file into place generate a burst
+		# of events, so wait for things to settle before looking at the file
+		gfile = Gio.file_new_for_path(self._path)
+		self._monitor = gfile.monitor_file(Gio.FileMonitorFlags.WATCH_MOVES, None)
+		self._monitor_id = self._monitor.connect('changed', self._file_changed)
+
+	def deactivate(self):
+		if self._reload_id is not None:
+			GLib.source_remove(self._reload_id)
+
+		if self._monitor:
+			self._monitor.disconnect(self._monitor_id)
+			self._monitor.cancel()
+
+		self._values = None
+		self._stat = None
+		self._monitor = None
+		self._monitor_id = None
+		self._reload_id = None
+
+	def __getitem__(self, key):
+		return self._values[key]
+
+	def _file_changed(self, monitor, gfile, other_gfile, event_type):
+		METRICS.count('wakeups_total', source='options-file', display=self._display)
+		with TRACER.trigger('file-monitor:' + event_type.value_nick, display=self._display):
+			if self._reload_id is not None:
+				GLib.source_remove(self._reload_id)
+			self._reload_id = GLib.timeout_add(self.RELOAD_DELAY, self._delayed_reload, TRACER.current)
+
+	def _delayed_reload(self, trace_id):
+		with TRACER.resume(trace_id):
+			with TRACER.span('options:reload'):
+				return self._reload()
+
+	def _reload(self, init=False):
+		self._reload_id = None
+
+		try:
+			st = os.stat(self._path)
+			stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+		except OSError:
+			stat = None
+
+		if stat == self._stat and not init:
+			LOG.debug("%s has not changed, skipping", self._path)
+			return False
+		self._stat = stat
+
+		values = dict((key, info[1]) for key, info in self.OPTIONS.items())
+		if stat is not None:
+			LOG.debug("Reading %s", self._path)
+			try:
+				with open(self._path, 'r') as f:
+					for line in f:
+						key, sep, value = line.partition(':')
+						key = key.strip()
+						if sep and key in self.OPTIONS:
+							parsed = self._parse(self.OPTIONS[key][0], value.strip())
+							if parsed is not None:
+								values[key] = parsed
+							else:
+								LOG.debug("  cannot parse %s: %s", key, value.strip())
+			except IOError as err:
+				LOG.debug("  failed: %s", err)
+		else:
+			LOG.debug("%s does not exist, using defaults", self._path)
+
+		changed = [key for key in values if values[key] != self._values[key]]
+		if changed or init:
+			RECORDER.record('options', values=values, init=init)
+		self._values = values
+		for key in changed:
+			LOG.debug("  %s is now %s", key, values[key])
+			if not init:
+				self.emit('changed::' + key, key)
+
+		return False
+
+	def _parse(self, value_type, value):
+		if value_type == 'boolean':
+			lower = value.lower()
+			if lower in ('true', 'on', 'yes'):
+				return True
+			if lower in ('false', 'off', 'no'):
+				return False
+			return None
+
+		# durations are H:MM:SS, MM:SS or a plain number of minutes
+		try:
+			parts = [int(part) for part in value.split(':')]
+		except ValueError:
+			return None
+		if len(parts) == 3:
+			return parts[0] * 3600 + parts[1] * 60 + parts[2]
+		if len(parts) == 2:
+			return parts[0] * 60 + parts[1]
+		if len(parts) == 1:
+			return parts[0] * 60
+		return None
+
+
+class ScreensaverStateSnapshot(collections.namedtuple('ScreensaverStateSnapshot', ['version', 'active', 'locked', 'active_since', 'timeout', 'inhibited', 'dpms'])):
+	__slots__ = ()
+
+	@property
+	def active_time(self):
+		seconds = 0
+		if self.active:
+			seconds = max(0, int(time.monotonic() - self.active_since))
+		return seconds
+
+	def as_dict(self):
+		state = {
+			'Active': bool(self.active),
+			'Locked': bool(self.locked),
+			'ActiveTime': self.active_time,
+			'Timeout': self.timeout or 0,
+			'Inhibited': bool(self.inhibited)
+		}
+		# unknown until we have changed it, without the DPMS extension
+		if self.dpms is not None:
+			state['DpmsEnabled'] = self.dpms
+		return state
+
+
+class ScreensaverState(object):
+	__slots__ = ('active', 'locked', 'active_since', 'timeout', 'inhibited', 'dpms', 'version', '_snapshot')
+
+	def __init__(self):
+		self.active = None
+		self.locked = None
+		self.active_since = None
+		self.timeout = None
+		self.inhibited = False
+		self.dpms = None
+		self.version = 0
+		self._snapshot = None
+
+	def reset(self):
+		return self.update(active=None, locked=None, active_since=None, timeout=None, inhibited=False, dpms=None)
+
+	# returns True if anything changed
+	def update(self, **changes):
+		changed = False
+		for k, v in changes.items():
+			if getattr(self, k) != v:
+				setattr(self, k, v)
+				changed = True
+		if changed:
+			self.version += 1
+			self._snapshot = None
+		return changed
+
+	def snapshot(self):
+		if self._snapshot is None:
+			self._snapshot = ScreensaverStateSnapshot(self.version, self.active, self.locked, self.active_since, self.timeout, self.inhibited, self.dpms)
+		return self._snapshot
+
+
+# a child process that is started again, after a growing delay, whenever it
+# exits without being asked to
+class SupervisedProcess(GObject.GObject):
+	__gsignals__ = {
+		'started': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+		'exited': (GObject.SignalFlags.RUN_LAST, None, (int,))
+	}
+
+	RESTART_DELAYS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 30] # in seconds
+	# the delay starts again from the beginning after running for this long
+	STABLE_TIME = 60 # in seconds
+
+	def __init__(self, name, argv, env=None, stdout=False, display=None):
+		self.name = name
+		self._argv = argv
+		# only labels metrics
+		self._display = display
+		self._envp = ['%s=%s' % item for item in env.items()] if env is not None else None
+		self._stdout = stdout
+		self._pid = None
+		self._started = None
+		self._failures = 0
+		self._restart_id = None
+		self._stopped = False
+		# read end of the child's stdout, if asked for
+		self.stdout = None
+		self.restarts = 0
+
+		super(SupervisedProcess, self).__init__()
+
+	@property
+	def running(self):
+		return self._pid is not None
+
+	# raises GLib.Error if the process cannot be started; later restarts
+	# keep trying instead
+	def start(self):
+		self._stopped = False
+		self._spawn()
+
+	def _spawn(self):
+		METRICS.count('forks_total', command=self.name, display=self._display)
+		flags = GLib.SpawnFlags.SEARCH_PATH | GLib.SpawnFlags.DO_NOT_REAP_CHILD
+		pid, stdin, stdout, stderr = GLib.spawn_async(self._argv, envp=self._envp, flags=flags, standard_output=self._stdout)
+		self._pid = pid
+		self._started = time.monotonic()
+		self.stdout = stdout
+		GLib.child_watch_add(GLib.PRIORITY_DEFAULT, pid, self._exited)
+		self.emit('started', stdout)
+
+	def _exited(self, pid, status):
+		GLib.spawn_close_pid(pid)
+		ran = time.monotonic() - self._started
+		self._pid = None
+		self._started = None
+
+		self.emit('exited', status)
+		if self.stdout is not None:
+			os.close(self.stdout)
+			self.stdout = None
+
+		if self._stopped:
+			return
+
+		if os.WIFSIGNALED(status):
+			LOG.warning("%s was killed by signal %d", self.name, os.WTERMSIG(status))
+		else:
+			LOG.warning("%s exited with status %d", self.name, os.WEXITSTATUS(status))
+		if ran >= self.STABLE_TIME:
+			self._failures = 0
+		self._schedule_restart()
+
+	def _schedule_restart(self):
+		delay = self.RESTART_DELAYS[min(self._failures, len(self.RESTART_DELAYS) - 1)]
+		self._failures += 1
+		LOG.info("Restarting %s in %.1f seconds", self.name, delay)
+		self._restart_id = GLib.timeout_add(int(delay * 1000), self._restart)
+
+	def _restart(self):
+		self._restart_id = None
+		self.restarts += 1
+		METRICS.count('restarts_total', process=self.name, display=self._display)
+		try:
+			self._spawn()
+		except GLib.Error as err:
+			LOG.error("Cannot restart %s: %s", self.name, err.message)
+			self._schedule_restart()
+		return False
+
+	# skips the rest of the delay, e.g. once what it depends on is back
+	def retry(self):
+		if self._restart_id is not None:
+			GLib.source_remove(self._restart_id)
+			self._restart()
+
+	# the process is restarted once it has exited
+	def terminate(self):
+		if self._pid is not None:
+			os.kill(self._pid, signal.SIGTERM)
+
+	def stop(self, kill=True):
+		self._stopped = True
+		if self._restart_id is not None:
+			GLib.source_remove(self._restart_id)
+			self._restart_id = None
+		if kill:
+			self.terminate()
+
 
 class XScreenSaverManager(GObject.GObject):
 	__gsignals__ = {
 		'active-changed': (GObject.SignalFlags.RUN_LAST, None, (bool,)),
-		'timeout-changed': (GObject.SignalFlags.RUN_LAST, None, (int,))
+		'timeout-changed': (GObject.SignalFlags.RUN_LAST, None, (int,)),
+		'state-changed': (GObject.SignalFlags.RUN_LAST, None, ()),
+		'display-lost': (GObject.SignalFlags.RUN_LAST, None, ())
 	}
 
 	XSS = 'xscreensaver'
@@ -50,237 +1192,567 @@ class XScreenSaverManager(GObject.GObject):
 
 	XSET = 'xset'
 
-	DEFAULT_TIMEOUT = 600 # in seconds
+	COMMAND_TIMEOUT = 5 # in seconds
+	READY_TIMEOUT = 10 # in seconds
+	READY_POLL_INTERVALS = [50, 100, 200, 400, 800] # in milliseconds
+
+	# reset xscreensaver's idle timer this long before it would activate
+	INHIBIT_MARGIN = 10 # in seconds
+	WATCHER_READ_SIZE = 4096
 
-	DATETIME_FORMAT = '%a %b %d %H:%M:%S %Y'
-	TIMEOUT_FORMAT = '%H:%M:%S'
+	# xscreensaver always prints timestamps as ctime() does, in English
+	MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6, 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+	WEEKDAYS = {'Mon': 0, 'Tue': 1, 'Wed': 2, 'Thu': 3, 'Fri': 4, 'Sat': 5, 'Sun': 6}
 
-	def __init__(self, no_dpms=False):
+	def __init__(self, state, no_dpms=False, display=None, use_watcher=False):
+		self._state = state
+		# None for $DISPLAY
+		self._display = display
+		self._env = dict(os.environ, DISPLAY=display) if display is not None else None
 		self._screensaver = None
-		self._active = None
-		self._active_since = None
-		self._locked = None
+		self._screensaver_ids = None
+		self._relock = False
+		self._sleep_started = None
 		self._watcher = None
+		self._watcher_ids = None
 		self._watcher_read_buf = None
 		self._watcher_id = None
-		self._options_path = None
-		self._options_gfile = None
-		self._options_monitor = None
-		self._options_monitor_id = None
+		self._options = None
+		self._options_changed_id = None
 		self._manage_dpms = not no_dpms
+		# the watcher is only needed if the X display cannot be watched
+		self._use_watcher = use_watcher
 		self._inhibit_id = None
+		self._inhibit_reset_time = None
+		self._inhibit_stats = None
+		self._forks = 0
+		self._client = None
+		self._ready = None
+		self._ready_poll_id = None
+		self._ready_poll_count = None
+		self._ready_timeout_id = None
 
 		super(XScreenSaverManager, self).__init__()
 
 	def activate(self):
 		LOG.debug("Starting screensaver")
+		self._screensaver = SupervisedProcess(self.XSS, [self.XSS, '-nosplash'], self._env, display=self._display)
+		self._screensaver_ids = [self._screensaver.connect(s, h) for s, h in [
+			('started', self._screensaver_started),
+			('exited', self._screensaver_exited)
+		]]
 		try:
-			self._screensaver = subprocess.Popen([self.XSS, '-nosplash'])
-		except OSError as err:
-			LOG.error("Cannot start screensaver: %s", err)
+			self._screensaver.start()
+		except GLib.Error as err:
+			LOG.error("Cannot start screensaver: %s", err.message)
 			raise
-		time.sleep(1)
 
-		self._active = False
-		self._active_since = datetime.datetime.now()
-		self._locked = False
-		match = re.search(r"screen (\S+) since ([^\(]+)", (self._do_command('time')).decode('utf-8'))
-		if match:
-			state, date_str = match.groups()
-			self._active = state != 'non-blanked'
-			self._active_since = datetime.datetime.strptime(date_str.strip(), self.DATETIME_FORMAT)
-			self._locked = state == 'locked'
+		# provisional state until xscreensaver is ready
+		self._state.update(active=False, active_since=time.monotonic(), locked=False)
+		self._ready = False
+
+		self._options = XScreenSaverOptions(os.path.expanduser(self.XSS_OPTIONS), self._display)
+		self._options_changed_id = self._options.connect('changed::timeout', self._timeout_changed)
+		self._options.activate()
+		self._state.update(timeout=self._options['timeout'])
+
+		self._client = XScreenSaverClient(self._display)
+		if self._client.open():
+			self._state.update(dpms=self._client.get_dpms())
+			self._client.watch_status(self._x_status_changed, self._x_connection_lost)
+		else:
+			LOG.debug("Falling back to %s for commands", self.XSS_COMMAND)
+			self._client = None
+
+		self._wait_for_ready()
+
+	def _wait_for_ready(self):
+		self._ready = False
+		if self._client:
+			if self._client.find_window() is not None:
+				self._screensaver_ready("xscreensaver window already exists")
+		else:
+			self._ready_poll_count = 0
+			self._ready_poll_id = GLib.timeout_add(self.READY_POLL_INTERVALS[0], self._poll_ready)
+
+		if not self._ready:
+			self._ready_timeout_id = GLib.timeout_add_seconds(self.READY_TIMEOUT, self._ready_timed_out)
+
+	def _screensaver_started(self, process, stdout):
+		if process.restarts:
+			LOG.debug("Screensaver restarted, waiting for it to be ready")
+			self._wait_for_ready()
+
+	def _screensaver_exited(self, process, status):
+		for source_id in [self._ready_poll_id, self._ready_timeout_id]:
+			if source_id is not None:
+				GLib.source_remove(source_id)
+		self._ready_poll_id = None
+		self._ready_timeout_id = None
+		self._ready = False
+		# the screen is no longer blanked or locked, so lock it again once
+		# xscreensaver is back
+		if self._state.locked:
+			self._relock = True
+		if self._state.active:
+			self._set_state('UNBLANK', time.monotonic())
+
+	def _x_status_changed(self, received):
+		if not self._ready:
+			# _screensaver_ready() brings the state up to date
+			if self._client.find_window() is not None:
+				self._screensaver_ready("_SCREENSAVER_STATUS was set")
+			return
+
+		if self._watcher is not None:
+			return
+
+		status = self._client.get_status()
+		if status is None:
+			return
+		state, since = status
+		RECORDER.record('x-status', state=state, since=since)
+		if (state != 'UNBLANK') != self._state.active and LOG.isEnabledFor(logging.DEBUG):
+			LOG.debug("Screensaver state changed to %s at %d", state, since, extra=journal_fields(component='x', state=state))
+		self._set_state(state, self._monotonic_since(since), received, 'x')
+
+	def _x_connection_lost(self):
+		# xscreensaver went with the X server, there is nothing left to manage
+		self.emit('display-lost')
+
+	def _poll_ready(self):
+		self._ready_poll_id = None
+		self._do_command('version', self._poll_ready_finished)
+		return False
+
+	def _poll_ready_finished(self, retcode, output):
+		if self._ready is not False:
+			return
+
+		if retcode == 0:
+			self._screensaver_ready("%s succeeded" % self.XSS_COMMAND)
+		else:
+			self._ready_poll_count += 1
+			interval = self.READY_POLL_INTERVALS[min(self._ready_poll_count, len(self.READY_POLL_INTERVALS) - 1)]
+			self._ready_poll_id = GLib.timeout_add(interval, self._poll_ready)
+
+	def _ready_timed_out(self):
+		self._ready_timeout_id = None
+		LOG.warning("Screensaver not ready after %d seconds, continuing anyway", self.READY_TIMEOUT)
+		self._screensaver_ready("timed out")
+		return False
+
+	def _screensaver_ready(self, reason):
+		LOG.debug("Screensaver ready at %.1f ms (%s)", startup_ms(), reason)
+		self._ready = True
+
+		for source_id in [self._ready_poll_id, self._ready_timeout_id]:
+			if source_id is not None:
+				GLib.source_remove(source_id)
+		self._ready_poll_id = None
+		self._ready_timeout_id = None
+
+		# one status query also brings the state up to date after a restart
+		self._query_status(self._status_received)
+
+		if self._relock:
+			LOG.warning("Screensaver was restarted while locked, locking again")
+			self._relock = False
+			self._command('lock')
+
+		if self._watcher is not None:
+			# it may have given up while xscreensaver was gone
+			self._watcher.retry()
+			return
+
+		if self._client and not self._use_watcher:
+			LOG.debug("Watching _SCREENSAVER_STATUS, not starting watcher")
+			return
 
 		LOG.debug("Starting watcher")
+		self._watcher = SupervisedProcess(self.XSS_COMMAND + ' -watch', [self.XSS_COMMAND, '-watch'], self._env, stdout=True, display=self._display)
+		self._watcher_ids = [self._watcher.connect(s, h) for s, h in [
+			('started', self._watcher_started),
+			('exited', self._watcher_exited)
+		]]
 		try:
-			self._watcher = subprocess.Popen([self.XSS_COMMAND, '-watch'], stdout=subprocess.PIPE)
-		except OSError as err:
-			LOG.error("Cannot start watcher: %s", err)
-			raise
-		self._watcher_read_buf = []
-		self._watcher_id = GLib.io_add_watch(self._watcher.stdout, GLib.IO_IN, self._read_from_watcher)
+			self._watcher.start()
+		except GLib.Error as err:
+			LOG.error("Cannot start watcher: %s", err.message)
+			for h in self._watcher_ids:
+				self._watcher.disconnect(h)
+			self._watcher = None
+			self._watcher_ids = None
+
+	def _watcher_started(self, process, fd):
+		os.set_blocking(fd, False)
+		self._watcher_read_buf = bytearray()
+		self._watcher_id = GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT, GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._read_from_watcher)
+		if process.restarts and self._ready:
+			# events were missed while it was gone
+			LOG.debug("Watcher restarted, checking screensaver status")
+			self._query_status(self._status_received)
+
+	def _watcher_exited(self, process, status):
+		# anything left in the pipe is covered by the status query after the
+		# restart
+		if self._watcher_id is not None:
+			GLib.source_remove(self._watcher_id)
+			self._watcher_id = None
+		self._watcher_read_buf = None
 
-		self._timeout = -1
-		self._options_path = os.path.expanduser(self.XSS_OPTIONS)
+	def _status_received(self, state, since):
+		if state is not None and self._state.active is not None:
+			self._set_state(state, since)
 
-		self._read_timeout(None, init=True)
+	# received is when the event that told us reached the daemon
+	def _set_state(self, state, since, received=None, source=None):
+		locked = state == 'LOCK'
+		active = state != 'UNBLANK'
 
-		self._options_gfile = Gio.file_new_for_path(self._options_path)
-		self._options_monitor = self._options_gfile.monitor_file(Gio.FileMonitorFlags.NONE, None)
-		self._options_monitor_id = self._options_monitor.connect('changed', lambda m, f, g, e: self._read_timeout(e))
+		if active != self._state.active:
+			self._state.update(active=active, active_since=since, locked=locked)
+			self.emit('active-changed', active)
+			if received is not None:
+				METRICS.observe('state_event_latency_seconds', time.monotonic() - received, source=source, display=self._display)
+			self.emit('state-changed')
+		elif self._state.update(locked=locked):
+			self.emit('state-changed')
 
 	def deactivate(self):
+		for source_id in [self._ready_poll_id, self._ready_timeout_id]:
+			if source_id is not None:
+				GLib.source_remove(source_id)
+
 		if self._inhibit_id is not None:
 			GLib.source_remove(self._inhibit_id)
 
-		if self._options_monitor:
-			self._options_monitor.disconnect(self._options_monitor_id)
-			self._options_monitor.cancel()
+		if self._options:
+			self._options.disconnect(self._options_changed_id)
+			self._options.deactivate()
 
 		if self._watcher_id is not None:
 			GLib.source_remove(self._watcher_id)
 
 		if self._watcher:
 			LOG.debug("Ending watcher")
-			self._watcher.terminate()
-
-		if self._screensaver and self._screensaver.poll() is None:
-			LOG.debug("Ending screensaver")
-			self._do_command('exit')
-			time.sleep(1)
+			for h in self._watcher_ids:
+				self._watcher.disconnect(h)
+			self._watcher.stop()
+
+		if self._screensaver:
+			for h in self._screensaver_ids:
+				self._screensaver.disconnect(h)
+			# xscreensaver is asked to exit, rather than killed
+			self._screensaver.stop(kill=False)
+			if self._screensaver.running:
+				LOG.debug("Ending screensaver")
+				if not (self._client and self._client.send_command('exit')):
+					# the main loop has ended, so don't wait for the result
+					self._spawn([self.XSS_COMMAND, '-exit'], flags=Gio.SubprocessFlags.NONE)
+
+		if self._client:
+			self._client.close()
+
+		self._state.reset()
 
 		self._screensaver = None
-		self._active = None
-		self._active_since = None
-		self._locked = None
+		self._screensaver_ids = None
+		self._relock = False
+		self._sleep_started = None
 		self._watcher = None
+		self._watcher_ids = None
 		self._watcher_read_buf = None
 		self._watcher_id = None
-		self._timeout = None
-		self._options_path = None
-		self._options_gfile = None
-		self._options_monitor = None
-		self._options_monitor_id = None
+		self._options = None
+		self._options_changed_id = None
 		self._inhibit_id = None
+		self._inhibit_reset_time = None
+		self._inhibit_stats = None
+		self._client = None
+		self._ready = None
+		self._ready_poll_id = None
+		self._ready_poll_count = None
+		self._ready_timeout_id = None
+
+	def _command(self, cmd, callback=None):
+		if self._client:
+			with TRACER.span('x:' + cmd):
+				sent = self._client.send_command(cmd)
+			if sent:
+				if callback:
+					callback()
+				return
+		if callback:
+			self._do_command(cmd, lambda retcode, output: callback())
+		else:
+			self._do_command(cmd)
 
-	def _do_command(self, cmd):
-		LOG.debug("Calling %s -%s", self.XSS_COMMAND, cmd)
-		try:
-			process = subprocess.Popen([self.XSS_COMMAND, '-' + cmd], stdout=subprocess.PIPE)
-			output = process.communicate()[0].strip()
-			retcode = process.returncode
-			if retcode < 0:
-				LOG.error("%s was terminated by signal %d", self.XSS_COMMAND, -retcode)
-				output = None
-			else:
-				LOG.debug("  output (exit: %d): %s", retcode, output)
-		except OSError as err:
-			LOG.error("Cannot call %s: %s", self.XSS_COMMAND, err)
-			output = None
+	def _query_status(self, callback):
+		if self._client:
+			status = self._client.get_status()
+			if status:
+				state, since = status
+				LOG.debug("Screensaver status is %s since %d", state, since)
+				callback(state, self._monotonic_since(since))
+				return
 
-		return output
+		self._do_command('time', lambda retcode, output: self._parse_status(output, callback))
 
-	def _read_from_watcher(self, source, condition):
-		c = source.read(1)
-		if c != '\n':
-			self._watcher_read_buf.append(c)
+	def _parse_status(self, output, callback):
+		match = re.search(r"screen (\S+) since ([^\(]+)", output) if output else None
+		if match:
+			state, date_str = match.groups()
+			state = {'non-blanked': 'UNBLANK', 'locked': 'LOCK'}.get(state, 'BLANK')
+			since = self.parse_datetime(date_str)
+			callback(state, self._monotonic_since(since) if since is not None else time.monotonic())
 		else:
-			event = ''.join(self._watcher_read_buf)
-			self._watcher_read_buf = []
-			state, rest = event.split(None, 1)
-			if state == 'BLANK' or state == 'LOCK' or state == 'UNBLANK':
-				active = state != 'UNBLANK'
-				since = datetime.datetime.strptime(rest.strip(), self.DATETIME_FORMAT)
-				self._locked = state == 'LOCK'
-				LOG.debug("Screensaver state changed to %s at %s", state, since)
-				if active != self._active:
-					self._active = active
-					self._active_since = since
-					self.emit('active-changed', active)
-
-		return True
+			callback(None, None)
 
-	def _read_timeout(self, event_type, init=False):
-		if event_type == Gio.FileMonitorEvent.CHANGES_DONE_HINT or event_type == Gio.FileMonitorEvent.DELETED or init:
-			timeout = self.DEFAULT_TIMEOUT
-
-			if event_type == Gio.FileMonitorEvent.CHANGES_DONE_HINT or init:
-				if init:
-					LOG.debug("Attempting to read from %s", self._options_path)
-				else:
-					LOG.debug("%s changed, attempting to read", self._options_path)
-				try:
-					f = open(self._options_path, 'r')
-					for line in f:
-						a = line.strip().split()
-						if len(a) == 2 and a[0] == 'timeout:':
-							LOG.debug("  found timeout: %s", a[1])
-							# 12 hours seems to be the max timeout, so this should be okay
-							try:
-								dt = datetime.datetime.strptime(a[1], self.TIMEOUT_FORMAT)
-								timeout = dt.second + (dt.minute * 60) + (dt.hour * 3600)
-								LOG.debug("Timeout was %d seconds, now %d seconds", self._timeout, timeout)
-							except ValueError as err:
-								LOG.debug("  cannot parse timeout: %s", err)
-								LOG.debug("Resetting timeout to default (%d seconds)", timeout)
-							break
-				except IOError as err:
-					LOG.debug("  failed: %s", err)
-					LOG.debug("Resetting timeout to default (%d seconds)", timeout)
+	@classmethod
+	def parse_datetime(cls, date_str):
+		# e.g. "Sat Nov  2 12:34:56 2013", returns seconds since the epoch
+		a = date_str.split()
+		try:
+			weekday, month, day, hms, year = a
+			hour, minute, second = hms.split(':')
+			return time.mktime((int(year), cls.MONTHS[month], int(day), int(hour), int(minute), int(second), cls.WEEKDAYS[weekday], 0, -1))
+		except (KeyError, ValueError, OverflowError):
+			LOG.debug("Cannot parse date: %s", date_str)
+			return None
+
+	def _monotonic_since(self, timestamp):
+		# convert a wall clock time to the monotonic clock
+		return time.monotonic() - max(0, time.time() - timestamp)
+
+	def _do_command(self, cmd, callback=None):
+		self._spawn([self.XSS_COMMAND, '-' + cmd], callback)
+
+	def _spawn(self, argv, callback=None, flags=Gio.SubprocessFlags.STDOUT_PIPE):
+		if LOG.isEnabledFor(logging.DEBUG):
+			LOG.debug("Calling %s", ' '.join(argv), extra=journal_fields(component='xscreensaver'))
+		self._forks += 1
+		METRICS.count('forks_total', command=' '.join(argv[:2]), display=self._display)
+		try:
+			launcher = Gio.SubprocessLauncher.new(flags)
+			if self._display is not None:
+				launcher.setenv('DISPLAY', self._display, True)
+			process = launcher.spawnv(argv)
+		except GLib.Error as err:
+			LOG.error("Cannot call %s: %s", argv[0], err.message)
+			if callback:
+				callback(None, None)
+			return
+
+		if not flags & Gio.SubprocessFlags.STDOUT_PIPE:
+			return
+
+		# a hung child must not keep its callback (or the caller) waiting
+		pending = {'argv': argv, 'callback': callback, 'started': time.monotonic(), 'trace_id': TRACER.current}
+		pending['timeout_id'] = GLib.timeout_add_seconds(self.COMMAND_TIMEOUT, self._spawn_timed_out, process, pending)
+		process.communicate_utf8_async(None, None, self._spawn_finished, pending)
+
+	def _spawn_timed_out(self, process, pending):
+		LOG.error("%s did not exit within %d seconds, killing", pending['argv'][0], self.COMMAND_TIMEOUT)
+		pending['timeout_id'] = None
+		process.force_exit()
+		return False
+
+	def _spawn_finished(self, process, result, pending):
+		if pending['timeout_id'] is not None:
+			GLib.source_remove(pending['timeout_id'])
+			pending['timeout_id'] = None
+
+		METRICS.count('wakeups_total', source='child', display=self._display)
+		command = ' '.join(pending['argv'][:2])
+		ended = time.monotonic()
+		METRICS.observe('command_duration_seconds', ended - pending['started'], command=command, display=self._display)
+		TRACER.add('spawn:' + command, pending['started'], ended, pending['trace_id'])
+
+		name = pending['argv'][0]
+		retcode = None
+		output = None
+		try:
+			ok, stdout, stderr = process.communicate_utf8_finish(result)
+		except GLib.Error as err:
+			LOG.error("Cannot call %s: %s", name, err.message)
+		else:
+			if process.get_if_signaled():
+				LOG.error("%s was terminated by signal %d", name, process.get_term_sig())
 			else:
-				LOG.debug("%s deleted, resetting timeout to default (%d seconds)", self._options_path, timeout)
-
-			if timeout != self._timeout:
-				self._timeout = timeout
-				if self._inhibit_id is not None:
-					self.inhibit()
-				self.emit('timeout-changed', timeout)
+				retcode = process.get_exit_status()
+				output = (stdout or '').strip()
+				LOG.debug("  %s output (exit: %d): %s", name, retcode, output)
+
+		if pending['callback']:
+			with TRACER.resume(pending['trace_id']):
+				pending['callback'](retcode, output)
+
+	def _read_from_watcher(self, fd, condition):
+		METRICS.count('wakeups_total', source='watcher', display=self._display)
+
+		# read everything that is available and handle each complete line;
+		# an empty read means the pipe was closed
+		chunk = b''
+		received = time.monotonic()
+		if condition & (GLib.IO_IN | GLib.IO_HUP):
+			try:
+				chunk = os.read(fd, self.WATCHER_READ_SIZE)
+			except BlockingIOError:
+				return True
+			except OSError as err:
+				LOG.error("Cannot read from watcher: %s", err)
+
+		buf = self._watcher_read_buf
+		if chunk:
+			buf.extend(chunk)
+			end = buf.rfind(b'\n')
+			if end >= 0:
+				lines = buf[:end].decode('utf-8', 'replace').split('\n')
+				del buf[:end + 1]
+				for line in lines:
+					self._handle_watcher_line(line, received)
+			return True
+
+		if buf:
+			self._handle_watcher_line(buf.decode('utf-8', 'replace'), received)
+			del buf[:]
+		# returning False removes the watch, so a dead pipe cannot keep
+		# waking us up; the watcher is restarted once it has exited
+		LOG.warning("Watcher closed its output")
+		self._watcher_id = None
+		self._watcher.terminate()
+		return False
+
+	def _handle_watcher_line(self, line, received):
+		RECORDER.record('watcher', line=line)
+		parts = line.split(None, 1)
+		if len(parts) < 2:
+			return
+
+		state, rest = parts
+		if state == 'BLANK' or state == 'LOCK' or state == 'UNBLANK':
+			if LOG.isEnabledFor(logging.DEBUG):
+				LOG.debug("Screensaver state changed to %s at %s", state, rest, extra=journal_fields(component='watcher', state=state))
+			since = None
+			if (state != 'UNBLANK') != self._state.active:
+				timestamp = self.parse_datetime(rest)
+				since = self._monotonic_since(timestamp) if timestamp is not None else time.monotonic()
+			with TRACER.trigger('watcher:' + state, display=self._display):
+				self._set_state(state, since, received, 'watcher')
+
+	def _timeout_changed(self, options, key):
+		timeout = options[key]
+		LOG.debug("Timeout is now %d seconds", timeout)
+		self._state.update(timeout=timeout)
+		if self._inhibit_id is not None:
+			self.inhibit()
+		self.emit('timeout-changed', timeout)
+		self.emit('state-changed')
 
 	def _set_dpms(self, enable):
-		if self._manage_dpms:
+		if not self._manage_dpms:
+			return
+
+		current = self._client.get_dpms() if self._client else None
+		if current is not None:
+			if self._state.dpms is not None and current != self._state.dpms:
+				LOG.debug("DPMS was %s by something else", 'enabled' if current else 'disabled')
+			if current == enable:
+				LOG.debug("DPMS is already %s", 'enabled' if enable else 'disabled')
+			elif self._client.set_dpms(enable):
+				LOG.debug("%s DPMS", 'Enabled' if enable else 'Disabled')
+			else:
+				current = None
+
+		if current is None:
+			# without the DPMS extension there is no way to see changes made
+			# by others, so only skip what we have already done
+			if enable == self._state.dpms:
+				LOG.debug("DPMS was already %s, skipping", 'enabled' if enable else 'disabled')
+				return
 			cmd = '+dpms' if enable else '-dpms'
-			LOG.debug("Calling %s %s", self.XSET, cmd)
-			try:
-				output = subprocess.check_output([self.XSET, cmd], stderr=subprocess.STDOUT)
-				if output:
-					LOG.error("%s returned with output: %s", self.XSET, output)
-				else:
-					LOG.debug("  exited normally")
-			except subprocess.CalledProcessError as err:
-				LOG.error("%s returned non-zero exit status %d: %s", self.XSET, err.returncode, err.output)
-			except OSError as err:
-				LOG.error("Cannot call %s: %s", self.XSET, err)
+			self._spawn([self.XSET, cmd], self._set_dpms_finished, Gio.SubprocessFlags.STDOUT_PIPE | Gio.SubprocessFlags.STDERR_MERGE)
+
+		if self._state.update(dpms=enable):
+			self.emit('state-changed')
+
+	def _set_dpms_finished(self, retcode, output):
+		if retcode:
+			LOG.error("%s returned non-zero exit status %d: %s", self.XSET, retcode, output)
+		elif output:
+			LOG.error("%s returned with output: %s", self.XSET, output)
 
 	@property
 	def active(self):
-		return self._active
+		return self._state.active
 
 	@active.setter
 	def active(self, value):
-		if value != self._active:
+		self.set_active(value)
+
+	def set_active(self, value, callback=None):
+		if value != self._state.active:
 			if value:
 				LOG.debug("Screensaver is inactive, activating")
 				cmd = 'activate'
 			else:
 				LOG.debug("Screensaver is active, deactivating")
 				cmd = 'deactivate'
-			self._do_command(cmd)
+			self._command(cmd, callback)
 		else:
 			if value:
 				LOG.debug("Screensaver is already active")
 			else:
 				LOG.debug("Screensaver is already inactive")
+			if callback:
+				callback()
 
-	@property
-	def active_time(self):
-		seconds = 0
-		if self._active:
-			delta = datetime.datetime.now() - self._active_since
-			seconds = delta.seconds + (delta.days * 3600)
-		return seconds
+	def prepare_for_sleep(self, active):
+		# the monotonic clock stops while suspended, so count the time
+		# spent asleep using the wall clock
+		if active:
+			self._sleep_started = time.time()
+		elif self._sleep_started is not None:
+			slept = max(0, time.time() - self._sleep_started)
+			LOG.debug("Resumed after %d seconds asleep", slept)
+			if self._state.active_since is not None:
+				self._state.update(active_since=self._state.active_since - slept)
+			self._sleep_started = None
 
 	@property
 	def timeout(self):
-		return self._timeout
-
-	def lock(self):
-		if not self._locked:
+		return self._state.timeout
+
+	def lock(self, callback=None):
+		if self._screensaver is not None and not self._screensaver.running:
+			LOG.debug("Screensaver is restarting, locking once it is back")
+			self._relock = True
+			if callback:
+				callback()
+		elif not self._state.locked:
 			LOG.debug("Locking")
-			self._do_command('lock')
+			self._command('lock', callback)
 		else:
 			LOG.debug("Already locked")
+			if callback:
+				callback()
 
-	def simulate_user_activity(self):
+	def simulate_user_activity(self, callback=None):
 		LOG.debug("Simulating user activity")
-		self._do_command('deactivate')
+		self._command('deactivate', callback)
 
 	def inhibit(self):
-		interval = max(20, self._timeout - 10)
-		LOG.debug("Inhibiting screensaver every %d seconds", interval)
-		if self._inhibit_id is not None:
+		LOG.debug("Inhibiting screensaver")
+		uninhibited = self._inhibit_id is None
+		if uninhibited:
+			self._inhibit_stats = {'started': time.monotonic(), 'forks': self._forks, 'wakeups': 0, 'resets': 0}
+		else:
 			GLib.source_remove(self._inhibit_id)
 		self._do_inhibit()
-		self._inhibit_id = GLib.timeout_add(interval * 1000, self._do_inhibit)
+		self._schedule_inhibit()
+		if self._state.update(inhibited=True):
+			self.emit('state-changed')
 
 	def uninhibit(self):
 		LOG.debug("Uninhibiting screensaver")
@@ -288,108 +1760,374 @@ class XScreenSaverManager(GObject.GObject):
 			self._set_dpms(True)
 			GLib.source_remove(self._inhibit_id)
 			self._inhibit_id = None
+			self._inhibit_reset_time = None
+			self._log_inhibit_stats()
+			self._inhibit_stats = None
+			self._state.update(inhibited=False)
+			self.emit('state-changed')
+
+	def _get_idle_time(self):
+		# xscreensaver restarts its idle timer on user input and when we reset
+		# it, whichever was most recent
+		idle = self._client.get_idle_time() if self._client else None
+		if idle is None or self._inhibit_reset_time is None:
+			return idle
+		return min(idle, time.monotonic() - self._inhibit_reset_time)
+
+	def _schedule_inhibit(self):
+		idle = self._get_idle_time()
+		if idle is None:
+			# no idle time available, reset at a fixed interval
+			interval = max(20, self.timeout - self.INHIBIT_MARGIN)
+		else:
+			interval = max(1, self.timeout - self.INHIBIT_MARGIN - idle)
+		LOG.debug("Next inhibit check in %d seconds", interval)
+		self._inhibit_id = GLib.timeout_add_seconds(int(interval), self._inhibit_timeout)
+
+	def _inhibit_timeout(self):
+		self._inhibit_stats['wakeups'] += 1
+		METRICS.count('wakeups_total', source='inhibit', display=self._display)
+		with TRACER.trigger('timer:inhibit', display=self._display):
+			idle = self._get_idle_time()
+			if idle is None or idle >= self.timeout - self.INHIBIT_MARGIN:
+				self._do_inhibit()
+			else:
+				LOG.debug("Idle for %d seconds, no need to inhibit yet", idle)
+			self._schedule_inhibit()
+		return False
 
 	def _do_inhibit(self):
-		if not self._locked:
+		# nothing is sent while locked, so xscreensaver's idle timer is not
+		# reset either
+		if not self._state.locked:
 			LOG.debug("Inhibiting")
-			self._do_command('deactivate')
+			self._inhibit_reset_time = time.monotonic()
+			self._inhibit_stats['resets'] += 1
+			self._command('deactivate')
 			self._set_dpms(False)
 		else:
 			LOG.debug("Screensaver is locked, skipping inhibit")
-		return True
 
+	def _log_inhibit_stats(self):
+		stats = self._inhibit_stats
+		hours = max(time.monotonic() - stats['started'], 1) / 3600.0
+		forks = self._forks - stats['forks']
+		LOG.debug("Inhibited for %d seconds: %d wakeups (%.1f per hour), %d resets (%.1f per hour), %d forks (%.1f per hour)",
+			hours * 3600, stats['wakeups'], stats['wakeups'] / hours, stats['resets'], stats['resets'] / hours, forks, forks / hours)
+		# what the fixed interval scheduler would have done, for comparison
+		periodic = 3600.0 / max(20, self.timeout - self.INHIBIT_MARGIN)
+		LOG.debug("  a fixed %d second interval would have used %.1f wakeups and %.1f forks per hour",
+			max(20, self.timeout - self.INHIBIT_MARGIN), periodic, periodic * (2 if self._manage_dpms else 1))
 
-class FauxGnomeScreensaverDBusService(dbus.service.Object):
+
+class FauxGnomeScreensaverDBusService(object):
 	GS_SERVICE = 'org.gnome.ScreenSaver'
 	GS_PATH = '/org/gnome/ScreenSaver'
+	GS_INTERFACE = 'org.gnome.ScreenSaver'
+
+	# extensions that are not part of the GNOME Screensaver interface
+	FGS_INTERFACE = 'com.github.jefferyto.FauxGnomeScreensaver'
+
+	DBUS_INTERFACE_PROPERTIES = 'org.freedesktop.DBus.Properties'
+
+	# GDBus answers org.freedesktop.DBus.Properties itself, asking
+	# _get_property for the values
+	INTROSPECTION_XML = '''
+<node>
+	<interface name="org.gnome.ScreenSaver">
+		<method name="Quit"/>
+		<method name="Lock"/>
+		<method name="SimulateUserActivity"/>
+		<method name="SetActive">
+			<arg name="value" type="b" direction="in"/>
+		</method>
+		<method name="GetActive">
+			<arg name="active" type="b" direction="out"/>
+		</method>
+		<method name="GetActiveTime">
+			<arg name="seconds" type="u" direction="out"/>
+		</method>
+		<method name="ShowMessage">
+			<arg name="summary" type="s" direction="in"/>
+			<arg name="body" type="s" direction="in"/>
+			<arg name="icon" type="s" direction="in"/>
+		</method>
+		<signal name="ActiveChanged">
+			<arg name="new_value" type="b"/>
+		</signal>
+	</interface>
+	<interface name="com.github.jefferyto.FauxGnomeScreensaver">
+		<method name="GetState">
+			<arg name="state" type="a{sv}" direction="out"/>
+		</method>
+		<method name="GetMetrics">
+			<arg name="metrics" type="a{sd}" direction="out"/>
+		</method>
+		<method name="GetTrace">
+			<arg name="trace" type="s" direction="out"/>
+		</method>
+		<method name="GetLogLevel">
+			<arg name="level" type="s" direction="out"/>
+		</method>
+		<method name="SetLogLevel">
+			<arg name="level" type="s" direction="in"/>
+		</method>
+		<property name="Active" type="b" access="read"/>
+		<property name="Locked" type="b" access="read"/>
+		<property name="ActiveTime" type="u" access="read">
+			<annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal" value="false"/>
+		</property>
+		<property name="Timeout" type="u" access="read"/>
+		<property name="Inhibited" type="b" access="read"/>
+		<property name="DpmsEnabled" type="b" access="read"/>
+	</interface>
+</node>
+'''
+
+	STATE_TYPES = {
+		'Active': 'b',
+		'Locked': 'b',
+		'ActiveTime': 'u',
+		'Timeout': 'u',
+		'Inhibited': 'b',
+		'DpmsEnabled': 'b'
+	}
+
+	# changes constantly, so it is not announced by PropertiesChanged
+	STATE_UNANNOUNCED = ['ActiveTime']
+
+	LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
 
-	def __init__(self, owner):
+	def __init__(self, owner, state, connection, display=None):
 		self._owner = owner
+		self._state = state
+		# None outside --supervise, where everything is this display's
+		self._display = display
+		self._announced_state = None
+		self._announced_version = None
+		self._pending = {}
 
 		LOG.debug("Adding %s dbus service", self.GS_SERVICE)
-		bus = dbus.SessionBus()
-		bus_name = dbus.service.BusName(name=self.GS_SERVICE, bus=bus)
-		super(FauxGnomeScreensaverDBusService, self).__init__(bus_name, self.GS_PATH)
+		self._connection = connection
+
+		# objects must be registered before the name is claimed
+		node_info = Gio.DBusNodeInfo.new_for_xml(self.INTROSPECTION_XML)
+		self._registration_ids = [self._connection.register_object_with_closures(self.GS_PATH, i, self._method_call, self._get_property, None) for i in node_info.interfaces]
+		self._owner_id = Gio.bus_own_name_on_connection(self._connection, self.GS_SERVICE, Gio.BusNameOwnerFlags.NONE, self._name_acquired, self._name_lost)
+
+		self._methods = {
+			(self.GS_INTERFACE, 'Quit'): self.Quit,
+			(self.GS_INTERFACE, 'Lock'): self.Lock,
+			(self.GS_INTERFACE, 'SimulateUserActivity'): self.SimulateUserActivity,
+			(self.GS_INTERFACE, 'SetActive'): self.SetActive,
+			(self.GS_INTERFACE, 'GetActive'): self.GetActive,
+			(self.GS_INTERFACE, 'GetActiveTime'): self.GetActiveTime,
+			(self.GS_INTERFACE, 'ShowMessage'): self.ShowMessage,
+			(self.FGS_INTERFACE, 'GetState'): self.GetState,
+			(self.FGS_INTERFACE, 'GetMetrics'): self.GetMetrics,
+			(self.FGS_INTERFACE, 'GetTrace'): self.GetTrace,
+			(self.FGS_INTERFACE, 'GetLogLevel'): self.GetLogLevel,
+			(self.FGS_INTERFACE, 'SetLogLevel'): self.SetLogLevel
+		}
 
 	def uninit(self):
 		LOG.debug("Removing %s dbus service", self.GS_SERVICE)
+		Gio.bus_unown_name(self._owner_id)
+		for registration_id in self._registration_ids:
+			self._connection.unregister_object(registration_id)
+
 		self._owner = None
+		self._state = None
+		self._announced_state = None
+		self._announced_version = None
+		self._pending = None
+		self._connection = None
+		self._registration_ids = None
+		self._owner_id = None
+		self._methods = None
+
+	def _name_acquired(self, connection, name):
+		LOG.debug("Acquired %s bus name (%.1f ms)", name, startup_ms())
+
+	def _name_lost(self, connection, name):
+		LOG.warning("Cannot own %s bus name", name)
+
+	def _method_call(self, connection, sender, object_path, interface_name, method_name, parameters, invocation):
+		METRICS.count('wakeups_total', source='dbus-method', display=self._display)
+		if RECORDER.active:
+			RECORDER.record('call', sender=sender, iface=interface_name, name=method_name, args=parameters.print_(True))
+		with TRACER.trigger('dbus:' + method_name, sender=sender, display=self._display):
+			args = parameters.unpack()
+			self._log_method(method_name, sender, args)
+			self._pending[invocation] = (method_name, time.monotonic(), TRACER.current)
+			self._methods[(interface_name, method_name)](invocation, *args)
+
+	# called once per property for GetAll; only FGS_INTERFACE has any, and
+	# GDBus refuses Set since they are all read-only
+	def _get_property(self, connection, sender, object_path, interface_name, property_name):
+		METRICS.count('wakeups_total', source='dbus-property', display=self._display)
+		self._log_method('Get', sender, (interface_name, property_name))
+		# GDBus aborts if this returns no value without an error, so
+		# DpmsEnabled reads as False while it is unknown
+		value = self._state.snapshot().as_dict().get(property_name, False)
+		self._log_method_return('Get', value)
+		return GLib.Variant(self.STATE_TYPES[property_name], value)
+
+	def _call_finished(self, invocation):
+		call = self._pending.pop(invocation, None) if self._pending is not None else None
+		if call is not None:
+			method, started, trace_id = call
+			ended = time.monotonic()
+			# not by sender, every command line client has a new unique name
+			METRICS.observe('dbus_method_duration_seconds', ended - started, method=method, display=self._display)
+			TRACER.add('dbus-reply:' + method, started, ended, trace_id)
+
+	def _return_value(self, invocation, value):
+		self._call_finished(invocation)
+		invocation.return_value(value)
+
+	def _return_error(self, invocation, name, message):
+		self._call_finished(invocation)
+		invocation.return_dbus_error(name, message)
+
+	def _variants(self, state):
+		return dict((k, GLib.Variant(self.STATE_TYPES[k], v)) for k, v in state.items())
+
+	def state_changed(self):
+		snapshot = self._state.snapshot()
+		if snapshot.version == self._announced_version:
+			return
+		self._announced_version = snapshot.version
+
+		state = snapshot.as_dict()
+		for k in self.STATE_UNANNOUNCED:
+			state.pop(k, None)
+
+		if self._announced_state is None:
+			changed = state
+		else:
+			changed = dict((k, v) for k, v in state.items() if self._announced_state.get(k) != v)
+		self._announced_state = state
+
+		if changed:
+			self._log_signal('PropertiesChanged', (self.FGS_INTERFACE, changed))
+			self._emit_signal(self.DBUS_INTERFACE_PROPERTIES, 'PropertiesChanged', GLib.Variant('(sa{sv}as)', (self.FGS_INTERFACE, self._variants(changed), [])))
 
+	def active_changed(self, new_value):
+		self._log_signal('ActiveChanged', (new_value,))
+		self._emit_signal(self.GS_INTERFACE, 'ActiveChanged', GLib.Variant('(b)', (new_value,)))
+
+	def _emit_signal(self, interface_name, signal_name, parameters):
+		try:
+			self._connection.emit_signal(None, self.GS_PATH, interface_name, signal_name, parameters)
+		except GLib.Error as err:
+			LOG.error("Cannot emit %s signal: %s", signal_name, err.message)
+
+	# these run for every call and signal, so skip building fields when
+	# debug logging is off
 	def _log_method(self, method, sender, in_args=None):
-		LOG.debug("Received %s method call to org.gnome.ScreenSaver from %s", method, sender or "unknown sender")
+		if not LOG.isEnabledFor(logging.DEBUG):
+			return
+		fields = journal_fields(component='service', method=method, sender=sender)
+		LOG.debug("Received %s method call to org.gnome.ScreenSaver from %s", method, sender or "unknown sender", extra=fields)
 		if in_args:
-			LOG.debug("  with arguments: %s", in_args)
+			LOG.debug("  with arguments: %s", in_args, extra=fields)
 
 	def _log_method_return(self, method, value):
-		LOG.debug("Returning %s for %s method call", value, method)
+		if not LOG.isEnabledFor(logging.DEBUG):
+			return
+		LOG.debug("Returning %s for %s method call", value, method, extra=journal_fields(component='service', method=method))
 
 	def _log_signal(self, signal, out_args=None):
-		LOG.debug("Emitting %s signal from org.gnome.ScreenSaver", signal)
+		if not LOG.isEnabledFor(logging.DEBUG):
+			return
+		fields = journal_fields(component='service', signal=signal)
+		LOG.debug("Emitting %s signal from org.gnome.ScreenSaver", signal, extra=fields)
 		if out_args:
-			LOG.debug("  with values: %s", out_args)
+			LOG.debug("  with values: %s", out_args, extra=fields)
 
-	@dbus.service.method(dbus_interface='org.gnome.ScreenSaver', sender_keyword='sender')
-	def Quit(self, sender=None):
-		self._log_method('Quit', sender)
+	def Quit(self, invocation):
+		self._return_value(invocation, None)
 		self._owner.emit('quit')
 
-	@dbus.service.method(dbus_interface='org.gnome.ScreenSaver', sender_keyword='sender')
-	def Lock(self, sender=None):
-		self._log_method('Lock', sender)
-		self._owner.emit('lock')
-
-	@dbus.service.method(dbus_interface='org.gnome.ScreenSaver', sender_keyword='sender')
-	def SimulateUserActivity(self, sender=None):
-		self._log_method('SimulateUserActivity', sender)
-		self._owner.emit('simulate-user-activity')
-
-	@dbus.service.method(dbus_interface='org.gnome.ScreenSaver', in_signature='b', sender_keyword='sender')
-	def SetActive(self, value, sender=None):
-		self._log_method('SetActive', sender, (value,))
-		self._owner.emit('set-active', value)
-
-	@dbus.service.method(dbus_interface='org.gnome.ScreenSaver', out_signature='b', sender_keyword='sender')
-	def GetActive(self, sender=None):
-		self._log_method('GetActive', sender)
-		active = self._owner.emit('get-active')
+	# replies are sent once xscreensaver has been told, not before
+	def Lock(self, invocation):
+		self._owner.emit('lock', lambda: self._return_value(invocation, None))
+
+	def SimulateUserActivity(self, invocation):
+		self._owner.emit('simulate-user-activity', lambda: self._return_value(invocation, None))
+
+	def SetActive(self, invocation, value):
+		self._owner.emit('set-active', value, lambda: self._return_value(invocation, None))
+
+	def GetActive(self, invocation):
+		active = bool(self._state.active)
 		self._log_method_return('GetActive', active)
-		return active
+		self._return_value(invocation, GLib.Variant('(b)', (active,)))
 
-	@dbus.service.method(dbus_interface='org.gnome.ScreenSaver', out_signature='u', sender_keyword='sender')
-	def GetActiveTime(self, sender=None):
-		self._log_method('GetActiveTime', sender)
-		seconds = self._owner.emit('get-active-time')
+	def GetActiveTime(self, invocation):
+		seconds = self._state.snapshot().active_time
 		self._log_method_return('GetActiveTime', seconds)
-		return seconds
+		self._return_value(invocation, GLib.Variant('(u)', (seconds,)))
 
-	@dbus.service.method(dbus_interface='org.gnome.ScreenSaver', in_signature='sss', sender_keyword='sender')
-	def ShowMessage(self, summary, body, icon, sender=None):
-		self._log_method('ShowMessage', sender, (summary, body, icon))
+	def ShowMessage(self, invocation, summary, body, icon):
 		# FIXME
-		LOG.warning("ShowMessage not implemented: sender=%s summary=%s body=%s icon=%s", sender, summary, body, icon)
-
-	@dbus.service.signal(dbus_interface='org.gnome.ScreenSaver', signature='b')
-	def ActiveChanged(self, new_value):
-		self._log_signal('ActiveChanged', (new_value,))
+		LOG.warning("ShowMessage not implemented: summary=%s body=%s icon=%s", summary, body, icon)
+		self._return_value(invocation, None)
+
+	def GetState(self, invocation):
+		state = self._state.snapshot().as_dict()
+		self._log_method_return('GetState', state)
+		self._return_value(invocation, GLib.Variant('(a{sv})', (self._variants(state),)))
+
+	# under --supervise, only this display's metrics and traces, and those
+	# of the whole process
+	def GetMetrics(self, invocation):
+		metrics = METRICS.as_dict((self._display, '') if self._display is not None else None)
+		self._log_method_return('GetMetrics', metrics)
+		self._return_value(invocation, GLib.Variant('(a{sd})', (metrics,)))
+
+	def GetTrace(self, invocation):
+		self._return_value(invocation, GLib.Variant('(s)', (TRACER.as_json(self._display),)))
+
+	def GetLogLevel(self, invocation):
+		level = logging.getLevelName(LOG.getEffectiveLevel())
+		self._log_method_return('GetLogLevel', level)
+		self._return_value(invocation, GLib.Variant('(s)', (level,)))
+
+	def SetLogLevel(self, invocation, level):
+		# one log level for the whole process, not one per display
+		if self._display is not None:
+			self._return_error(invocation, 'org.freedesktop.DBus.Error.NotSupported', "The log level cannot be changed with --supervise")
+			return
+		if level.upper() not in self.LOG_LEVELS:
+			self._return_error(invocation, 'org.freedesktop.DBus.Error.InvalidArgs', "Unknown log level %s, expected one of %s" % (level, ', '.join(self.LOG_LEVELS)))
+			return
+		LOG.setLevel(level.upper())
+		LOG.info("Log level changed to %s", level.upper())
+		self._return_value(invocation, None)
 
 
 class FauxGnomeScreensaverService(GObject.GObject):
 	__gsignals__ = {
 		'quit': (GObject.SignalFlags.RUN_LAST, None, ()),
-		'lock': (GObject.SignalFlags.RUN_LAST, None, ()),
-		'simulate-user-activity': (GObject.SignalFlags.RUN_LAST, None, ()),
-		'set-active': (GObject.SignalFlags.RUN_LAST, None, (bool,)),
-		'get-active': (GObject.SignalFlags.RUN_LAST, bool, ()),
-		'get-active-time': (GObject.SignalFlags.RUN_LAST, int, ())
+		'lock': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+		'simulate-user-activity': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+		'set-active': (GObject.SignalFlags.RUN_LAST, None, (bool, object))
 	}
 
-	def __init__(self):
+	def __init__(self, state, bus=None, display=None):
+		self._state = state
+		# None for the session bus of this process
+		self._session_bus = bus
+		self._display = display
 		self._service = None
 
 		super(FauxGnomeScreensaverService, self).__init__()
 
 	def activate(self):
-		self._service = FauxGnomeScreensaverDBusService(self)
+		bus = self._session_bus or Gio.bus_get_sync(Gio.BusType.SESSION, None)
+		self._service = FauxGnomeScreensaverDBusService(self, self._state, bus, self._display)
 
 	def deactivate(self):
 		if self._service:
@@ -398,7 +2136,11 @@ class FauxGnomeScreensaverService(GObject.GObject):
 
 	def active_changed(self, active):
 		if self._service:
-			self._service.ActiveChanged(active)
+			self._service.active_changed(active)
+
+	def state_changed(self):
+		if self._service:
+			self._service.state_changed()
 
 
 class GnomeSessionManagerListener(GObject.GObject):
@@ -409,42 +2151,153 @@ class GnomeSessionManagerListener(GObject.GObject):
 	GSM_SERVICE = 'org.gnome.SessionManager'
 	GSM_PATH = '/org/gnome/SessionManager'
 	GSM_INTERFACE = 'org.gnome.SessionManager'
+	GSM_INHIBITOR_INTERFACE = 'org.gnome.SessionManager.Inhibitor'
 	GSM_INHIBITOR_FLAG_IDLE = 8
 
-	def __init__(self):
-		self._iface = None
+	# a remove / add pair within this time does not uninhibit and inhibit
+	INHIBITED_DELAY = 500 # in milliseconds
+
+	def __init__(self, bus=None, display=None):
+		# None for the session bus of this process
+		self._session_bus = bus
+		# only labels metrics and traces
+		self._display = display
+		self._bus = None
 		self._inhibited = None
+		self._inhibitors = None
+		self._idle_inhibitors = None
+		self._fallback = False
+		self._pending_inhibited = None
+		self._inhibited_id = None
+		self._matches = []
 
 		super(GnomeSessionManagerListener, self).__init__()
 
 	def activate(self):
-		bus = dbus.SessionBus()
-		proxy = bus.get_object(self.GSM_SERVICE, self.GSM_PATH)
-		iface = dbus.Interface(proxy, dbus_interface=self.GSM_INTERFACE)
-
-		self._iface = iface
-		self._check_inhibited()
+		self._bus = self._session_bus or Gio.bus_get_sync(Gio.BusType.SESSION, None)
+		self._inhibitors = {}
+		self._idle_inhibitors = set()
 
 		LOG.debug("Listening for signals from %s", self.GSM_INTERFACE)
-		iface.connect_to_signal('InhibitorAdded', self._inhibitor_added)
-		iface.connect_to_signal('InhibitorRemoved', self._inhibitor_removed)
+		for s, h in [
+					('InhibitorAdded', self._inhibitor_added),
+					('InhibitorRemoved', self._inhibitor_removed)
+				]:
+			self._matches.append(dbus_subscribe(self._bus, self.GSM_SERVICE, self.GSM_INTERFACE, s, self.GSM_PATH, h, display=self._display))
+
+		dbus_call(self._bus, self.GSM_SERVICE, self.GSM_PATH, self.GSM_INTERFACE, 'GetInhibitors', None, self._inhibitors_received, self._inhibitors_error)
 
 	def deactivate(self):
 		LOG.debug("Disconnecting from %s", self.GSM_INTERFACE)
-		self._iface = None
+
+		for m in self._matches:
+			self._bus.signal_unsubscribe(m)
+
+		if self._inhibited_id is not None:
+			GLib.source_remove(self._inhibited_id)
+
+		self._bus = None
 		self._inhibited = None
+		self._inhibitors = None
+		self._idle_inhibitors = None
+		self._fallback = False
+		self._pending_inhibited = None
+		self._inhibited_id = None
+		self._matches = []
 
-	def _inhibitor_added(self, inhibitor_id):
-		LOG.debug("Received InhibitorAdded signal from %s", self.GSM_INTERFACE)
+	def _inhibitors_error(self, err):
+		LOG.debug("Cannot get inhibitors from %s, checking IsInhibited instead: %s", self.GSM_INTERFACE, err)
+		self._fallback = True
 		self._check_inhibited()
 
-	def _inhibitor_removed(self, inhibitor_id):
-		LOG.debug("Received InhibitorRemoved signal from %s", self.GSM_INTERFACE)
-		self._check_inhibited()
+	def _inhibitors_received(self, inhibitor_ids):
+		if self._bus is None:
+			return
+
+		LOG.debug("%s has %d inhibitors (%.1f ms)", self.GSM_INTERFACE, len(inhibitor_ids), startup_ms())
+		for inhibitor_id in inhibitor_ids:
+			self._add_inhibitor(inhibitor_id)
+		if not inhibitor_ids:
+			self._update_inhibited()
+
+	def _inhibitor_added(self, path, inhibitor_id):
+		if LOG.isEnabledFor(logging.DEBUG):
+			LOG.debug("Received InhibitorAdded signal from %s", self.GSM_INTERFACE, extra=journal_fields(component='gnome-session'))
+		if self._fallback:
+			self._check_inhibited()
+		else:
+			self._add_inhibitor(inhibitor_id)
+
+	def _inhibitor_removed(self, path, inhibitor_id):
+		if LOG.isEnabledFor(logging.DEBUG):
+			LOG.debug("Received InhibitorRemoved signal from %s", self.GSM_INTERFACE, extra=journal_fields(component='gnome-session'))
+		if self._fallback:
+			self._check_inhibited()
+		elif inhibitor_id in self._inhibitors:
+			del self._inhibitors[inhibitor_id]
+			self._idle_inhibitors.discard(inhibitor_id)
+			self._update_inhibited()
+
+	def _add_inhibitor(self, inhibitor_id):
+		# flags are unknown until GetFlags returns
+		self._inhibitors[inhibitor_id] = None
+		dbus_call(self._bus, self.GSM_SERVICE, inhibitor_id, self.GSM_INHIBITOR_INTERFACE, 'GetFlags', None,
+			lambda flags: self._flags_received(inhibitor_id, flags), lambda err: self._flags_error(inhibitor_id, err))
+
+	def _flags_error(self, inhibitor_id, err):
+		LOG.debug("Cannot get flags for inhibitor %s: %s", inhibitor_id, err)
+		if self._bus is None or inhibitor_id not in self._inhibitors:
+			return
+
+		# it may have been the last one that the first result waits for
+		del self._inhibitors[inhibitor_id]
+		self._update_inhibited()
+
+	def _flags_received(self, inhibitor_id, flags):
+		# the inhibitor may have been removed while waiting
+		if self._bus is None or inhibitor_id not in self._inhibitors:
+			return
+
+		LOG.debug("Inhibitor %s has flags %d", inhibitor_id, flags)
+		self._inhibitors[inhibitor_id] = flags
+		if flags & self.GSM_INHIBITOR_FLAG_IDLE:
+			self._idle_inhibitors.add(inhibitor_id)
+		self._update_inhibited()
 
 	def _check_inhibited(self):
-		inhibited = self._iface.IsInhibited(self.GSM_INHIBITOR_FLAG_IDLE)
+		dbus_call(self._bus, self.GSM_SERVICE, self.GSM_PATH, self.GSM_INTERFACE, 'IsInhibited', GLib.Variant('(u)', (self.GSM_INHIBITOR_FLAG_IDLE,)), self._inhibited_received, self._inhibited_error)
+
+	def _inhibited_error(self, err):
+		LOG.debug("Cannot check if %s is inhibited: %s", self.GSM_INTERFACE, err)
+
+	def _inhibited_received(self, inhibited):
+		if self._bus is None:
+			return
+
+		self._update_inhibited(bool(inhibited))
+
+	def _update_inhibited(self, inhibited=None):
+		if inhibited is None:
+			# a non-idle inhibitor answering first must not announce that we
+			# are not inhibited while an idle one has yet to answer
+			if self._inhibited is None and None in self._inhibitors.values():
+				return
+			inhibited = bool(self._idle_inhibitors)
 		LOG.debug("%s is %s", self.GSM_INTERFACE, 'idle inhibited' if inhibited else 'not idle inhibited')
+
+		self._pending_inhibited = inhibited
+		if self._inhibited is None:
+			# first result, no need to wait
+			self._emit_inhibited(inhibited)
+		elif self._inhibited_id is None:
+			self._inhibited_id = GLib.timeout_add(self.INHIBITED_DELAY, self._inhibited_timeout)
+
+	def _inhibited_timeout(self):
+		self._inhibited_id = None
+		self._emit_inhibited(self._pending_inhibited)
+		return False
+
+	def _emit_inhibited(self, inhibited):
 		if inhibited != self._inhibited:
 			self._inhibited = inhibited
 			self.emit('inhibited-changed', inhibited)
@@ -468,67 +2321,96 @@ class ConsoleKitListener(GObject.GObject):
 	CK_SESSION_INTERFACE = CK_INTERFACE + '.Session'
 
 	def __init__(self):
+		self._bus = None
 		self._ssid = None
 		self._matches = []
 
 		super(ConsoleKitListener, self).__init__()
 
 	def activate(self):
-		bus = dbus.SystemBus()
+		self._bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
 
 		LOG.debug("Getting current ConsoleKit session id")
-		try:
-			manager = bus.get_object(self.CK_SERVICE, self.CK_MANAGER_PATH)
-			ssid = manager.GetCurrentSession(dbus_interface=self.CK_MANAGER_INTERFACE)
-		except dbus.exceptions.DBusException as err:
-			LOG.debug("Cannot get current ConsoleKit session id: %s", err)
-			ssid = None
-
-		if ssid is not None:
-			self._ssid = ssid
-
-			LOG.debug("Listening for signals from %s", self.CK_SESSION_INTERFACE)
-			# sender path is the session id
-			for s, h in [
-						('Lock', self._lock),
-						('Unlock', self._unlock),
-						('ActiveChanged', self._active_changed)
-					]:
-				self._matches.append(bus.add_signal_receiver(h, signal_name=s, dbus_interface=self.CK_SESSION_INTERFACE, path_keyword='path'))
+		dbus_call(self._bus, self.CK_SERVICE, self.CK_MANAGER_PATH, self.CK_MANAGER_INTERFACE, 'GetCurrentSession', None, self._session_received, self._session_error)
+
+	def _session_error(self, err):
+		LOG.debug("Cannot get current ConsoleKit session id: %s", err)
+
+	def _session_received(self, ssid):
+		if self._bus is None:
+			return
+
+		LOG.debug("Current ConsoleKit session id is %s (%.1f ms)", ssid, startup_ms())
+		self._ssid = ssid
+
+		LOG.debug("Listening for signals from %s", self.CK_SESSION_INTERFACE)
+		# sender path is the session id
+		for s, h in [
+					('Lock', self._lock),
+					('Unlock', self._unlock),
+					('ActiveChanged', self._active_changed)
+				]:
+			self._matches.append(dbus_subscribe(self._bus, None, self.CK_SESSION_INTERFACE, s, ssid, h))
 
 	def deactivate(self):
 		LOG.debug("Disconnecting from %s", self.CK_SESSION_INTERFACE)
 
 		for m in self._matches:
-			m.remove()
+			self._bus.signal_unsubscribe(m)
 
+		self._bus = None
 		self._ssid = None
 		self._matches = []
 
-	def _lock(self, path=None):
+	def _lock(self, path):
 		if path == self._ssid:
-			LOG.debug("Received Lock signal from %s", self.CK_SESSION_INTERFACE)
+			if LOG.isEnabledFor(logging.DEBUG):
+				LOG.debug("Received Lock signal from %s", self.CK_SESSION_INTERFACE, extra=journal_fields(component='consolekit'))
 			self.emit('lock')
 
-	def _unlock(self, path=None):
+	def _unlock(self, path):
 		if path == self._ssid:
-			LOG.debug("Received Unlock signal from %s", self.CK_SESSION_INTERFACE)
+			if LOG.isEnabledFor(logging.DEBUG):
+				LOG.debug("Received Unlock signal from %s", self.CK_SESSION_INTERFACE, extra=journal_fields(component='consolekit'))
 			self.emit('unlock')
 
-	def _active_changed(self, is_active, path=None):
+	def _active_changed(self, path, is_active):
 		if path == self._ssid:
-			LOG.debug("Received ActiveChanged signal from %s, is_active=%s", self.CK_SESSION_INTERFACE, is_active)
+			if LOG.isEnabledFor(logging.DEBUG):
+				LOG.debug("Received ActiveChanged signal from %s, is_active=%s", self.CK_SESSION_INTERFACE, is_active, extra=journal_fields(component='consolekit'))
 			if is_active:
 				self.emit('is-active')
 
 
-class SystemdLogindListener(GObject.GObject):
+# one logind session, i.e. one display
+class SystemdLogindSession(GObject.GObject):
 	__gsignals__ = {
 		'lock': (GObject.SignalFlags.RUN_LAST, None, ()),
 		'unlock': (GObject.SignalFlags.RUN_LAST, None, ()),
 		'is-active': (GObject.SignalFlags.RUN_LAST, None, ())
 	}
 
+	def __init__(self, state, session_id=None):
+		self.state = state
+		# None for the session this process is running in
+		self.session_id = session_id
+		self.path = None
+		self.active = None
+
+		super(SystemdLogindSession, self).__init__()
+
+	@property
+	def name(self):
+		return self.session_id or 'current'
+
+
+# shared by every display, so that there is one set of logind signal
+# subscriptions and one sleep inhibitor per process
+class SystemdLogindListener(GObject.GObject):
+	__gsignals__ = {
+		'prepare-for-sleep': (GObject.SignalFlags.RUN_LAST, None, (bool,))
+	}
+
 	SYSTEMD_LOGIND_SERVICE = 'org.freedesktop.login1'
 	SYSTEMD_LOGIND_PATH = '/org/freedesktop/login1'
 	SYSTEMD_LOGIND_INTERFACE = 'org.freedesktop.login1.Manager'
@@ -536,84 +2418,272 @@ class SystemdLogindListener(GObject.GObject):
 	SYSTEMD_LOGIND_SESSION_PATH = '/org/freedesktop/login1/session'
 	SYSTEMD_LOGIND_SESSION_INTERFACE = 'org.freedesktop.login1.Session'
 
+	DBUS_SERVICE = 'org.freedesktop.DBus'
+	DBUS_PATH = '/org/freedesktop/DBus'
+	DBUS_INTERFACE = 'org.freedesktop.DBus'
 	DBUS_INTERFACE_PROPERTIES = 'org.freedesktop.DBus.Properties'
 
+	# suspend is held off until the screen is locked, but not for longer
+	# than this (logind's own limit is InhibitDelayMaxSec, 5 seconds)
+	SLEEP_LOCK_TIMEOUT = 3 # in seconds
+
 	def __init__(self):
-		self._ssid = None
+		self._bus = None
+		self._running = None
+		self._sessions = []
+		self._paths = {}
 		self._matches = []
+		self._session_matches = {}
+		self._inhibitor_fd = None
+		self._inhibitor_pending = False
+		self._sleep_started = None
+		self._sleep_timeout_id = None
 
 		super(SystemdLogindListener, self).__init__()
 
+	def add_session(self, session):
+		self._sessions.append(session)
+		if self._running:
+			self._find_session(session)
+
+	def remove_session(self, session):
+		self._sessions.remove(session)
+		if session.path is not None:
+			self._paths.pop(session.path, None)
+			for m in self._session_matches.pop(session.path, []):
+				self._bus.signal_unsubscribe(m)
+		session.path = None
+		session.active = None
+		# it may be the one that sleep is waiting for
+		self.state_changed()
+
 	def activate(self):
+		self._bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+
+		# ask the bus rather than look for /run/systemd/seats, so that logind
+		# is found wherever it is running (including in the benchmarks)
 		LOG.debug("Checking if logind is running")
-		if os.path.exists('/run/systemd/seats/'):
-			bus = dbus.SystemBus()
+		dbus_call(self._bus, self.DBUS_SERVICE, self.DBUS_PATH, self.DBUS_INTERFACE, 'NameHasOwner', GLib.Variant('(s)', (self.SYSTEMD_LOGIND_SERVICE,)), self._has_owner_received, self._has_owner_error)
 
-			LOG.debug("Getting current logind session id")
-			try:
-				manager = bus.get_object(self.SYSTEMD_LOGIND_SERVICE, self.SYSTEMD_LOGIND_PATH)
-				ssid = manager.GetSessionByPID(os.getpid(), dbus_interface=self.SYSTEMD_LOGIND_INTERFACE)
-			except dbus.exceptions.DBusException as err:
-				LOG.debug("Cannot get current logind session id: %s", err)
-				ssid = None
-
-			if ssid is not None:
-				self._ssid = ssid
-
-				LOG.debug("Listening for signals from %s", self.SYSTEMD_LOGIND_SERVICE)
-				# sender path is the session id
-				for s, h, i in [
-							('Lock', self._lock, self.SYSTEMD_LOGIND_SESSION_INTERFACE),
-							('Unlock', self._unlock, self.SYSTEMD_LOGIND_SESSION_INTERFACE),
-							('PropertiesChanged', self._properties_changed, self.DBUS_INTERFACE_PROPERTIES),
-							('PrepareForSleep', self._prepare_for_sleep, self.SYSTEMD_LOGIND_INTERFACE)
-						]:
-					self._matches.append(bus.add_signal_receiver(h, signal_name=s, dbus_interface=i, bus_name=self.SYSTEMD_LOGIND_SERVICE, path_keyword='path'))
+	def _has_owner_error(self, err):
+		LOG.debug("Cannot check if logind is running: %s", err)
 
-		else:
+	def _has_owner_received(self, has_owner):
+		if self._bus is None:
+			return
+
+		if not has_owner:
 			LOG.debug("logind is not running")
+			return
+
+		self._running = True
+		for session in self._sessions:
+			self._find_session(session)
+
+	def _find_session(self, session):
+		LOG.debug("Getting logind session path for %s session", session.name)
+		if session.session_id is None:
+			method, parameters = 'GetSessionByPID', GLib.Variant('(u)', (os.getpid(),))
+		else:
+			method, parameters = 'GetSession', GLib.Variant('(s)', (session.session_id,))
+		dbus_call(self._bus, self.SYSTEMD_LOGIND_SERVICE, self.SYSTEMD_LOGIND_PATH, self.SYSTEMD_LOGIND_INTERFACE, method, parameters,
+			lambda path: self._session_received(session, path), lambda err: self._session_error(session, err))
+
+	def _session_error(self, session, err):
+		LOG.debug("Cannot get logind session path for %s session: %s", session.name, err)
+
+	def _session_received(self, session, path):
+		# the session may have been removed while waiting
+		if self._bus is None or session not in self._sessions:
+			return
+
+		LOG.debug("Logind session path for %s session is %s (%.1f ms)", session.name, path, startup_ms())
+		session.path = path
+		self._paths[path] = session
+
+		LOG.debug("Listening for signals from %s for %s", self.SYSTEMD_LOGIND_SERVICE, path)
+		# only this session's signals, and only its own property changes
+		self._session_matches[path] = [dbus_subscribe(self._bus, self.SYSTEMD_LOGIND_SERVICE, i, s, path, h, arg0) for s, h, i, arg0 in [
+			('Lock', self._lock, self.SYSTEMD_LOGIND_SESSION_INTERFACE, None),
+			('Unlock', self._unlock, self.SYSTEMD_LOGIND_SESSION_INTERFACE, None),
+			('PropertiesChanged', self._properties_changed, self.DBUS_INTERFACE_PROPERTIES, self.SYSTEMD_LOGIND_SESSION_INTERFACE)
+		]]
+
+		# so that logind repeating Active=true is not taken for a switch
+		# back to the session
+		dbus_call(self._bus, self.SYSTEMD_LOGIND_SERVICE, path, self.DBUS_INTERFACE_PROPERTIES, 'Get', GLib.Variant('(ss)', (self.SYSTEMD_LOGIND_SESSION_INTERFACE, 'Active')),
+			lambda is_active: self._initial_active_received(session, path, is_active), lambda err: self._active_error(session, err))
+
+		if not self._matches:
+			self._matches.append(dbus_subscribe(self._bus, self.SYSTEMD_LOGIND_SERVICE, self.SYSTEMD_LOGIND_INTERFACE, 'PrepareForSleep', self.SYSTEMD_LOGIND_PATH, self._prepare_for_sleep))
+			self._take_inhibitor()
 
 	def deactivate(self):
 		LOG.debug("Disconnecting from %s", self.SYSTEMD_LOGIND_SERVICE)
 
 		for m in self._matches:
-			m.remove()
+			self._bus.signal_unsubscribe(m)
+		for matches in self._session_matches.values():
+			for m in matches:
+				self._bus.signal_unsubscribe(m)
 
-		self._ssid = None
-		self._matches = []
+		if self._sleep_timeout_id is not None:
+			GLib.source_remove(self._sleep_timeout_id)
 
-	def _lock(self, path=None):
-		if path == self._ssid:
-			LOG.debug("Received Lock signal from %s", self.SYSTEMD_LOGIND_SERVICE)
-			self.emit('lock')
+		self._release_inhibitor()
 
-	def _unlock(self, path=None):
-		if path == self._ssid:
-			LOG.debug("Received Unlock signal from %s", self.SYSTEMD_LOGIND_SERVICE)
-			self.emit('unlock')
+		for session in self._sessions:
+			session.path = None
+			session.active = None
 
-	def _properties_changed(self, interface_name, changed_properties, invalidated_properties, path=None):
-		if path == self._ssid:
-			LOG.debug("Received PropertiesChanged signal from %s", self.SYSTEMD_LOGIND_SERVICE)
-			LOG.debug("  changed: %s", changed_properties)
-			LOG.debug("  invalidated: %s", invalidated_properties)
+		self._bus = None
+		self._running = None
+		self._paths = {}
+		self._matches = []
+		self._session_matches = {}
+		self._inhibitor_fd = None
+		self._inhibitor_pending = False
+		self._sleep_started = None
+		self._sleep_timeout_id = None
+
+	def _take_inhibitor(self):
+		if self._inhibitor_fd is not None or self._inhibitor_pending:
+			return
+
+		LOG.debug("Taking sleep delay inhibitor from %s", self.SYSTEMD_LOGIND_SERVICE)
+		self._inhibitor_pending = True
+		# the reply carries a file descriptor, which dbus_call cannot handle
+		self._bus.call_with_unix_fd_list(self.SYSTEMD_LOGIND_SERVICE, self.SYSTEMD_LOGIND_PATH, self.SYSTEMD_LOGIND_INTERFACE, 'Inhibit',
+			GLib.Variant('(ssss)', ('sleep', 'faux-gnome-screensaver', "Locking the screen before sleeping", 'delay')),
+			GLib.VariantType('(h)'), Gio.DBusCallFlags.NONE, -1, None, None, self._inhibitor_received)
+
+	def _inhibitor_received(self, bus, result, *user_data):
+		self._inhibitor_pending = False
+		try:
+			reply, fd_list = bus.call_with_unix_fd_list_finish(result)
+		except GLib.Error as err:
+			LOG.debug("Cannot take sleep delay inhibitor: %s", err.message)
+			return
+
+		# get() returns a duplicate that is ours to close
+		fd = fd_list.get(reply.unpack()[0])
+		if self._bus is None:
+			os.close(fd)
+			return
+
+		LOG.debug("Took sleep delay inhibitor")
+		self._inhibitor_fd = fd
+
+	def _release_inhibitor(self):
+		if self._inhibitor_fd is not None:
+			LOG.debug("Releasing sleep delay inhibitor")
+			os.close(self._inhibitor_fd)
+			self._inhibitor_fd = None
+
+	# sleep waits for every display to be locked
+	def _all_locked(self):
+		return all(session.state.locked for session in self._sessions)
+
+	def state_changed(self):
+		if self._sleep_started is not None and self._all_locked():
+			self._sleep_locked()
+
+	def _sleep_locked(self):
+		latency = time.monotonic() - self._sleep_started
+		LOG.debug("Locked %.1f ms after PrepareForSleep", latency * 1000)
+		METRICS.observe('sleep_lock_latency_seconds', latency)
+		self._end_sleep_wait()
+
+	def _sleep_timed_out(self):
+		self._sleep_timeout_id = None
+		LOG.warning("Screen not locked %d seconds after PrepareForSleep, letting the system sleep anyway", self.SLEEP_LOCK_TIMEOUT)
+		METRICS.count('sleep_lock_timeouts_total')
+		self._end_sleep_wait()
+		return False
+
+	def _end_sleep_wait(self):
+		if self._sleep_timeout_id is not None:
+			GLib.source_remove(self._sleep_timeout_id)
+			self._sleep_timeout_id = None
+		self._sleep_started = None
+		self._release_inhibitor()
+
+	def _lock(self, path):
+		session = self._paths.get(path)
+		if session is not None:
+			if LOG.isEnabledFor(logging.DEBUG):
+				LOG.debug("Received Lock signal from %s for %s", self.SYSTEMD_LOGIND_SERVICE, path, extra=journal_fields(component='logind'))
+			session.emit('lock')
+
+	def _unlock(self, path):
+		session = self._paths.get(path)
+		if session is not None:
+			if LOG.isEnabledFor(logging.DEBUG):
+				LOG.debug("Received Unlock signal from %s for %s", self.SYSTEMD_LOGIND_SERVICE, path, extra=journal_fields(component='logind'))
+			session.emit('unlock')
+
+	def _properties_changed(self, path, interface_name, changed_properties, invalidated_properties):
+		session = self._paths.get(path)
+		if session is not None and interface_name == self.SYSTEMD_LOGIND_SESSION_INTERFACE:
+			if LOG.isEnabledFor(logging.DEBUG):
+				fields = journal_fields(component='logind')
+				LOG.debug("Received PropertiesChanged signal from %s for %s", self.SYSTEMD_LOGIND_SERVICE, path, extra=fields)
+				LOG.debug("  changed: %s", changed_properties, extra=fields)
+				LOG.debug("  invalidated: %s", invalidated_properties, extra=fields)
 			prop = 'Active'
-			if prop in changed_properties or prop in invalidated_properties:
-				LOG.debug("  Active property for %s was changed, getting new value", path)
-				bus = dbus.SystemBus()
-				proxy = bus.get_object(self.SYSTEMD_LOGIND_SERVICE, path)
-				properties_manager = dbus.Interface(proxy, self.DBUS_INTERFACE_PROPERTIES)
-				is_active = properties_manager.Get(self.SYSTEMD_LOGIND_SESSION_INTERFACE, prop)
-				LOG.debug("  Active property is now %s", is_active)
-				if is_active:
-					self.emit('is-active')
-
-	def _prepare_for_sleep(self, active, path=None):
-		LOG.debug("Received PrepareForSleep signal from %s, active=%s", self.SYSTEMD_LOGIND_SERVICE, active)
+			if prop in changed_properties:
+				self._active_received(session, changed_properties[prop])
+			elif prop in invalidated_properties:
+				LOG.debug("  Active property for %s was invalidated, getting new value", path)
+				dbus_call(self._bus, self.SYSTEMD_LOGIND_SERVICE, path, self.DBUS_INTERFACE_PROPERTIES, 'Get', GLib.Variant('(ss)', (self.SYSTEMD_LOGIND_SESSION_INTERFACE, prop)),
+					lambda is_active: self._active_received(session, is_active), lambda err: self._active_error(session, err))
+
+	def _active_error(self, session, err):
+		LOG.debug("Cannot get Active property for %s: %s", session.path, err)
+
+	def _initial_active_received(self, session, path, is_active):
+		# a PropertiesChanged signal may have got here first
+		if session.path != path or session.active is not None:
+			return
+
+		LOG.debug("Logind session %s is %s", path, 'active' if is_active else 'not active')
+		session.active = bool(is_active)
+
+	def _active_received(self, session, is_active):
+		if session.path is None:
+			return
+
+		LOG.debug("  Active property is now %s", is_active)
+		# logind may announce Active again without it having changed, only
+		# switching back to the session counts as activity
+		was_active = session.active
+		session.active = bool(is_active)
+		if session.active and not was_active:
+			session.emit('is-active')
+
+	def _prepare_for_sleep(self, path, active):
+		if LOG.isEnabledFor(logging.DEBUG):
+			LOG.debug("Received PrepareForSleep signal from %s, active=%s", self.SYSTEMD_LOGIND_SERVICE, active, extra=journal_fields(component='logind'))
+		self.emit('prepare-for-sleep', active)
 		if active:
-			self.emit('lock')
+			# keep the inhibitor until the watchers report LOCK
+			self._sleep_started = time.monotonic()
+			for session in list(self._sessions):
+				session.emit('lock')
+			# state_changed() may have seen every lock already
+			if self._sleep_started is not None:
+				if self._all_locked():
+					self._sleep_locked()
+				elif self._sleep_timeout_id is None:
+					self._sleep_timeout_id = GLib.timeout_add_seconds(self.SLEEP_LOCK_TIMEOUT, self._sleep_timed_out)
+		else:
+			if self._sleep_started is not None:
+				self._end_sleep_wait()
+			self._take_inhibitor()
 
 
+# one per process: under --supervise this clamps the settings of the user
+# running faux-gnome-screensaver, which every display is expected to share
 class GSettingsManager(GObject.GObject):
 	SCHEMA_SCREENSAVER = 'org.gnome.desktop.screensaver'
 	SCHEMA_SESSION = 'org.gnome.desktop.session'
@@ -642,9 +2712,20 @@ class GSettingsManager(GObject.GObject):
 		}
 	}
 
+	# another program that keeps undoing our changes is left alone for a
+	# while instead of fighting it
+	FEEDBACK_WINDOW = 60 # in seconds
+	FEEDBACK_LIMIT = 5 # changes within FEEDBACK_WINDOW
+	BACKOFF_MIN = 60 # in seconds
+	BACKOFF_MAX = 3600 # in seconds
+
 	def __init__(self):
 		self._gsettings = None
 		self._saved = None
+		self._pending = None
+		self._flush_id = None
+		self._write_times = None
+		self._writes = 0
 
 		super(GSettingsManager, self).__init__()
 
@@ -655,6 +2736,8 @@ class GSettingsManager(GObject.GObject):
 			if schema not in self._gsettings:
 				self._gsettings[schema] = Gio.Settings(schema)
 
+		self._pending = {}
+		self._write_times = collections.deque()
 		self._saved = {}
 		for key, info in self.SETTINGS.items():
 			schema = info['schema']
@@ -664,7 +2747,10 @@ class GSettingsManager(GObject.GObject):
 				LOG.debug("Listening to changes to %s.%s", schema, key)
 				self._saved[key] = {
 					'value': None,
-					'handler_id': gsettings.connect('changed::' + key, lambda _, k: self._changed(k))
+					'handler_id': gsettings.connect('changed::' + key, self._setting_changed),
+					'changes': collections.deque(),
+					'backoff': 0,
+					'backoff_id': None
 				}
 				self._changed(key, init=True)
 			else:
@@ -672,34 +2758,110 @@ class GSettingsManager(GObject.GObject):
 
 	def deactivate(self):
 		if self._saved:
+			if self._flush_id is not None:
+				GLib.source_remove(self._flush_id)
+				self._flush_id = None
+			self._pending = {}
+
+			# written now rather than from an idle callback, which would
+			# outlive us (or never run, once the main loop has ended)
+			restore = {}
+			for key, info in self._saved.items():
+				if info['backoff_id'] is not None:
+					GLib.source_remove(info['backoff_id'])
+					info['backoff_id'] = None
+				restore.setdefault(self.SETTINGS[key]['schema'], {})[key] = info['value']
+			for schema, values in restore.items():
+				self._write(schema, values)
+			# make sure the restored values are written before we exit
+			Gio.Settings.sync()
+
 			for key, info in self._saved.items():
 				schema = self.SETTINGS[key]['schema']
-				self._set_setting(key, info['value'])
 				LOG.debug("Disconnecting %s.%s", schema, key)
 				self._gsettings[schema].disconnect(info['handler_id'])
 
 		self._gsettings = None
 		self._saved = None
+		self._pending = None
+		self._flush_id = None
+		self._write_times = None
 
 	def _get_setting(self, key):
 		info = self.SETTINGS[key]
 		return getattr(self._gsettings[info['schema']], 'get_' + info['type'])(key)
 
-	def _set_setting(self, key, value, ret=None):
-		info = self.SETTINGS[key]
-		schema = info['schema']
-		gsettings = self._gsettings[schema]
-		handler_id = self._saved[key]['handler_id']
+	def _queue_write(self, key, value):
+		schema = self.SETTINGS[key]['schema']
+		self._pending.setdefault(schema, {})[key] = value
+		if self._flush_id is None:
+			self._flush_id = GLib.idle_add(self._flush)
+
+	def _flush(self):
+		self._flush_id = None
 
-		LOG.debug("Setting %s.%s to %s", schema, key, value)
-		gsettings.handler_block(handler_id)
-		result = getattr(gsettings, 'set_' + info['type'])(key, value)
-		gsettings.sync()
-		gsettings.handler_unblock(handler_id)
-		if not result:
-			LOG.warning("Unable to set %s.%s to %s", schema, key, value)
+		for schema, values in self._pending.items():
+			self._write(schema, values)
+		self._pending = {}
 
-		return ret if ret is not None else result # for _changed()
+		cutoff = time.monotonic() - 60
+		while self._write_times and self._write_times[0] < cutoff:
+			self._write_times.popleft()
+		LOG.debug("%d GSettings writes in the last minute, %d in total", len(self._write_times), self._writes)
+
+		return False
+
+	# one delay() / apply() transaction per schema
+	def _write(self, schema, values):
+		gsettings = self._gsettings[schema]
+		handler_ids = [self._saved[key]['handler_id'] for key in values]
+
+		for handler_id in handler_ids:
+			gsettings.handler_block(handler_id)
+		gsettings.delay()
+		for key, value in values.items():
+			LOG.debug("Setting %s.%s to %s", schema, key, value)
+			if not getattr(gsettings, 'set_' + self.SETTINGS[key]['type'])(key, value):
+				LOG.warning("Unable to set %s.%s to %s", schema, key, value)
+			METRICS.count('gsettings_writes_total', key=schema + '.' + key)
+		gsettings.apply()
+		for handler_id in handler_ids:
+			gsettings.handler_unblock(handler_id)
+
+		self._writes += 1
+		self._write_times.append(time.monotonic())
+
+	def _in_feedback_loop(self, key):
+		info = self.SETTINGS[key]
+		saved = self._saved[key]
+		if saved['backoff_id'] is not None:
+			LOG.debug("Backing off from %s.%s, not changing it", info['schema'], key)
+			return True
+
+		now = time.monotonic()
+		changes = saved['changes']
+		changes.append(now)
+		while changes[0] < now - self.FEEDBACK_WINDOW:
+			changes.popleft()
+
+		if len(changes) > self.FEEDBACK_LIMIT:
+			saved['backoff'] = min(max(saved['backoff'] * 2, self.BACKOFF_MIN), self.BACKOFF_MAX)
+			changes.clear()
+			LOG.warning("%s.%s keeps being changed by another program, leaving it alone for %d seconds", info['schema'], key, saved['backoff'])
+			saved['backoff_id'] = GLib.timeout_add_seconds(saved['backoff'], self._backoff_done, key)
+			return True
+
+		return False
+
+	def _backoff_done(self, key):
+		self._saved[key]['backoff_id'] = None
+		self._changed(key)
+		return False
+
+	def _setting_changed(self, gsettings, key):
+		METRICS.count('wakeups_total', source='gsettings')
+		with TRACER.trigger('gsettings:' + key):
+			self._changed(key)
 
 	def _changed(self, key, init=False):
 		info = self.SETTINGS[key]
@@ -709,12 +2871,166 @@ class GSettingsManager(GObject.GObject):
 			LOG.debug("Saving initial value %s for %s.%s", value, schema, key)
 		else:
 			LOG.debug("%s.%s changed to %s", schema, key, value)
+		RECORDER.record('gsettings', schema=schema, key=key, value=value, init=init)
 
 		self._saved[key]['value'] = value
 
 		clamp = info['clamp']
-		if value != clamp:
-			GLib.idle_add(self._set_setting, key, clamp, False)
+		if value != clamp and (init or not self._in_feedback_loop(key)):
+			self._queue_write(key, clamp)
+
+
+# everything that belongs to one X display: xscreensaver, the
+# org.gnome.ScreenSaver service on the display's session bus, and the
+# listeners for that session
+class DisplaySession(GObject.GObject):
+	__gsignals__ = {
+		'quit': (GObject.SignalFlags.RUN_LAST, None, ())
+	}
+
+	def __init__(self, sl_listener, display=None, bus_address=None, session_id=None, no_dpms=False, use_watcher=False):
+		self._sl_listener = sl_listener
+		# all None for the display, session bus and session of this process
+		self._display = display
+		self._bus_address = bus_address
+		self._session_id = session_id
+		self._no_dpms = no_dpms
+		self._use_watcher = use_watcher
+		self._bus = None
+		self._objs = None
+		self._order = None
+		self._activated = None
+		self._sl_session = None
+		self._sl_session_ids = None
+
+		super(DisplaySession, self).__init__()
+
+	@property
+	def name(self):
+		return self._display or os.environ.get('DISPLAY', '')
+
+	def activate(self):
+		if self._bus_address is not None:
+			LOG.debug("Connecting to session bus for display %s", self.name)
+			flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+			self._bus = Gio.DBusConnection.new_for_address_sync(self._bus_address, flags, None, None)
+
+		# shared by everything that reads or writes screensaver state
+		state = ScreensaverState()
+
+		objs = {
+			'xss_manager': {
+				'obj': XScreenSaverManager(state, self._no_dpms, self._display, self._use_watcher),
+				'signals': [
+					('active-changed', lambda _, a: getobj('gs_service').active_changed(a)),
+					('state-changed', lambda _: getobj('gs_service').state_changed()),
+					('state-changed', lambda _: self._sl_listener.state_changed()),
+					('display-lost', lambda _: self.emit('quit'))
+				]
+			},
+			'gs_service': {
+				'obj': FauxGnomeScreensaverService(state, self._bus, self._display),
+				'signals': [
+					('quit', lambda _: self.emit('quit')),
+					('lock', lambda _, d: getobj('xss_manager').lock(d)),
+					('simulate-user-activity', lambda _, d: getobj('xss_manager').simulate_user_activity(d)),
+					('set-active', lambda _, v, d: getobj('xss_manager').set_active(v, d))
+				]
+			},
+			'gsm_listener': {
+				'obj': GnomeSessionManagerListener(self._bus, self._display),
+				'signals': [
+					('inhibited-changed', lambda _, i: getobj('xss_manager').inhibit() if i else getobj('xss_manager').uninhibit())
+				]
+			}
+		}
+		order = ['gs_service', 'xss_manager', 'gsm_listener']
+
+		# ConsoleKit can only tell us about the session we are running in
+		if self._display is None:
+			objs['ck_listener'] = {
+				'obj': ConsoleKitListener(),
+				'signals': [
+					('lock', lambda _: getobj('xss_manager').lock()),
+					('unlock', lambda _: setattr(getobj('xss_manager'), 'active', False)),
+					('is-active', lambda _: getobj('xss_manager').simulate_user_activity())
+				]
+			}
+			order.append('ck_listener')
+
+		def getobj(k):
+			return objs[k]['obj']
+
+		for k in order:
+			o = objs[k]
+			obj = o['obj']
+			o['ids'] = [obj.connect(s, h) for s, h in o['signals']]
+
+		self._objs = objs
+		self._order = order
+		self._activated = []
+
+		self._sl_session = SystemdLogindSession(state, self._session_id)
+		self._sl_session_ids = [self._sl_session.connect(s, h) for s, h in [
+			('lock', lambda _: getobj('xss_manager').lock()),
+			('unlock', lambda _: setattr(getobj('xss_manager'), 'active', False)),
+			('is-active', lambda _: getobj('xss_manager').simulate_user_activity())
+		]]
+		self._sl_listener.add_session(self._sl_session)
+
+		try:
+			for k in order:
+				started = time.monotonic()
+				getobj(k).activate()
+				self._activated.append(k)
+				LOG.debug("Activated %s for display %s in %.1f ms", k, self.name, (time.monotonic() - started) * 1000)
+		except:
+			self.deactivate()
+			raise
+
+	def deactivate(self):
+		if self._sl_session is not None:
+			self._sl_listener.remove_session(self._sl_session)
+			for h in self._sl_session_ids:
+				self._sl_session.disconnect(h)
+
+		if self._objs is not None:
+			for k in reversed(self._activated):
+				self._objs[k]['obj'].deactivate()
+
+			for k in reversed(self._order):
+				o = self._objs[k]
+				for h in o['ids']:
+					o['obj'].disconnect(h)
+
+		if self._bus is not None:
+			self._bus.close_sync(None)
+
+		self._bus = None
+		self._objs = None
+		self._order = None
+		self._activated = None
+		self._sl_session = None
+		self._sl_session_ids = None
+
+	def prepare_for_sleep(self, active):
+		if self._objs is not None:
+			self._objs['xss_manager']['obj'].prepare_for_sleep(active)
+
+
+# one display per line, as DISPLAY DBUS_SESSION_BUS_ADDRESS XDG_SESSION_ID
+def read_displays(path):
+	displays = []
+	with open(path) as f:
+		for number, line in enumerate(f, 1):
+			line = line.strip()
+			if not line or line.startswith('#'):
+				continue
+			fields = line.split()
+			if len(fields) != 3:
+				raise ValueError("line %d should be DISPLAY DBUS_SESSION_BUS_ADDRESS XDG_SESSION_ID" % number)
+			displays.append(tuple(fields))
+	return displays
 
 
 def main(argv):
@@ -722,13 +3038,44 @@ def main(argv):
 	parser.add_option('--no-daemon', action='store_true', dest='no_daemon', default=False, help="Don't become a daemon (not implemented)")
 	parser.add_option('--debug', action='store_true', dest='debug', default=False, help="Enable debugging code")
 	parser.add_option('--no-dpms', action='store_true', dest='no_dpms', default=False, help="Don't manage DPMS (Energy Star) features")
+	parser.add_option('--use-watcher', action='store_true', dest='use_watcher', default=False, help="Follow xscreensaver through xscreensaver-command -watch even when the X display can be watched directly")
+	parser.add_option('--journal', action='store_true', dest='journal', default=False, help="Log to the systemd journal with structured fields (default when stderr is the journal)")
+	parser.add_option('--supervise', dest='supervise', help="Manage every display listed in FILE, one per line as DISPLAY DBUS_SESSION_BUS_ADDRESS XDG_SESSION_ID, instead of $DISPLAY", metavar='FILE')
+	parser.add_option('--record', dest='record', help="Record every input (watcher lines, D-Bus calls and signals, settings changes) to FILE, for bench/faux-gnome-screensaver-replay.py; not with --supervise", metavar='FILE')
+	parser.add_option('--metrics-file', action='store_true', dest='metrics_file', default=False, help="Write Prometheus metrics to $XDG_RUNTIME_DIR/faux-gnome-screensaver-SESSION.prom, SESSION being $XDG_SESSION_ID or the display; with --supervise, one file per display and faux-gnome-screensaver-supervisor.prom")
 
 	options, args = parser.parse_args()
 
 	logging_level = logging.DEBUG if options.debug else logging.INFO
-	logging.basicConfig(format=LOG_FORMAT, level=logging_level)
+	use_journal = options.journal or JournalHandler.stderr_is_journal()
+	if use_journal and JournalHandler.available():
+		logging.basicConfig(level=logging_level, handlers=[JournalHandler(LOG.name)])
+	else:
+		logging.basicConfig(format=LOG_FORMAT, level=logging_level)
+		if options.journal:
+			LOG.warning("Cannot find %s, logging to stderr", JournalHandler.SOCKET_PATH)
+
+	# a recording has no display in it, and is replayed against one
+	if options.record and options.supervise:
+		LOG.error("--record cannot be used with --supervise, a recording is of one display")
+		return 1
+
+	displays = None
+	if options.supervise:
+		try:
+			displays = read_displays(options.supervise)
+		except (IOError, ValueError) as err:
+			LOG.error("Cannot read displays from %s: %s", options.supervise, err)
+			return 1
+
+	if options.record:
+		try:
+			RECORDER.open(options.record)
+		except (IOError, OSError) as err:
+			LOG.error("Cannot record to %s: %s", options.record, err)
+			return 1
+		LOG.debug("Recording inputs to %s", options.record)
 
-	DBusGMainLoop(set_as_default=True)
 	mainloop = GLib.MainLoop()
 
 	def quit(signum=None):
@@ -741,69 +3088,108 @@ def main(argv):
 	sighup_id = GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGHUP, quit, signal.SIGHUP)
 	sigterm_id = GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, quit, signal.SIGTERM)
 
-	objs = {
-		'gset_manager': {
-			'obj': GSettingsManager(),
-			'signals': []
-		},
-		'xss_manager': {
-			'obj': XScreenSaverManager(options.no_dpms),
-			'signals': [
-				('active-changed', lambda _, a: getobj('gs_service').active_changed(a))
-			]
-		},
-		'gs_service': {
-			'obj': FauxGnomeScreensaverService(),
-			'signals': [
-				('quit', lambda _: quit()),
-				('lock', lambda _: getobj('xss_manager').lock()),
-				('simulate-user-activity', lambda _: getobj('xss_manager').simulate_user_activity()),
-				('set-active', lambda _, v: setattr(getobj('xss_manager'), 'active', v)),
-				('get-active', lambda _: getobj('xss_manager').active),
-				('get-active-time', lambda _: getobj('xss_manager').active_time)
-			]
-		},
-		'gsm_listener': {
-			'obj': GnomeSessionManagerListener(),
-			'signals': [
-				('inhibited-changed', lambda _, i: getobj('xss_manager').inhibit() if i else getobj('xss_manager').uninhibit())
-			]
-		},
-		'ck_listener': {
-			'obj': ConsoleKitListener(),
-			'signals': [
-				('lock', lambda _: getobj('xss_manager').lock()),
-				('unlock', lambda _: setattr(getobj('xss_manager'), 'active', False)),
-				('is-active', lambda _: getobj('xss_manager').simulate_user_activity())
-			]
-		},
-		'sl_listener': {
-			'obj': SystemdLogindListener(),
-			'signals': [
-				('lock', lambda _: getobj('xss_manager').lock()),
-				('unlock', lambda _: setattr(getobj('xss_manager'), 'active', False)),
-				('is-active', lambda _: getobj('xss_manager').simulate_user_activity())
-			]
-		}
-	}
-
-	order = ['gset_manager', 'xss_manager', 'gs_service', 'gsm_listener', 'ck_listener', 'sl_listener']
-
-	def getobj(k):
-		return objs[k]['obj']
-
-	for k in order:
-		o = objs[k]
-		obj = o['obj']
-		ids = []
-		for s, h in o['signals']:
-			ids.append(obj.connect(s, h))
-		o['ids'] = ids
+	def dump_metrics(signum):
+		LOG.info("Received signal %d, dumping metrics:\n%s", signum, METRICS.as_text())
+		return True
 
-	for k in order:
-		getobj(k).activate()
+	sigusr1_id = GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, dump_metrics, signal.SIGUSR1)
+
+	metrics_id = None
+	# display (None for the whole process) -> (path, labels, displays)
+	metrics_files = {}
+	if options.metrics_file:
+		runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+		if runtime_dir:
+			# $XDG_RUNTIME_DIR is shared by all of the user's sessions
+			def metrics_path(key):
+				return os.path.join(runtime_dir, 'faux-gnome-screensaver-%s.prom' % re.sub(r'[^A-Za-z0-9_.-]', '_', key))
+
+			# so that one node exporter can tell sessions apart
+			if displays is None:
+				session_id = os.environ.get('XDG_SESSION_ID', '')
+				display = os.environ.get('DISPLAY', '')
+				metrics_files[None] = (metrics_path(session_id or display.lstrip(':') or str(os.getpid())), (('uid', os.getuid()), ('session', session_id), ('display', display)), None)
+			else:
+				# one file per display, its series already have a display label,
+				# and one for what the displays share
+				for display, bus_address, session_id in displays:
+					metrics_files[display] = (metrics_path(session_id), (('uid', os.getuid()), ('session', session_id)), (display,))
+				metrics_files[None] = (metrics_path('supervisor'), (('uid', os.getuid()),), ('',))
+			metrics_written = [None]
+
+			def write_metrics():
+				if METRICS.version != metrics_written[0]:
+					if all([METRICS.write_file(path, labels, selected) for path, labels, selected in metrics_files.values()]):
+						metrics_written[0] = METRICS.version
+				return True
+
+			LOG.debug("Writing metrics to %s every %d seconds", ', '.join(path for path, labels, selected in metrics_files.values()), Metrics.WRITE_INTERVAL)
+			metrics_id = GLib.timeout_add_seconds(Metrics.WRITE_INTERVAL, write_metrics)
+		else:
+			LOG.warning("XDG_RUNTIME_DIR is not set, not writing metrics")
 
-	LOG.debug("Entering main loop")
+	# stale metrics would look like a live session
+	def remove_metrics_file(display):
+		if display in metrics_files:
+			try:
+				os.remove(metrics_files.pop(display)[0])
+			except OSError:
+				pass
+
+	sl_listener = SystemdLogindListener()
+	gset_manager = GSettingsManager()
+	if displays is None:
+		sessions = [DisplaySession(sl_listener, no_dpms=options.no_dpms, use_watcher=options.use_watcher)]
+	else:
+		sessions = [DisplaySession(sl_listener, display, bus_address, session_id, options.no_dpms, options.use_watcher) for display, bus_address, session_id in displays]
+
+	def display_quit(session):
+		if displays is None:
+			quit()
+			return
+
+		# not from inside the Quit call that asked for it
+		def remove():
+			if session in sessions:
+				LOG.info("Stopping display %s", session.name)
+				session.deactivate()
+				sessions.remove(session)
+				remove_metrics_file(session.name)
+				if not sessions:
+					quit()
+			return False
+
+		GLib.idle_add(remove)
+
+	session_ids = dict((session, session.connect('quit', display_quit)) for session in sessions)
+
+	def prepare_for_sleep(listener, active):
+		for session in sessions:
+			session.prepare_for_sleep(active)
+
+	sleep_id = sl_listener.connect('prepare-for-sleep', prepare_for_sleep)
+
+	# claim the bus names first, calls are answered from provisional state
+	# until xscreensaver is ready
+	for session in list(sessions):
+		started = time.monotonic()
+		try:
+			session.activate()
+		except (GLib.Error, OSError) as err:
+			if displays is None:
+				raise
+			LOG.error("Cannot start display %s: %s", session.name, err)
+			sessions.remove(session)
+			remove_metrics_file(session.name)
+			continue
+		LOG.debug("Activated display %s in %.1f ms", session.name, (time.monotonic() - started) * 1000)
+
+	for k, obj in [('gset_manager', gset_manager), ('sl_listener', sl_listener)]:
+		started = time.monotonic()
+		obj.activate()
+		LOG.debug("Activated %s in %.1f ms", k, (time.monotonic() - started) * 1000)
+
+	LOG.debug("Entering main loop with %d displays (%.1f ms)", len(sessions), startup_ms())
 	try:
 		mainloop.run()
 	except KeyboardInterrupt:
@@ -811,15 +3197,22 @@ def main(argv):
 
 	GLib.source_remove(sighup_id)
 	GLib.source_remove(sigterm_id)
-
-	for k in reversed(order):
-		getobj(k).deactivate()
-
-	for k in reversed(order):
-		o = objs[k]
-		obj = o['obj']
-		for h in o['ids']:
-			obj.disconnect(h)
+	GLib.source_remove(sigusr1_id)
+	if metrics_id is not None:
+		GLib.source_remove(metrics_id)
+		for display in list(metrics_files):
+			remove_metrics_file(display)
+
+	sl_listener.deactivate()
+	gset_manager.deactivate()
+	for session in reversed(sessions):
+		session.deactivate()
+
+	sl_listener.disconnect(sleep_id)
+	for session, h in session_ids.items():
+		session.disconnect(h)
+
+	RECORDER.close()
 
 
 if __name__ == '__main__':